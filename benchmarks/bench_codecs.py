@@ -0,0 +1,63 @@
+"""
+Compares the cache codecs on follower pages and user info of various sizes.
+
+Reports the bytes stored and the time taken to encode and decode each
+payload.
+"""
+
+from common import report, setup_django, timeit, user_dict
+
+setup_django()
+
+import simplejson
+
+from django_oauth_twitter.cache import Codec, CompactJsonCodec, ZlibCodec
+from django_oauth_twitter.utils import (decode_userinfo_json,
+                                        encode_userinfo_json)
+
+
+CODECS = [
+    ('raw', Codec()),
+    ('zlib', ZlibCodec()),
+    ('compact', CompactJsonCodec()),
+    ('zlib+compact', ZlibCodec(codec=CompactJsonCodec())),
+]
+
+
+def bench_responses():
+    rows = []
+    for users in (1, 10, 100, 1000):
+        payload = simplejson.dumps([user_dict(i) for i in range(users)])
+        for name, codec in CODECS:
+            data = codec.encode(payload)
+            encode = timeit(lambda: codec.encode(payload))
+            decode = timeit(lambda: codec.decode(data))
+            rows.append((users, len(payload), name, len(data),
+                         '%.1f' % (100.0 * len(data) / len(payload)),
+                         '%.1f' % (encode * 1e6), '%.1f' % (decode * 1e6)))
+    print 'Cached responses (pages of user info)'
+    report(('users', 'bytes', 'codec', 'stored', '%', 'encode us',
+            'decode us'), rows)
+
+
+def bench_userinfo():
+    from django.conf import settings
+    rows = []
+    payload = simplejson.dumps(user_dict(1), sort_keys=True)
+    for threshold in (None, 0):
+        settings.DJANGO_OAUTH_TWITTER_USERINFO_COMPRESS_THRESHOLD = threshold
+        data = encode_userinfo_json(payload)
+        encode = timeit(lambda: encode_userinfo_json(payload))
+        decode = timeit(lambda: decode_userinfo_json(data))
+        name = threshold is None and 'compact' or 'compact+zlib'
+        rows.append((len(payload), name, len(data),
+                     '%.1f' % (100.0 * len(data) / len(payload)),
+                     '%.1f' % (encode * 1e6), '%.1f' % (decode * 1e6)))
+    print
+    print 'TwitterUser.userinfo_json'
+    report(('bytes', 'codec', 'stored', '%', 'encode us', 'decode us'), rows)
+
+
+if __name__ == '__main__':
+    bench_responses()
+    bench_userinfo()
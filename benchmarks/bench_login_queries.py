@@ -0,0 +1,135 @@
+"""
+Counts the queries of a Twitter login, from signin through two pages.
+
+Compares the views as they were, which looked the User up from the
+TwitterUser and logged them in with ModelBackend, with TwitterBackend.
+Each page shows the screen name of request.user.twitter.  Twitter is
+faked and sessions are kept in the cache, so only the queries for the
+User and their TwitterUser are counted.
+"""
+
+from common import create_tables, report, setup_django
+
+setup_django(
+    ROOT_URLCONF='__main__',
+    SESSION_ENGINE='django.contrib.sessions.backends.cache',
+    MIDDLEWARE_CLASSES=(
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django_oauth_twitter.middleware.SessionMiddleware',
+    ),
+)
+
+from django.conf import settings
+from django.conf.urls.defaults import patterns, url
+from django.contrib.auth import login
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import HttpResponse
+from django.test.client import Client
+
+from oauth.oauth import OAuthToken
+import twitter
+
+import django_oauth_twitter.models
+import django_oauth_twitter.utils
+import django_oauth_twitter.views
+from django_oauth_twitter.models import TwitterUser
+from django_oauth_twitter.views import OAuthTwitter
+
+
+class FakeTwitterApi(object):
+    """Answers the calls of a login, without calling Twitter."""
+
+    def __init__(self, token=None):
+        pass
+
+    def SetCache(self, cache):
+        self._cache = cache
+
+    def getRequestToken(self):
+        return OAuthToken('request', 'secret')
+
+    def getSigninURL(self, token):
+        return 'http://twitter.example/oauth/authenticate'
+
+    def getAccessToken(self):
+        return OAuthToken('access', 'secret')
+
+    def GetUserInfo(self):
+        return twitter.User(id=1, screen_name='twitter')
+
+
+class LegacyOAuthTwitter(OAuthTwitter):
+    """The views as they were, before TwitterBackend."""
+
+    def _authenticate(self, userinfo):
+        try:
+            return TwitterUser.objects.get(twitter_id=userinfo.id).user
+        except TwitterUser.DoesNotExist:
+            return None
+
+    def _login(self, request, user):
+        user.backend = 'django.contrib.auth.backends.ModelBackend'
+        login(request, user)
+
+
+# The views being measured.
+oauthtwitter = None
+
+def page(request):
+    return HttpResponse(request.user.twitter.screen_name)
+
+urlpatterns = patterns('',
+    url(r'^signin/$', lambda request: oauthtwitter.signin(request),
+        name='twitter_signin'),
+    url(r'^callback/$', lambda request: oauthtwitter.callback(request),
+        name='twitter_callback'),
+    url(r'^page/$', page, name='page'),
+)
+
+
+def count_queries(f):
+    """Returns the number of queries made by calling `f`."""
+    connection.queries = []
+    f()
+    return len(connection.queries)
+
+
+def flow():
+    """Returns the query counts of the steps of a login."""
+    client = Client()
+    return [
+        count_queries(lambda: client.get('/signin/?next=/page/')),
+        count_queries(lambda: client.get('/callback/',
+                                         {'oauth_token': 'request'})),
+        count_queries(lambda: client.get('/page/')),
+        count_queries(lambda: client.get('/page/')),
+    ]
+
+
+def main():
+    global oauthtwitter
+    create_tables()
+    user = User.objects.create_user('twitter', '', 'password')
+    TwitterUser.objects.create_twitter_user(
+        user, OAuthToken('access', 'secret'),
+        twitter.User(id=1, screen_name='twitter')
+    )
+    django_oauth_twitter.models.TwitterApi = FakeTwitterApi
+    django_oauth_twitter.views.TwitterApi = FakeTwitterApi
+    django_oauth_twitter.utils.TwitterApi = FakeTwitterApi
+    settings.DEBUG = True
+
+    rows = []
+    for name, views in [('ModelBackend', LegacyOAuthTwitter()),
+                        ('TwitterBackend', OAuthTwitter())]:
+        oauthtwitter = views
+        counts = flow()
+        rows.append([name] + counts + [sum(counts)])
+    report(('backend', 'signin', 'callback', 'page', 'page again', 'total'),
+           rows)
+
+
+if __name__ == '__main__':
+    main()
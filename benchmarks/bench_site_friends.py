@@ -0,0 +1,97 @@
+"""
+Intersects a synthetic 100,000 id follow graph with the TwitterUser table.
+
+Compares a single twitter_id__in query over every id, as
+TwitterUser.get_site_friends() used to do, with
+TwitterUser.iter_site_friends(), which walks pages of 5,000 ids and
+looks them up in bounded chunks.  Runs against SQLite.
+"""
+
+import random
+
+from common import create_tables, report, setup_django, timeit
+
+setup_django()
+
+from django.db import connection, DatabaseError, transaction
+
+from django_oauth_twitter.models import TwitterUser
+
+
+FOLLOWS = 100000
+PAGE_SIZE = 5000
+SITE_USERS = 20000
+
+
+class GraphApi(object):
+    """Serves pages of friend ids, like Twitter's friends/ids."""
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def GetFriendIDs(self, user=None, cursor=-1):
+        if cursor == -1:
+            cursor = 0
+        next_cursor = cursor + PAGE_SIZE
+        if next_cursor >= len(self.ids):
+            next_cursor = 0
+        return {'ids': self.ids[cursor:cursor + PAGE_SIZE],
+                'next_cursor': next_cursor}
+
+
+def populate():
+    """Creates SITE_USERS users, with Twitter ids spread over 1-500,000."""
+    create_tables()
+    random.seed(0)
+    twitter_ids = random.sample(xrange(1, 500001), SITE_USERS)
+    cursor = connection.cursor()
+    cursor.executemany(
+        'INSERT INTO auth_user (id, username, first_name, last_name, email, '
+        'password, is_staff, is_active, is_superuser, last_login, '
+        'date_joined) VALUES (%s, %s, "", "", "", "!", 0, 1, 0, '
+        '"2010-01-01", "2010-01-01")',
+        [(i + 1, 'user%d' % i) for i in xrange(SITE_USERS)]
+    )
+    cursor.executemany(
+        'INSERT INTO django_oauth_twitter_twitteruser '
+        '(user_id, twitter_id, access_token_str, access_token_hash, '
+        'userinfo_json, screen_name, name, profile_image_url) '
+        'VALUES (%s, %s, "", "", "{}", "", "", "")',
+        [(i + 1, twitter_id) for i, twitter_id in enumerate(twitter_ids)]
+    )
+    transaction.commit_unless_managed()
+    return TwitterUser.objects.get(user__id=1)
+
+
+def main():
+    twitter_user = populate()
+    friend_ids = random.sample(xrange(1, 500001), FOLLOWS)
+    twitter_user._api = GraphApi(friend_ids)
+
+    def single_query():
+        return len(TwitterUser.objects.filter(twitter_id__in=friend_ids))
+
+    rows = []
+    try:
+        found = single_query()
+        rows.append(('single IN', found, '%.1f' % (timeit(single_query) *
+                                                   1e3)))
+    except DatabaseError, e:
+        rows.append(('single IN', 'fails', str(e)))
+        transaction.rollback_unless_managed()
+    for chunk_size in (100, 250, 500, 900):
+        def stream():
+            return len(list(twitter_user.iter_site_friends(
+                chunk_size=chunk_size
+            )))
+        found = stream()
+        rows.append(('chunks of %d' % chunk_size, found,
+                     '%.1f' % (timeit(stream, number=3) * 1e3)))
+    print '%d follows, %d site users, pages of %d ids' % (FOLLOWS,
+                                                          SITE_USERS,
+                                                          PAGE_SIZE)
+    report(('lookup', 'site friends', 'ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
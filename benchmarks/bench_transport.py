@@ -0,0 +1,135 @@
+"""
+Counts the connections opened, and times, a login flow over HTTPS.
+
+A login asks Twitter for a request token, exchanges it for an access
+token, then fetches the user info.  Compares urllib2, which opens a
+connection for every request, with the pooled keep-alive Transport.
+The Twitter stub runs on localhost with a throwaway self-signed
+certificate, so openssl must be on the PATH.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import os
+import shutil
+from SocketServer import ThreadingMixIn
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import urllib2
+
+from common import report, setup_django
+
+setup_django()
+
+from django_oauth_twitter.transport import ConnectionPool, Transport
+from django_oauth_twitter.utils import TwitterApi
+
+
+FLOWS = 50
+
+RESPONSES = {
+    '/oauth/request_token': 'oauth_token=r&oauth_token_secret=s',
+    '/oauth/access_token': 'oauth_token=a&oauth_token_secret=b',
+    '/account/verify_credentials.json': '{"id":1,"screen_name":"twitter"}',
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Otherwise the unbuffered headers stall on delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = RESPONSES[self.path.split('?')[0]]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, certfile):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.socket = ssl.wrap_socket(self.socket, certfile=certfile,
+                                      server_side=True)
+        self.connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on idle keep-alive connections.
+        pass
+
+
+class Urllib2(object):
+    """urllib2, trusting the self-signed certificate."""
+    __version__ = urllib2.__version__
+
+    def build_opener(self):
+        context = ssl._create_unverified_context()
+        return urllib2.build_opener(urllib2.HTTPSHandler(context=context))
+
+
+def login(transport, url):
+    api = TwitterApi()
+    api._urllib = transport
+    request_token = api.getRequestToken(url + '/oauth/request_token')
+    api = TwitterApi()
+    # Sign with the token after construction, as some python-twitter
+    # releases refuse OAuthApi's token in Api.__init__().
+    api._access_token = request_token
+    api._urllib = transport
+    access_token = api.getAccessToken(url + '/oauth/access_token')
+    api._access_token = access_token
+    return api.GetUserInfo(url + '/account/verify_credentials.json')
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        certfile = os.path.join(directory, 'stub.pem')
+        subprocess.check_call(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+             '-days', '1', '-subj', '/CN=127.0.0.1',
+             '-keyout', certfile, '-out', certfile],
+            stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT
+        )
+        server = StubServer(certfile)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        url = 'https://127.0.0.1:%d' % server.server_port
+
+        pool = ConnectionPool(
+            timeout=10, ssl_context=ssl._create_unverified_context()
+        )
+        rows = []
+        for name, transport in [('urllib2', Urllib2()),
+                                ('pooled', Transport(pool))]:
+            before = server.connections
+            start = time.time()
+            for i in xrange(FLOWS):
+                login(transport, url)
+            elapsed = time.time() - start
+            rows.append((name,
+                         '%.2f' % (float(server.connections - before) / FLOWS),
+                         '%.2f' % (elapsed / FLOWS * 1e3)))
+        report(('transport', 'connections/login', 'ms/login'), rows)
+        pool.clear()
+        server.shutdown()
+        server.server_close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Times twitter_id__in lookups against 32-bit and 64-bit id columns.
+
+Builds a copy of the TwitterUser id column as an IntegerField, as it
+was, and as a BigIntegerField, as it is now, each with a unique index
+and the same 20,000 ids.  Then looks up pages of 5,000 Twitter ids, half
+of them on the site, ID_CHUNK_SIZE at a time as iter_twitter_ids()
+does.  Current Twitter ids do not fit the 32-bit column, so ids are
+drawn below 2^31 for both.
+
+Runs against SQLite, where both are stored alike, unless
+DJANGO_SETTINGS_MODULE points elsewhere.  The gap shows on backends
+that cast between integer widths to compare ids.
+"""
+
+import random
+
+from common import create_tables, report, setup_django, timeit
+
+setup_django()
+
+from django.db import connection, transaction
+
+from django_oauth_twitter.models import ID_CHUNK_SIZE
+
+
+PAGE_SIZE = 5000
+SITE_USERS = 20000
+
+
+def populate(field, twitter_ids):
+    """Returns a new table of `twitter_ids` in a `field` column."""
+    table = 'bench_twitter_ids_%s' % field.lower()
+    quote = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute('CREATE TABLE %s (id %s PRIMARY KEY, '
+                   'twitter_id %s NOT NULL UNIQUE)' % (
+        quote(table),
+        connection.creation.data_types['AutoField'],
+        connection.creation.data_types[field],
+    ))
+    cursor.executemany(
+        'INSERT INTO %s (id, twitter_id) VALUES (%%s, %%s)' % quote(table),
+        [(i + 1, twitter_id) for i, twitter_id in enumerate(twitter_ids)]
+    )
+    transaction.commit_unless_managed()
+    return table
+
+
+def lookup(table, ids):
+    """Returns the primary keys of the rows of `table` with `ids`."""
+    cursor = connection.cursor()
+    found = []
+    for i in xrange(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[i:i + ID_CHUNK_SIZE]
+        cursor.execute(
+            'SELECT id FROM %s WHERE twitter_id IN (%s)' % (
+                connection.ops.quote_name(table),
+                ', '.join(['%s'] * len(chunk))
+            ),
+            chunk
+        )
+        found.extend(row[0] for row in cursor.fetchall())
+    return found
+
+
+def main():
+    create_tables()
+    random.seed(0)
+    id_range = xrange(10 ** 9, 2 ** 31)
+    twitter_ids = random.sample(id_range, SITE_USERS)
+    page = (random.sample(twitter_ids, PAGE_SIZE // 2) +
+            random.sample(id_range, PAGE_SIZE // 2))
+    random.shuffle(page)
+
+    rows = []
+    for field in ('IntegerField', 'BigIntegerField'):
+        table = populate(field, twitter_ids)
+        found = len(lookup(table, page))
+        rows.append((field, found,
+                     '%.2f' % (timeit(lambda: lookup(table, page)) * 1e3)))
+    report(('column', 'found', 'ms/page'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Times repeated access to the user info of a TwitterUser.
+
+A page render typically touches userinfo(), the screen name and
+__unicode__ several times per TwitterUser.  Compares the first access,
+which parses userinfo_json, with the following ones, which reuse the
+parsed user info.
+"""
+
+from common import report, setup_django, timeit, user_dict
+
+setup_django()
+
+import simplejson
+
+from django_oauth_twitter.models import TwitterUser
+from django_oauth_twitter.utils import encode_userinfo_json
+
+
+def main():
+    json = encode_userinfo_json(simplejson.dumps(user_dict(1)))
+
+    def first_access():
+        # A fresh instance, as loaded from the database.
+        twitter_user = TwitterUser(twitter_id=1, userinfo_json=json)
+        return twitter_user.userinfo()
+
+    twitter_user = TwitterUser(twitter_id=1, userinfo_json=json)
+    twitter_user.userinfo()
+
+    def repeated_access():
+        return twitter_user.userinfo()
+
+    def render():
+        # Five accesses, as in a template showing a profile.
+        twitter_user = TwitterUser(twitter_id=1, userinfo_json=json)
+        for i in range(5):
+            twitter_user.userinfo()
+
+    rows = [('first userinfo()', '%.2f' % (timeit(first_access) * 1e6)),
+            ('repeated userinfo()', '%.2f' % (timeit(repeated_access) * 1e6)),
+            ('render, 5 accesses', '%.2f' % (timeit(render) * 1e6))]
+    report(('access', 'us'), rows)
+
+
+if __name__ == '__main__':
+    main()
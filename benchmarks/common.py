@@ -0,0 +1,110 @@
+"""
+Helpers shared by the django-oauth-twitter benchmarks.
+
+Run a benchmark from the top of the source tree, e.g.:
+
+    python benchmarks/bench_codecs.py
+
+If DJANGO_SETTINGS_MODULE isn't set, Django is configured with an
+in-memory SQLite database and a local-memory cache.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def setup_django(**extra):
+    """Configures Django with minimal settings, plus `extra`."""
+    from django.conf import settings
+    if os.environ.get('DJANGO_SETTINGS_MODULE') or settings.configured:
+        return
+    options = {
+        'DATABASE_ENGINE': 'sqlite3',
+        'DATABASE_NAME': ':memory:',
+        'DATABASES': {'default': {'ENGINE': 'django.db.backends.sqlite3',
+                                  'NAME': ':memory:'}},
+        'CACHE_BACKEND': 'locmem://',
+        'INSTALLED_APPS': ('django.contrib.auth',
+                           'django.contrib.contenttypes',
+                           'django.contrib.sessions',
+                           'django_oauth_twitter'),
+        'TWITTER_CONSUMER_KEY': 'KEY',
+        'TWITTER_CONSUMER_SECRET': 'SECRET',
+    }
+    options.update(extra)
+    settings.configure(**options)
+
+
+def create_tables():
+    """Creates the tables for INSTALLED_APPS."""
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+
+def timeit(f, repeat=3, number=None):
+    """
+    Returns the best time, in seconds, taken by a single call to `f`.
+
+    If `number` is None, calls `f` enough times for each of the
+    `repeat` measurements to take at least 0.05 seconds.
+    """
+    if number is None:
+        number = 1
+        while True:
+            start = time.time()
+            for i in xrange(number):
+                f()
+            if time.time() - start >= 0.05:
+                break
+            number *= 10
+    best = None
+    for r in xrange(repeat):
+        start = time.time()
+        for i in xrange(number):
+            f()
+        elapsed = (time.time() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def user_dict(i):
+    """Returns a dictionary resembling Twitter user info for user `i`."""
+    return {
+        'id': 10000000 + i,
+        'screen_name': 'user%d' % i,
+        'name': 'User Number %d' % i,
+        'description': 'Just another Twitter user, number %d.' % i,
+        'location': 'Montreal, QC',
+        'url': 'http://example.com/user%d' % i,
+        'profile_image_url': ('http://a1.twimg.com/profile_images/%d/'
+                              'avatar_normal.png' % i),
+        'profile_background_color': '9ae4e8',
+        'profile_text_color': '000000',
+        'profile_link_color': '0000ff',
+        'profile_sidebar_fill_color': 'e0ff92',
+        'profile_sidebar_border_color': '87bc44',
+        'followers_count': i * 7 % 5000,
+        'friends_count': i * 13 % 2000,
+        'statuses_count': i * 31 % 10000,
+        'favourites_count': i % 100,
+        'utc_offset': -18000,
+        'time_zone': 'Eastern Time (US & Canada)',
+        'protected': False,
+        'status': {'id': 5000000000 + i,
+                   'text': 'Status update number %d from user%d' % (i, i),
+                   'created_at': 'Mon Jan 04 15:00:00 +0000 2010',
+                   'source': 'web'},
+    }
+
+
+def report(header, rows):
+    """Prints `rows` as a table under `header`."""
+    widths = [max(len(str(row[i])) for row in [header] + rows)
+              for i in range(len(header))]
+    for row in [header] + rows:
+        print '  '.join(str(cell).rjust(width)
+                        for cell, width in zip(row, widths))
@@ -2,3 +2,5 @@ ACCESS_KEY = 'twitter_access_token'
 REQUEST_KEY = 'twitter_request_token'
 SUCCESS_URL_KEY = 'twitter_success_url'
 USERINFO_KEY = 'twitter_user_info'
+USERINFO_TIME_KEY = 'twitter_user_info_time'
+USERINFO_TOKEN_KEY = 'twitter_user_info_token'
@@ -3,8 +3,9 @@ from django.contrib import admin
 from django_oauth_twitter.models import TwitterUser
 
 class TwitterUserAdmin(admin.ModelAdmin):
-    list_display = ('user', 'twitter_id', 'screen_name')
-    search_fields = ('user', 'twitter_id')
+    list_display = ('user', 'twitter_id', 'screen_name', 'name')
+    list_select_related = True
+    search_fields = ('user__username', 'twitter_id', 'screen_name', 'name')
     ordering = ('user',)
 
 admin.site.register(TwitterUser, TwitterUserAdmin)
@@ -0,0 +1,109 @@
+"""
+An authentication backend for Users who sign in with Twitter.
+
+OAuthTwitter logs Users in through TwitterBackend, so it need not be
+listed in settings.AUTHENTICATION_BACKENDS.  To authenticate by Twitter
+id elsewhere, list it there and call:
+
+    user = authenticate(twitter_id=userinfo.id)
+"""
+
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from django_oauth_twitter.models import (TwitterUser, user_cache_key,
+                                         user_cache_timeout)
+
+
+# Read from the database even when the User is cached: the password
+# hash must not sit in a shared cache, and deactivating a User with
+# QuerySet.update() sends no signal to drop the cached copy.
+UNCACHED_USER_FIELDS = ('password', 'is_active')
+
+
+class TwitterBackend(ModelBackend):
+    """
+    Authenticates Users by the id of their linked Twitter account.
+
+    A User is loaded together with their TwitterUser, in one query, so
+    that `user.twitter` needs no query of its own.  get_user() caches
+    the pair for user_cache_timeout() seconds, except for the
+    UNCACHED_USER_FIELDS, which are read by primary key each time.
+    Saving or deleting either one drops it from the cache.  Inactive
+    Users are not returned.
+
+    Permissions are checked as ModelBackend does.
+    """
+
+    def authenticate(self, twitter_id=None):
+        if twitter_id is None:
+            return None
+        try:
+            twitter_user = TwitterUser.objects.select_related('user').get(
+                twitter_id=twitter_id
+            )
+        except TwitterUser.DoesNotExist:
+            return None
+        user = twitter_user.user
+        user._twitter_cache = twitter_user
+        return user
+
+    def get_user(self, user_id):
+        timeout = user_cache_timeout()
+        key = user_cache_key(user_id)
+        if timeout:
+            cached = cache.get(key)
+            if cached is not None:
+                return self._load(user_id, *cached)
+        try:
+            twitter_user = TwitterUser.objects.select_related('user').get(
+                user__id=user_id
+            )
+        except TwitterUser.DoesNotExist:
+            # Users who unlinked Twitter stay logged in.
+            try:
+                user = User.objects.get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            twitter_user = None
+        else:
+            user = twitter_user.user
+            user._twitter_cache = twitter_user
+        if not user.is_active:
+            return None
+        if timeout:
+            cache.set(key, (_fields(user, exclude=UNCACHED_USER_FIELDS),
+                            _fields(twitter_user)), timeout)
+        return user
+
+    def _load(self, user_id, user_fields, twitter_fields):
+        """
+        Returns the User cached as `user_fields` and `twitter_fields`,
+        or None if they have since been deleted or deactivated.
+        """
+        rows = User.objects.filter(pk=user_id).values(*UNCACHED_USER_FIELDS)
+        if not rows or not rows[0]['is_active']:
+            return None
+        user_fields = dict(user_fields)
+        user_fields.update(rows[0])
+        user = User(**user_fields)
+        if twitter_fields is not None:
+            twitter_user = TwitterUser(**twitter_fields)
+            twitter_user._user_cache = user
+            user._twitter_cache = twitter_user
+        return user
+
+
+def _fields(instance, exclude=()):
+    """
+    Returns the field values of the model `instance`, or None.
+
+    Model instances carry caches, such as TwitterUser.api(), that must
+    not be stored, so only their fields are cached, less `exclude`.
+    """
+    if instance is None:
+        return None
+    return dict((f.attname, getattr(instance, f.attname))
+                for f in instance._meta.fields if f.attname not in exclude)
@@ -35,7 +35,24 @@ To use with oauth-python-twitter
 """
 
 
+from hashlib import sha1
+import re
+import threading
+import time
+from uuid import uuid4
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 from django.core.cache import cache
+from django.utils.functional import update_wrapper
+import simplejson
+
+from django_oauth_twitter.instrumentation import endpoint
+from django_oauth_twitter.signals import twitter_cache_lookup
 
 
 class DjangoCachedApi(object):
@@ -47,7 +64,9 @@ class DjangoCachedApi(object):
         api.GetPublicTimeline()
     """
 
-    def __init__(self, api, cache_timeout=None, cache_backend=None):
+    def __init__(self, api, cache_timeout=None, cache_backend=None,
+                 stale_timeout=None, lock_wait=None, local_cache=None,
+                 codec=None, policy=None, keys=None):
         """
         Wrap twitter.Api so it uses the Django cache framework.
 
@@ -58,15 +77,45 @@ class DjangoCachedApi(object):
 
         `cache_backend` is the Django cache backend.  Defaults to
         Django's CACHE_BACKEND.
+
+        `stale_timeout` is how long, in seconds, an expired response may
+        still be served while it is being refreshed.  See DjangoCache.
+
+        `lock_wait` is how long, in seconds, to wait for another process
+        to fetch a missing response, instead of fetching it again.  See
+        DjangoCache.
+
+        `local_cache` is a LocalCache consulted before `cache_backend`.
+        Defaults to None, where every lookup goes to `cache_backend`.
+
+        `codec` encodes responses stored in `cache_backend`, such as a
+        ZlibCodec.  Defaults to storing responses as they are.
+
+        `policy` is a CachePolicy that overrides `cache_timeout` for
+        some API methods or URLs.
+
+        `keys` is a CacheKeys that namespaces and versions the keys of
+        the responses.  Defaults to keying responses by URL.
         """
         self.api = api
         if cache_timeout is None:
             cache_timeout = api._cache_timeout
-        self.api.SetCache(DjangoCache(cache_timeout, cache_backend))
+        self.api.SetCache(DjangoCache(cache_timeout, cache_backend,
+                                      stale_timeout=stale_timeout,
+                                      lock_wait=lock_wait,
+                                      local_cache=local_cache,
+                                      codec=codec,
+                                      policy=policy,
+                                      keys=keys))
 
     def __getattr__(self, name):
         # Passthrough for attribute resolution to self.api
-        return getattr(self.api, name)
+        value = getattr(self.api, name)
+        cache = self.api._cache
+        if cache.policy is not None and name in cache.policy.methods:
+            # Let the cache know which method is fetching URLs.
+            value = cache.calling(name, value)
+        return value
 
     def __setattr__(self, name, value):
         # Passthrough for attribute resolution to self.api
@@ -97,9 +146,50 @@ class DjangoCachedApi(object):
 
 
 class DjangoCache(object):
-    """Wrap the Django cache framework so it implements twitter._FileCache."""
+    """
+    Wrap the Django cache framework so it implements twitter._FileCache.
+
+    Entries are stored along with the time at which they go stale,
+    `cache_timeout` seconds after being set.  If `stale_timeout` is
+    set, a stale entry is kept for that many more seconds: the first
+    caller to see it stale is told it is missing, so that it fetches
+    a fresh copy, while every other caller is served the stale value
+    in the meantime.  Only once an entry is `cache_timeout +
+    stale_timeout` seconds old must callers wait for Twitter.
+
+    If `lock_wait` is set, only one caller at a time, across every
+    process sharing the cache backend, is told that a missing entry
+    must be fetched.  The others wait up to `lock_wait` seconds for it
+    to show up in the cache, before giving up and fetching it too.
+
+    If `local_cache` is set, entries are also kept in that LocalCache,
+    which is looked up before the cache backend.
+
+    If `codec` is set, values are encoded by that Codec before being
+    stored in the cache backend.
+
+    If `policy` is set, its CachePolicy picks the `cache_timeout` of
+    each entry.
+
+    If `keys` is set, its CacheKeys maps keys to the keys of the cache
+    backend, and decides which entries have been invalidated.  Entries
+    of the previous version of the keys are served as stale entries.
+
+    A DjangoCache may be shared by several threads: each thread's
+    `Get(key)` returns the entry found by its own `GetCachedTime(key)`.
+    """
+
+    # Maximum time, in seconds, that a single caller may spend
+    # fetching an entry before another caller may try.
+    LOCK_TIMEOUT = 30
 
-    def __init__(self, cache_timeout, cache_backend=None):
+    # Time, in seconds, between checks for an entry being fetched by
+    # another caller.
+    LOCK_POLL_INTERVAL = 0.05
+
+    def __init__(self, cache_timeout, cache_backend=None, stale_timeout=None,
+                 lock_wait=None, local_cache=None, codec=None, policy=None,
+                 keys=None):
         """
         Wraps the Django cache framework.
 
@@ -107,13 +197,53 @@ class DjangoCache(object):
 
         `cache_backend` is the Django cache backend.  Defaults to
         Django's CACHE_BACKEND.
+
+        `stale_timeout` is the time, in seconds, that a stale entry
+        may still be served while it is being refreshed.  Defaults to
+        None, where entries are discarded as soon as they go stale.
+
+        `lock_wait` is the time, in seconds, to wait for another
+        caller to fetch a missing entry.  Defaults to None, where every
+        caller fetches missing entries on its own.
+
+        `local_cache` is a LocalCache, usually shared by the whole
+        process, that is looked up before `cache_backend`.  Defaults to
+        None.
+
+        `codec` is the Codec used to encode values in `cache_backend`.
+        Defaults to storing values as they are.
+
+        `policy` is a CachePolicy that overrides `cache_timeout` for
+        some keys.  Defaults to None, where every entry uses
+        `cache_timeout`.
+
+        `keys` is a CacheKeys.  Defaults to None, where entries are
+        stored under their own keys.
         """
         self.cache_timeout = cache_timeout
+        self.stale_timeout = stale_timeout
+        self.lock_wait = lock_wait
+        self.local_cache = local_cache
+        if codec is None:
+            codec = Codec()
+        self.codec = codec
+        self.policy = policy
+        self.keys = keys
         if cache_backend is None:
             self._cache = cache
         else:
             self._cache = cache_backend
-        self._data = (None, None)
+        # The entry looked up by GetCachedTime() is kept per thread, so
+        # that threads sharing an API object don't see each other's.
+        self._local = threading.local()
+
+    def _get_data(self):
+        return getattr(self._local, 'data', (None, None))
+
+    def _set_data(self, value):
+        self._local.data = value
+
+    _data = property(_get_data, _set_data)
 
     def Get(self, key):
         """Returns the value of `key` from the cache, or None if missing."""
@@ -127,27 +257,587 @@ class DjangoCache(object):
 
     def Set(self, key, data):
         """Set the cached value of `key` as `data`."""
-        return self._cache.set(key, data, self.cache_timeout)
+        timeout = self._timeout(key)
+        if not timeout:
+            return
+        stale_at = time.time() + timeout
+        if self.stale_timeout:
+            timeout += self.stale_timeout
+        entry = (stale_at, self.codec.encode(data))
+        if self.keys is not None:
+            # Record the generation seen before the data was fetched, so
+            # that an invalidation since then discards it.
+            generation = getattr(self._local, 'generation', None)
+            if generation is None:
+                generation = self.keys.generation(self._cache)
+            self._local.generation = None
+            entry += (generation,)
+        backend_key = self._backend_key(key)
+        result = self._cache.set(backend_key, entry, timeout)
+        if self.local_cache is not None:
+            self.local_cache.set(backend_key, (stale_at, data), _sizeof(data))
+        if self.stale_timeout or self.lock_wait:
+            # Let the next caller fetch this entry once it goes stale.
+            self._unlock(key)
+        return result
 
     def Remove(self, key, data):
         """Removes the cached value of `key`."""
-        return self._cache.delete(key)
+        backend_key = self._backend_key(key)
+        if self.local_cache is not None:
+            self.local_cache.delete(backend_key)
+        return self._cache.delete(backend_key)
 
     def GetCachedTime(self, key):
         """Returns infinity is `key` is in the cache.  -Infinity if missing."""
-        value = self._cache.get(key)
-        if value is None:
+        if not self._timeout(key):
+            # Never cached.
             self._data = (None, None)
+            return float('-inf')
+        start = time.time()
+        result = self._get_cached(key)
+        value = self._data[1]
+        size = None
+        if isinstance(value, basestring):
+            size = len(value)
+        twitter_cache_lookup.send_robust(sender=DjangoCache,
+                                         endpoint=endpoint(_key_url(key)),
+                                         latency=time.time() - start,
+                                         result=result, bytes=size)
+        if result == 'miss':
             # Force _FetchUrl() to always compute a new result.
             return float('-inf')
+        # Force _FetchUrl() to never compute a new result.
+        return float('inf')
+
+    def _get_cached(self, key):
+        """
+        Looks `key` up, and returns 'hit', 'stale' or 'miss'.
+
+        The value found, if any, is kept in `self._data`.
+        """
+        previous = False
+        entry = self._get_local(key)
+        if entry is None:
+            entry, previous_entry = self._read(key)
+            if entry is None and previous_entry is not None:
+                entry, previous = previous_entry, True
+            if entry is None and self.lock_wait:
+                entry = self._wait_for(key)
+            if entry is not None:
+                stale_at, data = entry
+                entry = (stale_at, self.codec.decode(data))
+                if self.local_cache is not None and not previous:
+                    self.local_cache.set(self._backend_key(key), entry,
+                                         _sizeof(entry[1]))
+        if entry is None or self._needs_refresh(key, entry, previous):
+            self._data = (None, None)
+            return 'miss'
+        stale_at, value = entry
         # `key` was found in cache and it is stored in `self._data` so
         # that `Get(key)` will return this result.  If this didn't
         # happen, there might be a race where _FetchUrl() will see
         # that the `key` is in the cache but it expired before it
         # could actually perform the `Get(key)`.
         self._data = (key, value)
-        # Force _FetchUrl() to never compute a new result.
-        return float('inf')
+        if previous or stale_at <= time.time():
+            return 'stale'
+        return 'hit'
+
+    def calling(self, method, f):
+        """
+        Returns `f`, wrapped so that the URLs it fetches are cached as
+        those of the API `method`, according to the CachePolicy.
+        """
+        def wrapper(*args, **kwargs):
+            previous = getattr(self._local, 'method', None)
+            self._local.method = method
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self._local.method = previous
+        return update_wrapper(wrapper, f)
+
+    def _timeout(self, key):
+        """Returns the cache timeout, in seconds, of `key`."""
+        if self.policy is None:
+            return self.cache_timeout
+        return self.policy.timeout(key,
+                                   method=getattr(self._local, 'method', None),
+                                   default=self.cache_timeout)
+
+    def _backend_key(self, key):
+        """Returns the key of `key` in the cache backend."""
+        if self.keys is None:
+            return key
+        return self.keys.key(key)
+
+    def _read(self, key):
+        """
+        Returns (entry, previous entry) for `key` in the cache backend.
+
+        The previous entry is the valid entry of the previous version
+        of the keys, if any.  Either one may be None.  With CacheKeys,
+        the entries and generation counters are read in one round trip.
+        Values that are not entries, such as those stored by earlier
+        versions, are treated as missing.
+        """
+        if self.keys is None:
+            entry = self._cache.get(key)
+            if not isinstance(entry, tuple) or len(entry) != 2:
+                entry = None
+            return entry, None
+        backend_key = self.keys.key(key)
+        previous_key = self.keys.previous_key(key)
+        names = [backend_key] + self.keys.counter_keys()
+        if previous_key is not None:
+            names.append(previous_key)
+        found = self._cache.get_many(names)
+        generation = self.keys.generation(self._cache, found)
+        self._local.generation = generation
+        entry = self.keys.valid(found.get(backend_key), generation)
+        previous = None
+        if entry is None and previous_key is not None:
+            previous = self.keys.valid(found.get(previous_key), generation)
+        return entry, previous
+
+    def _get_local(self, key):
+        """Returns the fresh entry for `key` in the LocalCache, or None."""
+        if self.local_cache is None:
+            return None
+        entry = self.local_cache.get(self._backend_key(key))
+        if entry is not None and time.time() >= entry[0]:
+            # Another process may already have refreshed this entry.
+            return None
+        return entry
+
+    def _needs_refresh(self, key, entry, previous=False):
+        """
+        Returns True if the caller should refresh the stale `entry`.
+
+        Only the caller holding the lock on `key` is asked to refresh
+        an entry.  Everybody else is served the stale entry until it is
+        replaced.  An entry of the `previous` version of the keys is
+        always stale.
+        """
+        if previous:
+            return self._lock(key)
+        stale_at, value = entry
+        if time.time() < stale_at:
+            return False
+        if not self.stale_timeout:
+            return True
+        return self._lock(key)
+
+    def _wait_for(self, key):
+        """
+        Returns the entry for `key` once another caller has fetched it.
+
+        Returns None if the caller should fetch the entry itself: when
+        it acquired the lock on `key`, or when waiting timed out.
+        """
+        if self._lock(key):
+            return None
+        deadline = time.time() + self.lock_wait
+        while time.time() < deadline:
+            time.sleep(self.LOCK_POLL_INTERVAL)
+            entry = self._read(key)[0]
+            if entry is not None:
+                return entry
+        return None
+
+    def _lock(self, key):
+        """Returns True if the caller acquired the lock on `key`."""
+        # add() is atomic in every Django cache backend, so only one
+        # caller can succeed until the lock is deleted or times out.
+        return self._cache.add(self._lock_key(key), True, self.LOCK_TIMEOUT)
+
+    def _unlock(self, key):
+        self._cache.delete(self._lock_key(key))
+
+    def _lock_key(self, key):
+        return '%s:lock' % self._backend_key(key)
+
+
+class CacheKeys(object):
+    """
+    Namespaces and versions the keys of DjangoCache entries.
+
+    python-twitter keys responses by URL.  CacheKeys stores them under
+    keys made of a `version`, a `namespace`, such as the digest of the
+    access token making the calls, and a digest of the URL:
+
+        keys = CacheKeys(namespace=token_digest(token), version=2)
+        api = DjangoCachedApi(OAuthApi(...), keys=keys)
+
+    Entries record the generations of the whole cache and of their
+    namespace when they were stored.  invalidate() and invalidate_all()
+    start new generations, which discards every older entry at once,
+    whatever its key.  The generations are read along with each entry.
+
+    Bumping `version`, such as on a deploy that changes responses,
+    moves entries to new keys.  The entries of the previous version are
+    then served as stale while each is refreshed by a single caller,
+    instead of every caller fetching from Twitter at once.
+    """
+    PREFIX = 'django_oauth_twitter:api'
+
+    # Time, in seconds, that generation counters are kept.  It should
+    # exceed every cache timeout.
+    COUNTER_TIMEOUT = 30 * 24 * 60 * 60
+
+    def __init__(self, namespace=None, version=1):
+        """
+        `namespace` is a string without spaces, or None for entries
+        shared by everyone.
+
+        `version` is an integer.
+        """
+        self.namespace = namespace
+        self.version = version
+
+    def key(self, key, version=None):
+        """Returns the key of the cache backend for `key`."""
+        if version is None:
+            version = self.version
+        return '%s:%s:%s:%s' % (self.PREFIX, version, self.namespace or '',
+                                sha1(key).hexdigest())
+
+    def previous_key(self, key):
+        """Returns the key of the previous version of `key`, or None."""
+        if self.version <= 1:
+            return None
+        return self.key(key, self.version - 1)
+
+    def counter_keys(self):
+        """Returns the keys of the generation counters of entries."""
+        keys = [self._counter_key(None)]
+        if self.namespace is not None:
+            keys.append(self._counter_key(self.namespace))
+        return keys
+
+    def generation(self, cache_backend, found=None):
+        """
+        Returns the current generation of entries in `cache_backend`.
+
+        `found` is a dictionary of the counters already read from
+        `cache_backend`.  Missing counters are started.
+        """
+        if found is None:
+            found = cache_backend.get_many(self.counter_keys())
+        return tuple(found.get(key) or self._start(cache_backend, key)
+                     for key in self.counter_keys())
+
+    def valid(self, entry, generation):
+        """
+        Returns `entry` without its generation, or None if it is missing
+        or was stored before `generation`.
+        """
+        if (not isinstance(entry, tuple) or len(entry) != 3 or
+            entry[2] != generation):
+            return None
+        return entry[:2]
+
+    def invalidate(self, cache_backend=None):
+        """
+        Discards every entry of this namespace, or of every namespace if
+        it is None.
+        """
+        self._bump(cache_backend, self._counter_key(self.namespace))
+
+    def invalidate_all(self, cache_backend=None):
+        """Discards every entry of every namespace."""
+        self._bump(cache_backend, self._counter_key(None))
+
+    def _counter_key(self, namespace):
+        return '%s:generation:%s' % (self.PREFIX, namespace or '')
+
+    def _start(self, cache_backend, counter_key):
+        # Generations are random, rather than counted, so that a
+        # counter that was evicted never comes back to an old value.
+        generation = uuid4().hex
+        if not cache_backend.add(counter_key, generation,
+                                 self.COUNTER_TIMEOUT):
+            generation = cache_backend.get(counter_key) or generation
+        return generation
+
+    def _bump(self, cache_backend, counter_key):
+        if cache_backend is None:
+            cache_backend = cache
+        cache_backend.set(counter_key, uuid4().hex, self.COUNTER_TIMEOUT)
+
+
+class CachePolicy(object):
+    """
+    Picks the cache timeout of API responses by method name or URL.
+
+        policy = CachePolicy(
+            methods={'GetUserInfo': 3600},
+            urls=[(r'/users/show', 3600),
+                  (r'/statuses/home_timeline', 60),
+                  (r'/direct_messages', 0)],
+        )
+        api = DjangoCachedApi(twitter.Api(), policy=policy)
+
+    A timeout of 0 means that the response is never cached.
+    """
+
+    def __init__(self, methods=None, urls=()):
+        """
+        `methods` is a dictionary mapping API method names, such as
+        'GetUserInfo', to cache timeouts in seconds.
+
+        `urls` is a sequence of (pattern, timeout) pairs, where
+        `pattern` is a regular expression searched for in the cache
+        key, which contains the URL.  The first match wins.
+
+        Methods take precedence over URLs.
+        """
+        if methods is None:
+            methods = {}
+        self.methods = dict(methods)
+        self.urls = [(re.compile(pattern), timeout)
+                     for pattern, timeout in urls]
+
+    def timeout(self, key, method=None, default=None):
+        """
+        Returns the cache timeout of `key`, fetched by the API `method`.
+
+        Returns `default` if no rule matches.
+        """
+        if method in self.methods:
+            return self.methods[method]
+        for pattern, timeout in self.urls:
+            if pattern.search(key):
+                return timeout
+        return default
+
+
+class Codec(object):
+    """
+    Encodes values stored in the cache backend by DjangoCache.
+
+    This codec stores values as they are.  Subclasses prefix encoded
+    strings with a tag byte, so that they can tell apart the values
+    that they encoded from those stored before they were in use.
+    """
+
+    def encode(self, value):
+        """Returns `value` encoded for the cache backend."""
+        return value
+
+    def decode(self, data):
+        """Returns the value encoded as `data`."""
+        return data
+
+
+class ZlibCodec(Codec):
+    """
+    Compresses strings of at least `threshold` bytes with zlib.
+
+    If `codec` is provided, values are encoded by it before being
+    compressed.
+    """
+    RAW = '\x00'
+    ZLIB = '\x01'
+
+    def __init__(self, threshold=1024, level=6, codec=None):
+        """
+        `threshold` is the size, in bytes, of the smallest string to
+        compress.
+
+        `level` is the zlib compression level, from 1 (fastest) to 9
+        (smallest).
+
+        `codec` is a Codec applied before compression.
+        """
+        self.threshold = threshold
+        self.level = level
+        if codec is None:
+            codec = Codec()
+        self.codec = codec
+
+    def encode(self, value):
+        data = self.codec.encode(value)
+        if not isinstance(data, str):
+            return data
+        if len(data) < self.threshold:
+            return self.RAW + data
+        return self.ZLIB + zlib.compress(data, self.level)
+
+    def decode(self, data):
+        if isinstance(data, str) and data:
+            tag = data[0]
+            if tag == self.ZLIB:
+                data = zlib.decompress(data[1:])
+            elif tag == self.RAW:
+                data = data[1:]
+        return self.codec.decode(data)
+
+
+class CompactJsonCodec(Codec):
+    """
+    Strips whitespace from JSON responses.
+
+    Stored responses are equivalent, but not byte-for-byte identical,
+    to the original responses, and need no decoding.  Responses that
+    aren't JSON are stored as they are.
+    """
+
+    def encode(self, value):
+        if not isinstance(value, basestring):
+            return value
+        try:
+            return simplejson.dumps(simplejson.loads(value),
+                                    separators=(',', ':'))
+        except ValueError:
+            return value
+
+
+class LocalCache(object):
+    """
+    Bounded, thread-safe, least-recently-used in-process cache.
+
+    Entries expire `timeout` seconds after being set, and the least
+    recently used entries are evicted to keep the total size of the
+    values under `max_bytes`.  `hits`, `misses` and `evictions` count
+    lookups, so that the cache can be sized.
+
+    Share a single LocalCache per process between DjangoCache
+    instances:
+
+        local_cache = LocalCache(max_bytes=1024 * 1024, timeout=5)
+        api = DjangoCachedApi(twitter.Api(), local_cache=local_cache)
+    """
+
+    def __init__(self, max_bytes, timeout):
+        """
+        `max_bytes` is the maximum total size of the cached values.
+
+        `timeout` is the time, in seconds, that entries are kept.
+        """
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Removes every entry and resets the counters."""
+        self._lock.acquire()
+        try:
+            # Entries are [prev, next, key, value, expires, size] nodes
+            # of a circular doubly-linked list, from least to most
+            # recently used.
+            self._root = root = []
+            root[:] = [root, root, None, None, None, 0]
+            self._map = {}
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+        finally:
+            self._lock.release()
+
+    def get(self, key):
+        """Returns the value of `key`, or None if missing or expired."""
+        self._lock.acquire()
+        try:
+            node = self._map.get(key)
+            if node is None:
+                self.misses += 1
+                return None
+            if time.time() >= node[4]:
+                self._remove(node)
+                self.misses += 1
+                return None
+            self._unlink(node)
+            self._append(node)
+            self.hits += 1
+            return node[3]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, size):
+        """
+        Sets the value of `key` as `value`, which is `size` bytes.
+
+        Values larger than `max_bytes` are not cached.
+        """
+        self._lock.acquire()
+        try:
+            node = self._map.get(key)
+            if node is not None:
+                self._remove(node)
+            if size > self.max_bytes:
+                return
+            while self.bytes + size > self.max_bytes:
+                self._remove(self._root[1])
+                self.evictions += 1
+            node = [None, None, key, value, time.time() + self.timeout, size]
+            self._append(node)
+            self._map[key] = node
+            self.bytes += size
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        """Removes `key`."""
+        self._lock.acquire()
+        try:
+            node = self._map.get(key)
+            if node is not None:
+                self._remove(node)
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """Returns a dictionary of counters describing the cache."""
+        self._lock.acquire()
+        try:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'items': len(self._map),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes}
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._map)
+
+    def _append(self, node):
+        root = self._root
+        last = root[0]
+        node[0], node[1] = last, root
+        last[1] = root[0] = node
+
+    def _unlink(self, node):
+        prev, next = node[0], node[1]
+        prev[1], next[0] = next, prev
+
+    def _remove(self, node):
+        self._unlink(node)
+        del self._map[node[2]]
+        self.bytes -= node[5]
+
+
+def _key_url(key):
+    """
+    Returns the URL of the python-twitter cache `key`, without the
+    '<username>:' or '<consumer key>:' that python-twitter prefixes it
+    with.
+    """
+    match = re.search(r'https?://', key)
+    if match is None:
+        return key
+    return key[match.start():]
+
+def _sizeof(value):
+    """Returns the approximate size, in bytes, of a cached `value`."""
+    if isinstance(value, basestring):
+        return len(value)
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
 
 
 class DjangoCacheError(Exception):
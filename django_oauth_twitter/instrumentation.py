@@ -0,0 +1,236 @@
+"""
+Aggregates the instrumentation signals sent for calls to Twitter.
+
+Every HTTP request, API call and cache lookup sends one of the signals
+in django_oauth_twitter.signals.  An Aggregator receives them, and
+keeps counts and recent latencies for each endpoint or API method:
+
+    aggregator = Aggregator()
+    aggregator.connect()
+    ...
+    for (kind, name), stats in aggregator.stats():
+        print kind, name, stats['p99']
+
+With settings.DJANGO_OAUTH_TWITTER_INSTRUMENT set to True, each
+process connects default_aggregator(), which publishes what it has
+seen to the Django cache.  The twitter_call_stats management command
+reports on the calls of every process.
+"""
+
+
+from collections import deque
+import math
+import os
+import re
+import socket
+import threading
+import time
+from urlparse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+
+from django_oauth_twitter.signals import (twitter_cache_lookup, twitter_call,
+                                          twitter_request)
+
+
+# Event kinds, by signal.
+KINDS = ((twitter_request, 'request'),
+         (twitter_call, 'call'),
+         (twitter_cache_lookup, 'cache'))
+_KIND_OF = dict(KINDS)
+
+PERCENTILES = (50, 90, 99)
+
+
+def endpoint(url):
+    """
+    Returns the endpoint of `url`: its path, with numbers replaced by
+    ':id', so that calls about different users are counted together.
+    """
+    return re.sub(r'\d+', ':id', urlsplit(url)[2])
+
+
+class Aggregator(object):
+    """
+    Keeps counts, and the latencies of the last `sample_size` events,
+    of each endpoint or API method.
+
+    If `publish_interval` is set, the aggregate is published to
+    `cache_backend` at most once every that many seconds, as events are
+    received.  published() merges what every process has published.
+    """
+
+    def __init__(self, sample_size=1000, publish_interval=None,
+                 cache_backend=None,
+                 key_prefix='django_oauth_twitter:instrumentation'):
+        self.sample_size = sample_size
+        self.publish_interval = publish_interval
+        if cache_backend is None:
+            cache_backend = cache
+        self.cache = cache_backend
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._published_at = time.time()
+        self.reset()
+
+    def connect(self):
+        """Starts receiving the instrumentation signals."""
+        for signal, kind in KINDS:
+            signal.connect(self.receive, dispatch_uid=(id(self), kind))
+
+    def disconnect(self):
+        """Stops receiving the instrumentation signals."""
+        for signal, kind in KINDS:
+            signal.disconnect(dispatch_uid=(id(self), kind))
+
+    def reset(self):
+        """Forgets every event."""
+        self._lock.acquire()
+        try:
+            self._entries = {}
+        finally:
+            self._lock.release()
+
+    def receive(self, signal, sender, latency, **kwargs):
+        """Records the event sent by `signal`."""
+        kind = _KIND_OF[signal]
+        name = kwargs.get('endpoint') or kwargs.get('name')
+        status = kwargs.get('status')
+        if kind == 'request':
+            error = status is None or status >= 400
+        else:
+            error = kwargs.get('error') is not None
+        self.record((kind, name), latency, error=error,
+                    retries=kwargs.get('retries') or 0,
+                    bytes=kwargs.get('bytes') or 0,
+                    result=kwargs.get('result'))
+
+    def record(self, key, latency, error=False, retries=0, bytes=0,
+               result=None):
+        """Records an event of `key`, which took `latency` seconds."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    'counts': dict.fromkeys(['count', 'errors', 'retries',
+                                             'bytes'], 0),
+                    'latencies': deque(maxlen=self.sample_size),
+                }
+            counts = entry['counts']
+            counts['count'] += 1
+            counts['errors'] += int(bool(error))
+            counts['retries'] += retries
+            counts['bytes'] += bytes
+            if result is not None:
+                counts[result] = counts.get(result, 0) + 1
+            entry['latencies'].append(latency)
+            publish = (self.publish_interval is not None and
+                       time.time() - self._published_at >=
+                       self.publish_interval)
+            if publish:
+                self._published_at = time.time()
+        finally:
+            self._lock.release()
+        if publish:
+            self.publish()
+
+    def snapshot(self):
+        """Returns {key: (counts, latencies)} of the events so far."""
+        self._lock.acquire()
+        try:
+            return dict((key, (dict(entry['counts']),
+                               list(entry['latencies'])))
+                        for key, entry in self._entries.iteritems())
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """Returns a sorted list of (key, stats), see summarize()."""
+        return summarize(self.snapshot())
+
+    def publish(self):
+        """Stores the snapshot of this process in the cache."""
+        timeout = max((self.publish_interval or 60) * 10, 60)
+        key = self._process_key()
+        self.cache.set(key, self.snapshot(), timeout)
+        index_key = '%s:index' % self.key_prefix
+        index = self.cache.get(index_key) or []
+        if key not in index:
+            # Forget the processes whose snapshots have expired.
+            live = self.cache.get_many(index)
+            index = [k for k in index if k in live] + [key]
+            self.cache.set(index_key, index, 24 * 60 * 60)
+
+    def published(self):
+        """Returns the snapshots published by every process, merged."""
+        index = self.cache.get('%s:index' % self.key_prefix) or []
+        merged = {}
+        for snapshot in self.cache.get_many(index).itervalues():
+            for key, (counts, latencies) in snapshot.iteritems():
+                merged_counts, merged_latencies = merged.setdefault(key,
+                                                                   ({}, []))
+                for name, value in counts.iteritems():
+                    merged_counts[name] = merged_counts.get(name, 0) + value
+                merged_latencies.extend(latencies)
+        return merged
+
+    def _process_key(self):
+        # Looked up on each publish(), as processes may fork after the
+        # aggregator is made.
+        return '%s:%s:%s' % (self.key_prefix, socket.gethostname(),
+                             os.getpid())
+
+
+def summarize(snapshot):
+    """
+    Returns a list of (key, stats) for each key of `snapshot`, sorted by
+    key.  `stats` has the counts of events, errors, retries, bytes and
+    cache results, and the p50, p90, p99 and max latencies, in seconds.
+    """
+    result = []
+    for key in sorted(snapshot):
+        counts, latencies = snapshot[key]
+        stats = dict(counts)
+        latencies = sorted(latencies)
+        for p in PERCENTILES:
+            stats['p%d' % p] = percentile(latencies, p)
+        stats['max'] = None
+        if latencies:
+            stats['max'] = latencies[-1]
+        result.append((key, stats))
+    return result
+
+
+def percentile(values, p):
+    """Returns the `p`th percentile of the sorted `values`, or None."""
+    if not values:
+        return None
+    # Nearest rank.
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+def default_aggregator():
+    """
+    Returns the Aggregator shared by this process.
+
+    It publishes its events every
+    settings.DJANGO_OAUTH_TWITTER_INSTRUMENT_PUBLISH_INTERVAL seconds,
+    60 by default.
+    """
+    global _aggregator
+    _aggregator_lock.acquire()
+    try:
+        if _aggregator is None:
+            _aggregator = Aggregator(publish_interval=getattr(
+                settings, 'DJANGO_OAUTH_TWITTER_INSTRUMENT_PUBLISH_INTERVAL',
+                60
+            ))
+        return _aggregator
+    finally:
+        _aggregator_lock.release()
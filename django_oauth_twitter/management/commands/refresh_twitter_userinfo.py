@@ -0,0 +1,41 @@
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_oauth_twitter.models import ID_CHUNK_SIZE, TwitterUser
+
+
+class Command(BaseCommand):
+    help = ('Refreshes the Twitter user info of every TwitterUser, saving '
+            'only the ones that changed.')
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', type='int', dest='concurrency',
+                    default=4,
+                    help='Number of users to fetch at a time.'),
+        make_option('--chunk-size', type='int', dest='chunk_size',
+                    default=ID_CHUNK_SIZE,
+                    help='Number of users to save per transaction.'),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        checked = changed = failed = 0
+        start = time.time()
+        for twitter_user, result in TwitterUser.objects.refresh_userinfo(
+            concurrency=options.get('concurrency'),
+            chunk_size=options.get('chunk_size')
+        ):
+            checked += 1
+            if isinstance(result, Exception):
+                failed += 1
+                print 'Skipped %s: %s' % (twitter_user.user.username, result)
+            elif result:
+                changed += 1
+                if verbosity >= 2:
+                    print 'Updated %s' % twitter_user.user.username
+        if verbosity >= 1:
+            elapsed = time.time() - start
+            print ('%d checked, %d changed, %d failed in %.1fs (%.1f/s)' %
+                   (checked, changed, failed, elapsed,
+                    checked / max(elapsed, 1e-6)))
@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from django_oauth_twitter.models import TwitterUser
+
+
+class Command(BaseCommand):
+    help = ('Checks every TwitterUser\'s access token with Twitter, and '
+            'unassociates the ones that have been revoked.')
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', type='int', dest='concurrency',
+                    default=4,
+                    help='Number of tokens to check at a time.'),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        checked = revoked = failed = 0
+        for twitter_user, result in TwitterUser.objects.sweep_revoked(
+            concurrency=options.get('concurrency')
+        ):
+            checked += 1
+            if isinstance(result, Exception):
+                failed += 1
+                print 'Skipped %s: %s' % (twitter_user.user.username, result)
+            elif result:
+                revoked += 1
+                if verbosity >= 1:
+                    print 'Revoked %s' % twitter_user.user.username
+        if verbosity >= 1:
+            print '%d checked, %d revoked, %d failed' % (checked, revoked,
+                                                        failed)
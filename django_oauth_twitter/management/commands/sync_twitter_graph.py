@@ -0,0 +1,40 @@
+from optparse import make_option
+from urllib2 import URLError
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_oauth_twitter.models import TwitterUser
+from django_oauth_twitter.ratelimit import RateLimited
+
+
+class Command(BaseCommand):
+    help = ('Stores the Twitter friends and followers of TwitterUsers, '
+            'so that site friends can be looked up without Twitter.')
+    args = '[username ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--fail-fast', action='store_true', dest='fail_fast',
+                    default=False,
+                    help='Stop at the first TwitterUser that fails.'),
+    )
+
+    def handle(self, *usernames, **options):
+        verbosity = int(options.get('verbosity', 1))
+        twitter_users = TwitterUser.objects.select_related('user')
+        if usernames:
+            twitter_users = twitter_users.filter(user__username__in=usernames)
+        for twitter_user in twitter_users.iterator():
+            try:
+                friends, followers = self._sync(twitter_user)
+            except (URLError, RateLimited), e:
+                if options.get('fail_fast'):
+                    raise
+                print 'Skipped %s: %s' % (twitter_user.user.username, e)
+                continue
+            if verbosity >= 1:
+                print ('%s: friends +%d -%d, followers +%d -%d' %
+                       ((twitter_user.user.username,) + friends + followers))
+
+    @transaction.commit_on_success
+    def _sync(self, twitter_user):
+        return twitter_user.sync_graph()
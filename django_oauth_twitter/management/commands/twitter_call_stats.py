@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from django_oauth_twitter.instrumentation import (default_aggregator,
+                                                  PERCENTILES, summarize)
+
+
+class Command(BaseCommand):
+    help = ('Shows counts and latency percentiles of the calls to Twitter, '
+            'as published by each process with '
+            'DJANGO_OAUTH_TWITTER_INSTRUMENT set.')
+    args = '[request|call|cache ...]'
+
+    def handle(self, *kinds, **options):
+        for (kind, name), stats in summarize(default_aggregator().published()):
+            if kinds and kind not in kinds:
+                continue
+            line = '%s %s: %d calls, %d errors' % (kind, name, stats['count'],
+                                                  stats['errors'])
+            if stats['retries']:
+                line += ', %d retries' % stats['retries']
+            if stats['bytes']:
+                line += ', %d bytes' % stats['bytes']
+            for result in ('hit', 'stale', 'miss'):
+                if result in stats:
+                    line += ', %d %s' % (stats[result], result)
+            latencies = ['p%d %s' % (p, _ms(stats['p%d' % p]))
+                         for p in PERCENTILES]
+            latencies.append('max %s' % _ms(stats['max']))
+            print '%s; %s' % (line, ' '.join(latencies))
+
+
+def _ms(seconds):
+    if seconds is None:
+        return '-'
+    return '%.1fms' % (seconds * 1e3)
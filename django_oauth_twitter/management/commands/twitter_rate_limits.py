@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_oauth_twitter.models import TwitterUser
+from django_oauth_twitter.ratelimit import default_scheduler, token_key_digest
+
+
+class Command(BaseCommand):
+    help = ('Shows the Twitter rate limit quota left for each access token '
+            'and endpoint, as last reported by Twitter.')
+    args = '[username ...]'
+
+    def handle(self, *usernames, **options):
+        names = {}
+        if usernames:
+            twitter_users = TwitterUser.objects.select_related('user').filter(
+                user__username__in=usernames
+            )
+            for twitter_user in twitter_users:
+                if twitter_user.access_token is None:
+                    continue
+                digest = token_key_digest(twitter_user.access_token.key)
+                names[digest] = twitter_user.user.username
+        now = time.time()
+        for token_key, endpoint, status in \
+                default_scheduler().tracker.entries():
+            if usernames and token_key not in names:
+                continue
+            remaining, limit, reset = status
+            print ('%s %s: %d/%d left, resets in %ds' %
+                   (names.get(token_key, token_key[:12]), endpoint,
+                    remaining, limit, reset - now))
@@ -1,8 +1,14 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
 from django.utils.functional import curry, SimpleLazyObject
 
 from django_oauth_twitter import (ACCESS_KEY, REQUEST_KEY, SUCCESS_URL_KEY,
-                                  USERINFO_KEY)
-from django_oauth_twitter.utils import get_user_info
+                                  USERINFO_KEY, USERINFO_TIME_KEY,
+                                  USERINFO_TOKEN_KEY)
+from django_oauth_twitter.utils import get_user_info, token_digest
 
 from oauth.oauth import OAuthToken
 import simplejson
@@ -19,15 +25,26 @@ class SessionMiddleware(object):
             token_str = request.session[ACCESS_KEY]
             token = OAuthToken.from_string(token_str)
             request.twitter_access_token = token
-            userinfo = SimpleLazyObject(curry(cached_user_info,
-                                              request, token))
-            request.twitter_userinfo = userinfo
+            request.twitter_userinfo = _lazy_user_info(request, token)
         if REQUEST_KEY in request.session:
             token_str = request.session[REQUEST_KEY]
             request.twitter_request_token = OAuthToken.from_string(token_str)
 
 
 def cached_user_info(request, token):
+    """
+    Returns the Twitter user info for `token`.
+
+    If settings.DJANGO_OAUTH_TWITTER_USERINFO_MAX_AGE is set, the copy
+    in the session is used, when there is one.  Once it is older than
+    that many seconds, it is refreshed out-of-band.  Otherwise, the
+    user info is fetched from Twitter, falling back on the copy in the
+    session.  Only a copy fetched with `token` is used.
+    """
+    max_age = getattr(settings, 'DJANGO_OAUTH_TWITTER_USERINFO_MAX_AGE', None)
+    has_copy = _has_session_copy(request, token)
+    if max_age is not None and has_copy:
+        return session_user_info(request, token, max_age)
     userinfo = None
     try:
         userinfo = get_user_info(token)
@@ -35,13 +52,104 @@ def cached_user_info(request, token):
         pass
     if userinfo is None:
         # Look for a cached copy in the session
-        if USERINFO_KEY in request.session:
+        if has_copy:
             userinfo_dict = simplejson.loads(request.session[USERINFO_KEY])
             userinfo = twitter.User.NewFromJsonDict(userinfo_dict)
     else:
-        request.session[USERINFO_KEY] = userinfo.AsJsonString()
+        _store_user_info(request, token, userinfo)
+    return userinfo
+
+def fetch_user_info(request, token):
+    """
+    Returns the Twitter user info for `token`, fetched from Twitter.
+
+    Unlike cached_user_info(), it never falls back on a copy, so it is
+    safe to decide which account `token` belongs to.  The session copy
+    is replaced.
+    """
+    userinfo = get_user_info(token)
+    _store_user_info(request, token, userinfo)
+    request.twitter_userinfo = userinfo
+    return userinfo
+
+def session_user_info(request, token, max_age):
+    """
+    Returns the Twitter user info for `token` stored in the session.
+
+    If it is older than `max_age` seconds, it is replaced by a copy
+    refreshed by refresh_user_info(), if there is one.  Otherwise, a
+    refresh is started in the background, and the old copy is returned
+    in the meantime.
+    """
+    session = request.session
+    if time.time() - session.get(USERINFO_TIME_KEY, 0) >= max_age:
+        refreshed = cache.get(_userinfo_cache_key(token))
+        if refreshed is None:
+            refresh_user_info_later(token, max_age)
+        else:
+            session[USERINFO_KEY], session[USERINFO_TIME_KEY] = refreshed
+    userinfo_dict = simplejson.loads(session[USERINFO_KEY])
+    return twitter.User.NewFromJsonDict(userinfo_dict)
+
+def refresh_user_info(token, max_age):
+    """
+    Fetches the Twitter user info for `token` into the cache.
+
+    session_user_info() picks it up from there, for up to `max_age`
+    seconds.
+    """
+    key = _userinfo_cache_key(token)
+    try:
+        userinfo = get_user_info(token)
+        cache.set(key, (userinfo.AsJsonString(), time.time()), max_age)
+    finally:
+        cache.delete(key + ':lock')
     return userinfo
 
+def refresh_user_info_later(token, max_age):
+    """
+    Runs refresh_user_info() in a background thread.
+
+    Only one refresh per `token` runs at a time, across processes.
+    """
+    key = _userinfo_cache_key(token)
+    if not cache.add(key + ':lock', True, 60):
+        return
+    thread = threading.Thread(target=_refresh_user_info_quietly,
+                              args=(token, max_age))
+    thread.setDaemon(True)
+    thread.start()
+
+def _refresh_user_info_quietly(token, max_age):
+    try:
+        refresh_user_info(token, max_age)
+    except:
+        # The stale copy in the session is served until the next try.
+        pass
+
+def _has_session_copy(request, token):
+    """Returns True if the session has user info fetched with `token`."""
+    session = request.session
+    return (USERINFO_KEY in session and
+            session.get(USERINFO_TOKEN_KEY) == token_digest(token))
+
+def _store_user_info(request, token, userinfo):
+    session = request.session
+    session[USERINFO_KEY] = userinfo.AsJsonString()
+    session[USERINFO_TIME_KEY] = time.time()
+    session[USERINFO_TOKEN_KEY] = token_digest(token)
+
+def _clear_user_info(request):
+    for key in (USERINFO_KEY, USERINFO_TIME_KEY, USERINFO_TOKEN_KEY):
+        if key in request.session:
+            del request.session[key]
+
+def _lazy_user_info(request, token):
+    return SimpleLazyObject(curry(cached_user_info, request, token))
+
+def _userinfo_cache_key(token):
+    return 'django_oauth_twitter:userinfo:%s' % token_digest(token)
+
 def get_success_url(request, clear=True):
     session = request.session
     if SUCCESS_URL_KEY in session:
@@ -61,12 +169,15 @@ def remove_tokens(request):
     if SUCCESS_URL_KEY in request.session:
         del request.session[SUCCESS_URL_KEY]
     if USERINFO_KEY in request.session:
-        del request.session[USERINFO_KEY]
         request.twitter_userinfo = None
+    _clear_user_info(request)
 
 def set_access_token(request, access_token):
     request.session[ACCESS_KEY] = access_token.to_string()
     request.twitter_access_token = access_token
+    # The user info in the session belongs to the previous token.
+    _clear_user_info(request)
+    request.twitter_userinfo = _lazy_user_info(request, access_token)
 
 def set_request_token(request, request_token, success_url):
     request.session[REQUEST_KEY] = request_token.to_string()
@@ -0,0 +1,83 @@
+
+from south.db import db
+from django.db import models
+from django_oauth_twitter.models import *
+
+class Migration:
+    
+    def forwards(self, orm):
+        
+        # Adding model 'TwitterFollow'
+        db.create_table('django_oauth_twitter_twitterfollow', (
+            ('id', orm['django_oauth_twitter.TwitterFollow:id']),
+            ('follower_id', orm['django_oauth_twitter.TwitterFollow:follower_id']),
+            ('followed_id', orm['django_oauth_twitter.TwitterFollow:followed_id']),
+        ))
+        db.send_create_signal('django_oauth_twitter', ['TwitterFollow'])
+        
+        # Creating unique_together for [follower_id, followed_id] on TwitterFollow.
+        db.create_unique('django_oauth_twitter_twitterfollow', ['follower_id', 'followed_id'])
+        
+    
+    
+    def backwards(self, orm):
+        
+        # Deleting unique_together for [follower_id, followed_id] on TwitterFollow.
+        db.delete_unique('django_oauth_twitter_twitterfollow', ['follower_id', 'followed_id'])
+        
+        # Deleting model 'TwitterFollow'
+        db.delete_table('django_oauth_twitter_twitterfollow')
+        
+    
+    
+    models = {
+        'auth.group': {
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '80', 'unique': 'True'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'unique_together': "(('content_type', 'codename'),)"},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30', 'unique': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'unique_together': "(('app_label', 'model'),)", 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'django_oauth_twitter.twitterfollow': {
+            'Meta': {'unique_together': "(('follower_id', 'followed_id'),)"},
+            'followed_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'follower_id': ('django.db.models.fields.IntegerField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'django_oauth_twitter.twitteruser': {
+            'access_token_str': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'twitter_id': ('django.db.models.fields.IntegerField', [], {'unique': 'True'}),
+            'user': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'twitter'", 'unique': 'True', 'to': "orm['auth.User']"}),
+            'userinfo_json': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        }
+    }
+    
+    complete_apps = ['django_oauth_twitter']
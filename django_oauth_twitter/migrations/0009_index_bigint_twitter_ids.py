@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import connection, models
+
+
+# The indexes the next migration needs on the BigIntegerField twins of
+# the id columns: (name, table, columns, unique).
+INDEXES = (
+    ('django_oauth_twitter_twitteruser_twitter_id_new_uniq',
+     'django_oauth_twitter_twitteruser', ['twitter_id_new'], True),
+    ('django_oauth_twitter_twitterfollow_follow_new_uniq',
+     'django_oauth_twitter_twitterfollow',
+     ['follower_id_new', 'followed_id_new'], True),
+    ('django_oauth_twitter_twitterfollow_followed_id_new',
+     'django_oauth_twitter_twitterfollow', ['followed_id_new'], False),
+)
+
+# The id columns of each table, with their BigIntegerField twins.
+COLUMNS = (
+    ('django_oauth_twitter_twitteruser', (('twitter_id', 'twitter_id_new'),)),
+    ('django_oauth_twitter_twitterfollow', (('follower_id', 'follower_id_new'),
+                                            ('followed_id', 'followed_id_new'))),
+)
+
+
+def create_triggers():
+    """Creates MySQL triggers that fill in the twins of written rows."""
+    for table, columns in COLUMNS:
+        assignments = ', '.join('NEW.%s = NEW.%s' % (db.quote_name(new),
+                                                     db.quote_name(old))
+                                for old, new in columns)
+        for name, event in trigger_names(table):
+            db.execute('CREATE TRIGGER %s BEFORE %s ON %s FOR EACH ROW SET %s' %
+                       (db.quote_name(name), event, db.quote_name(table),
+                        assignments))
+
+def drop_triggers():
+    for table, columns in COLUMNS:
+        for name, event in trigger_names(table):
+            db.execute('DROP TRIGGER IF EXISTS %s' % db.quote_name(name))
+
+def trigger_names(table):
+    return [('%s_bigint_insert' % table, 'INSERT'),
+            ('%s_bigint_update' % table, 'UPDATE')]
+
+def execute_outside_transaction(sql):
+    """
+    Executes `sql` in autocommit mode, as PostgreSQL does not allow
+    CREATE INDEX CONCURRENTLY inside a transaction.
+    """
+    db.commit_transaction()
+    raw = connection.connection
+    isolation_level = raw.isolation_level
+    # psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+    raw.set_isolation_level(0)
+    try:
+        raw.cursor().execute(sql)
+    finally:
+        raw.set_isolation_level(isolation_level)
+        db.start_transaction()
+
+
+class Migration(SchemaMigration):
+
+    # Indexes are built outside of South's transaction.
+    no_dry_run = True
+
+    def forwards(self, orm):
+        """
+        Indexes the BigIntegerField twins of the id columns, while the
+        site keeps writing to the tables.
+
+        The next migration swaps the twins in, and they must be indexed
+        by then.  Building the indexes here keeps that migration short.
+        On PostgreSQL they are built CONCURRENTLY, and on MySQL in
+        place, without blocking writes.  On MySQL, triggers also fill
+        in the twins of the rows written from now on.  Other databases
+        are swapped the plain way, without these indexes.
+        """
+        if db.backend_name == 'mysql':
+            create_triggers()
+        for name, table, columns, unique in INDEXES:
+            if db.backend_name == 'postgres':
+                # An index left INVALID by an interrupted build is
+                # built again.
+                execute_outside_transaction(
+                    'DROP INDEX IF EXISTS %s' % db.quote_name(name)
+                )
+                execute_outside_transaction(
+                    'CREATE %sINDEX CONCURRENTLY %s ON %s (%s)' % (
+                        unique and 'UNIQUE ' or '', db.quote_name(name),
+                        db.quote_name(table),
+                        ', '.join(map(db.quote_name, columns)))
+                )
+            elif db.backend_name == 'mysql':
+                db.execute('ALTER TABLE %s ADD %sINDEX %s (%s), '
+                           'ALGORITHM=INPLACE, LOCK=NONE' % (
+                    db.quote_name(table), unique and 'UNIQUE ' or '',
+                    db.quote_name(name),
+                    ', '.join(map(db.quote_name, columns))
+                ))
+
+    def backwards(self, orm):
+        for name, table, columns, unique in INDEXES:
+            if db.backend_name == 'postgres':
+                # The next migration's backwards() may leave a unique
+                # index backing a constraint.
+                db.execute('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s' %
+                           (db.quote_name(table), db.quote_name(name)))
+                db.execute('DROP INDEX IF EXISTS %s' % db.quote_name(name))
+            elif db.backend_name == 'mysql':
+                db.execute('ALTER TABLE %s DROP INDEX %s' %
+                           (db.quote_name(table), db.quote_name(name)))
+        if db.backend_name == 'mysql':
+            drop_triggers()
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'django_oauth_twitter.twitterfollow': {
+            'Meta': {'unique_together': "(('follower_id', 'followed_id'),)", 'object_name': 'TwitterFollow'},
+            'followed_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'followed_id_new': ('django.db.models.fields.BigIntegerField', [], {'null': 'True'}),
+            'follower_id': ('django.db.models.fields.IntegerField', [], {}),
+            'follower_id_new': ('django.db.models.fields.BigIntegerField', [], {'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'django_oauth_twitter.twitteruser': {
+            'Meta': {'object_name': 'TwitterUser'},
+            'access_token_hash': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '40', 'blank': 'True'}),
+            'access_token_str': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '40', 'blank': 'True'}),
+            'profile_image_url': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'screen_name': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '20', 'blank': 'True'}),
+            'twitter_id': ('django.db.models.fields.IntegerField', [], {'unique': 'True'}),
+            'twitter_id_new': ('django.db.models.fields.BigIntegerField', [], {'null': 'True'}),
+            'user': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'twitter'", 'unique': 'True', 'to': "orm['auth.User']"}),
+            'userinfo_json': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['django_oauth_twitter']
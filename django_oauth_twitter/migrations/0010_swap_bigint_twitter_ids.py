@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import connection, models
+
+
+USER = 'django_oauth_twitter_twitteruser'
+FOLLOW = 'django_oauth_twitter_twitterfollow'
+
+# The id columns of each table, with their BigIntegerField twins.
+COLUMNS = ((USER, 'twitter_id', 'twitter_id_new'),
+           (FOLLOW, 'follower_id', 'follower_id_new'),
+           (FOLLOW, 'followed_id', 'followed_id_new'))
+
+# The indexes built on the twins by the previous migration, with the
+# columns and uniqueness they have once the twins are swapped in.
+INDEXES = (
+    ('django_oauth_twitter_twitteruser_twitter_id_new_uniq',
+     USER, ['twitter_id'], True),
+    ('django_oauth_twitter_twitterfollow_follow_new_uniq',
+     FOLLOW, ['follower_id', 'followed_id'], True),
+    ('django_oauth_twitter_twitterfollow_followed_id_new',
+     FOLLOW, ['followed_id'], False),
+)
+
+
+def qn(name):
+    return db.quote_name(name)
+
+def commit():
+    db.commit_transaction()
+    db.start_transaction()
+
+def catch_up():
+    """Copies the ids of the rows written since the copy migration."""
+    db.execute('UPDATE django_oauth_twitter_twitteruser '
+               'SET twitter_id_new = twitter_id '
+               'WHERE twitter_id_new IS NULL')
+    db.execute('UPDATE django_oauth_twitter_twitterfollow '
+               'SET follower_id_new = follower_id, '
+               'followed_id_new = followed_id '
+               'WHERE follower_id_new IS NULL')
+
+def swapped_index_name(table, columns, unique):
+    """Returns the name South gives the index on `columns`."""
+    return db.create_index_name(table, columns,
+                                suffix=unique and '_uniq' or '')
+
+def check_name(table, column):
+    return '%s_%s_not_null' % (table, column)
+
+def create_triggers():
+    """Creates MySQL triggers that fill in the twins of written rows."""
+    for table in (USER, FOLLOW):
+        assignments = ', '.join('NEW.%s = NEW.%s' % (qn(new), qn(old))
+                                for t, old, new in COLUMNS if t == table)
+        for name, event in trigger_names(table):
+            db.execute('CREATE TRIGGER %s BEFORE %s ON %s FOR EACH ROW SET %s' %
+                       (qn(name), event, qn(table), assignments))
+
+def trigger_names(table):
+    return [('%s_bigint_insert' % table, 'INSERT'),
+            ('%s_bigint_update' % table, 'UPDATE')]
+
+
+class Migration(SchemaMigration):
+
+    # Commits as it goes, so that no lock is held for long.
+    no_dry_run = True
+
+    def forwards(self, orm):
+        """
+        Swaps the BigIntegerField twins in for the id columns.
+
+        On PostgreSQL and MySQL, the twins were indexed by the previous
+        migration, and the swap only blocks writes for a moment.  Other
+        databases are swapped with South's usual operations.
+        """
+        if db.backend_name == 'postgres':
+            self.forwards_postgres()
+        elif db.backend_name == 'mysql':
+            self.forwards_mysql()
+        else:
+            self.forwards_generic()
+
+    def forwards_postgres(self):
+        # Copy most rows written since the copy migration while writes
+        # go on, so that few are left to copy under the lock.
+        catch_up()
+        commit()
+
+        # Block writes, but not reads, until the twins are swapped in,
+        # so that no row is written with its twin left NULL.  The
+        # twins' indexes find the rows left to copy.
+        db.execute('LOCK TABLE %s, %s IN SHARE ROW EXCLUSIVE MODE' %
+                   (qn(USER), qn(FOLLOW)))
+        catch_up()
+        for table, old, new in COLUMNS:
+            # NOT VALID constraints only check the rows written from now
+            # on, so adding one does not scan the table.
+            db.execute('ALTER TABLE %s ADD CONSTRAINT %s '
+                       'CHECK (%s IS NOT NULL) NOT VALID' %
+                       (qn(table), qn(check_name(table, old)), qn(new)))
+            # Rows written from now on leave the old column NULL, until
+            # it is dropped.
+            db.execute('ALTER TABLE %s ALTER COLUMN %s DROP NOT NULL' %
+                       (qn(table), qn(old)))
+            db.execute('ALTER TABLE %s RENAME COLUMN %s TO %s' %
+                       (qn(table), qn(old), qn(old + '_old')))
+            db.execute('ALTER TABLE %s RENAME COLUMN %s TO %s' %
+                       (qn(table), qn(new), qn(old)))
+        commit()
+
+        # Validating scans the tables without blocking writes.
+        for table, old, new in COLUMNS:
+            db.execute('ALTER TABLE %s VALIDATE CONSTRAINT %s' %
+                       (qn(table), qn(check_name(table, old))))
+        commit()
+
+        # From PostgreSQL 12, the valid CHECK constraint spares SET NOT
+        # NULL its scan.  Before that, SET NOT NULL would scan the table
+        # under an exclusive lock, so the CHECK constraint stays instead.
+        if connection.connection.server_version >= 120000:
+            for table, old, new in COLUMNS:
+                db.execute('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL' %
+                           (qn(table), qn(old)))
+                db.execute('ALTER TABLE %s DROP CONSTRAINT %s' %
+                           (qn(table), qn(check_name(table, old))))
+        for index, table, columns, unique in INDEXES:
+            name = swapped_index_name(table, columns, unique)
+            if unique:
+                db.execute('ALTER TABLE %s ADD CONSTRAINT %s '
+                           'UNIQUE USING INDEX %s' %
+                           (qn(table), qn(name), qn(index)))
+            else:
+                db.execute('ALTER INDEX %s RENAME TO %s' %
+                           (qn(index), qn(name)))
+        # Dropping a column does not rewrite the table.
+        for table, old, new in COLUMNS:
+            db.execute('ALTER TABLE %s DROP COLUMN %s' %
+                       (qn(table), qn(old + '_old')))
+
+    def forwards_mysql(self):
+        # The previous migration's triggers fill in the twins of the
+        # rows written since.  Copy those written before them.
+        catch_up()
+        commit()
+
+        # Rebuilds the tables in place, while writes go on.
+        for table in (USER, FOLLOW):
+            db.execute('ALTER TABLE %s %s, ALGORITHM=INPLACE, LOCK=NONE' % (
+                qn(table),
+                ', '.join('MODIFY %s bigint NOT NULL, MODIFY %s integer NULL' %
+                          (qn(new), qn(old))
+                          for t, old, new in COLUMNS if t == table)
+            ))
+
+        # Renaming columns and indexes only changes metadata, but the
+        # triggers must go at the same time, so writes are blocked for
+        # that moment.
+        db.execute('LOCK TABLES %s WRITE, %s WRITE' % (qn(USER), qn(FOLLOW)))
+        try:
+            for table in (USER, FOLLOW):
+                for name, event in trigger_names(table):
+                    db.execute('DROP TRIGGER %s' % qn(name))
+            for table in (USER, FOLLOW):
+                clauses = []
+                for t, old, new in COLUMNS:
+                    if t == table:
+                        clauses.append('CHANGE %s %s integer NULL' %
+                                       (qn(old), qn(old + '_old')))
+                        clauses.append('CHANGE %s %s bigint NOT NULL' %
+                                       (qn(new), qn(old)))
+                for index, t, columns, unique in INDEXES:
+                    if t == table:
+                        clauses.append('RENAME INDEX %s TO %s' % (
+                            qn(index),
+                            qn(swapped_index_name(table, columns, unique))
+                        ))
+                db.execute('ALTER TABLE %s %s, ALGORITHM=INPLACE' %
+                           (qn(table), ', '.join(clauses)))
+        finally:
+            db.execute('UNLOCK TABLES')
+
+        # Rebuilds the tables in place, while writes go on.
+        for table in (USER, FOLLOW):
+            db.execute('ALTER TABLE %s %s, ALGORITHM=INPLACE, LOCK=NONE' % (
+                qn(table),
+                ', '.join('DROP COLUMN %s' % qn(old + '_old')
+                          for t, old, new in COLUMNS if t == table)
+            ))
+
+    def forwards_generic(self):
+        catch_up()
+
+        # Swapping 'TwitterUser.twitter_id' for 'TwitterUser.twitter_id_new'
+        db.delete_column('django_oauth_twitter_twitteruser', 'twitter_id')
+        db.rename_column('django_oauth_twitter_twitteruser', 'twitter_id_new', 'twitter_id')
+        db.alter_column('django_oauth_twitter_twitteruser', 'twitter_id', self.gf('django.db.models.fields.BigIntegerField')())
+        db.create_unique('django_oauth_twitter_twitteruser', ['twitter_id'])
+
+        # Swapping 'TwitterFollow.follower_id' and 'TwitterFollow.followed_id'
+        db.delete_column('django_oauth_twitter_twitterfollow', 'follower_id')
+        db.delete_column('django_oauth_twitter_twitterfollow', 'followed_id')
+        db.rename_column('django_oauth_twitter_twitterfollow', 'follower_id_new', 'follower_id')
+        db.rename_column('django_oauth_twitter_twitterfollow', 'followed_id_new', 'followed_id')
+        db.alter_column('django_oauth_twitter_twitterfollow', 'follower_id', self.gf('django.db.models.fields.BigIntegerField')())
+        db.alter_column('django_oauth_twitter_twitterfollow', 'followed_id', self.gf('django.db.models.fields.BigIntegerField')())
+        db.create_unique('django_oauth_twitter_twitterfollow', ['follower_id', 'followed_id'])
+        db.create_index('django_oauth_twitter_twitterfollow', ['followed_id'])
+
+    def backwards(self, orm):
+        # Swapping back blocks writes, as it is only done in a pinch.
+        if db.backend_name == 'postgres':
+            for table, old, new in COLUMNS:
+                db.execute('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s' %
+                           (qn(table), qn(check_name(table, old))))
+
+        # Swapping 'TwitterUser.twitter_id' back to an IntegerField
+        db.delete_unique('django_oauth_twitter_twitteruser', ['twitter_id'])
+        db.rename_column('django_oauth_twitter_twitteruser', 'twitter_id', 'twitter_id_new')
+        db.alter_column('django_oauth_twitter_twitteruser', 'twitter_id_new', self.gf('django.db.models.fields.BigIntegerField')(null=True))
+        db.add_column('django_oauth_twitter_twitteruser', 'twitter_id',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+        db.execute('UPDATE django_oauth_twitter_twitteruser '
+                   'SET twitter_id = twitter_id_new')
+        db.create_unique('django_oauth_twitter_twitteruser', ['twitter_id'])
+
+        # Swapping 'TwitterFollow.follower_id' and 'TwitterFollow.followed_id' back
+        db.delete_unique('django_oauth_twitter_twitterfollow', ['follower_id', 'followed_id'])
+        db.delete_index('django_oauth_twitter_twitterfollow', ['followed_id'])
+        db.rename_column('django_oauth_twitter_twitterfollow', 'follower_id', 'follower_id_new')
+        db.rename_column('django_oauth_twitter_twitterfollow', 'followed_id', 'followed_id_new')
+        db.alter_column('django_oauth_twitter_twitterfollow', 'follower_id_new', self.gf('django.db.models.fields.BigIntegerField')(null=True))
+        db.alter_column('django_oauth_twitter_twitterfollow', 'followed_id_new', self.gf('django.db.models.fields.BigIntegerField')(null=True))
+        db.add_column('django_oauth_twitter_twitterfollow', 'follower_id',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+        db.add_column('django_oauth_twitter_twitterfollow', 'followed_id',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+        db.execute('UPDATE django_oauth_twitter_twitterfollow '
+                   'SET follower_id = follower_id_new, '
+                   'followed_id = followed_id_new')
+        db.create_unique('django_oauth_twitter_twitterfollow', ['follower_id', 'followed_id'])
+        db.create_index('django_oauth_twitter_twitterfollow', ['followed_id'])
+
+        # Leave the twins indexed, as the previous migration did.
+        if db.backend_name in ('postgres', 'mysql'):
+            for index, table, columns, unique in INDEXES:
+                db.execute('CREATE %sINDEX %s ON %s (%s)' % (
+                    unique and 'UNIQUE ' or '', qn(index), qn(table),
+                    ', '.join(qn(column + '_new') for column in columns)
+                ))
+        if db.backend_name == 'mysql':
+            create_triggers()
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'django_oauth_twitter.twitterfollow': {
+            'Meta': {'unique_together': "(('follower_id', 'followed_id'),)", 'object_name': 'TwitterFollow'},
+            'followed_id': ('django.db.models.fields.BigIntegerField', [], {'db_index': 'True'}),
+            'follower_id': ('django.db.models.fields.BigIntegerField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'django_oauth_twitter.twitteruser': {
+            'Meta': {'object_name': 'TwitterUser'},
+            'access_token_hash': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '40', 'blank': 'True'}),
+            'access_token_str': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '40', 'blank': 'True'}),
+            'profile_image_url': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'screen_name': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '20', 'blank': 'True'}),
+            'twitter_id': ('django.db.models.fields.BigIntegerField', [], {'unique': 'True'}),
+            'user': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'twitter'", 'unique': 'True', 'to': "orm['auth.User']"}),
+            'userinfo_json': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['django_oauth_twitter']
\ No newline at end of file
@@ -1,18 +1,117 @@
+import time
 from urllib2 import HTTPError
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import ugettext_lazy as _
 
 from oauth.oauth import OAuthToken
 import simplejson
 import twitter
 
-from django_oauth_twitter.cache import DjangoCachedApi
-from django_oauth_twitter.signals import twitter_user_created
-from django_oauth_twitter.utils import fail_whale, get_user_info, TwitterApi
+from django_oauth_twitter.cache import (CacheKeys, CachePolicy,
+                                        DjangoCachedApi, LocalCache)
+from django_oauth_twitter.instrumentation import default_aggregator
+from django_oauth_twitter.pool import WorkerPool
+from django_oauth_twitter.ratelimit import default_scheduler
+from django_oauth_twitter.signals import (twitter_cache_lookup,
+                                          twitter_user_created)
+from django_oauth_twitter.utils import (decode_userinfo_json,
+                                        encode_userinfo_dict,
+                                        encode_userinfo_json, fail_whale,
+                                        get_user_info, id_pages,
+                                        token_digest, TwitterApi)
+
+
+_local_cache = None
+
+def local_cache():
+    """
+    Returns the LocalCache shared by this process, or None if disabled.
+
+    Enable it by setting DJANGO_OAUTH_TWITTER_LOCAL_CACHE_BYTES to its
+    maximum size.  Entries are kept for
+    DJANGO_OAUTH_TWITTER_LOCAL_CACHE_TIMEOUT seconds.
+    """
+    global _local_cache
+    if _local_cache is None:
+        max_bytes = getattr(settings, 'DJANGO_OAUTH_TWITTER_LOCAL_CACHE_BYTES',
+                            None)
+        if max_bytes:
+            timeout = getattr(settings,
+                              'DJANGO_OAUTH_TWITTER_LOCAL_CACHE_TIMEOUT', 5)
+            _local_cache = LocalCache(max_bytes=max_bytes, timeout=timeout)
+    return _local_cache
+
+
+def cache_policy():
+    """
+    Returns the CachePolicy for Twitter API responses, or None.
+
+    DJANGO_OAUTH_TWITTER_CACHE_METHOD_TIMEOUTS maps API method names to
+    cache timeouts, and DJANGO_OAUTH_TWITTER_CACHE_URL_TIMEOUTS is a
+    sequence of (URL pattern, cache timeout) pairs.  See CachePolicy.
+    """
+    methods = getattr(settings, 'DJANGO_OAUTH_TWITTER_CACHE_METHOD_TIMEOUTS',
+                      None)
+    urls = getattr(settings, 'DJANGO_OAUTH_TWITTER_CACHE_URL_TIMEOUTS', ())
+    if not methods and not urls:
+        return None
+    return CachePolicy(methods=methods, urls=urls)
+
+
+def cache_keys(access_token=None):
+    """
+    Returns the CacheKeys for Twitter API responses fetched with
+    `access_token`, namespaced by its digest.
+
+    DJANGO_OAUTH_TWITTER_CACHE_VERSION is the version of the keys, 1 by
+    default.  Bump it to move to new keys, while entries of the previous
+    version are served as stale.  See CacheKeys.
+    """
+    namespace = None
+    if access_token is not None:
+        namespace = token_digest(access_token)
+    return CacheKeys(namespace=namespace,
+                     version=getattr(settings,
+                                     'DJANGO_OAUTH_TWITTER_CACHE_VERSION', 1))
+
+
+def revocation_ttl():
+    """
+    Returns how long, in seconds, TwitterUser.is_revoked() caches its
+    answer: DJANGO_OAUTH_TWITTER_REVOCATION_TTL, 600 by default.
+    """
+    return getattr(settings, 'DJANGO_OAUTH_TWITTER_REVOCATION_TTL', 600)
+
+
+def user_cache_timeout():
+    """
+    Returns how long, in seconds, backends.TwitterBackend caches a User
+    and their TwitterUser: DJANGO_OAUTH_TWITTER_USER_CACHE_TIMEOUT, 300
+    by default.  0 disables the cache.
+    """
+    return getattr(settings, 'DJANGO_OAUTH_TWITTER_USER_CACHE_TIMEOUT', 300)
+
+
+def user_cache_key(user_id):
+    return 'django_oauth_twitter:user:%s' % user_id
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Forgets the cached User of `instance`, a User or a TwitterUser, once
+    it has been saved or deleted.
+    """
+    if isinstance(instance, User):
+        user_id = instance.pk
+    else:
+        user_id = instance.user_id
+    cache.delete(user_cache_key(user_id))
 
 
 class UserAlreadyLinked(Exception):
@@ -23,14 +122,90 @@ class TwitterAlreadyLinked(Exception):
     pass
 
 
+# Number of Twitter ids to look up per query.  Keeps IN clauses well
+# below the limits of database backends, such as the 999 variables of
+# older SQLite versions.
+ID_CHUNK_SIZE = 500
+
+
+class TwitterUserQuerySet(QuerySet):
+    _prime_userinfo = False
+
+    def with_userinfo(self):
+        """
+        Returns a copy of this queryset that loads each TwitterUser with
+        its User, in the same query, and decodes its user info once, as
+        it is loaded.
+
+        Rendering `twitter_user.user`, `user.twitter` or the user info of
+        the results then needs no more queries or parsing.
+        """
+        clone = self.select_related('user')
+        clone._prime_userinfo = True
+        return clone
+
+    def iterator(self):
+        for twitter_user in super(TwitterUserQuerySet, self).iterator():
+            if self._prime_userinfo:
+                twitter_user.user._twitter_cache = twitter_user
+                if twitter_user.userinfo_json:
+                    twitter_user.userinfo()
+            yield twitter_user
+
+    def _clone(self, *args, **kwargs):
+        kwargs.setdefault('_prime_userinfo', self._prime_userinfo)
+        return super(TwitterUserQuerySet, self)._clone(*args, **kwargs)
+
+
 class TwitterUserManager(models.Manager):
+    def get_query_set(self):
+        return TwitterUserQuerySet(self.model, using=self._db)
+
+    def with_userinfo(self):
+        """
+        Returns every TwitterUser, loaded as by
+        TwitterUserQuerySet.with_userinfo().
+        """
+        return self.get_query_set().with_userinfo()
+
+    def for_users(self, users, chunk_size=ID_CHUNK_SIZE):
+        """
+        Returns a list of (user, TwitterUser) for each of `users`, with
+        None for Users who have not linked Twitter.
+
+        The TwitterUsers are looked up `chunk_size` Users at a time, and
+        cached on their User, with their user info decoded, so
+        `user.twitter` needs no query of its own.  In a template:
+
+            {% for user, twitter_user in pairs %}
+        """
+        users = list(users)
+        by_user_id = {}
+        for i in xrange(0, len(users), chunk_size):
+            chunk = [user.pk for user in users[i:i + chunk_size]]
+            for twitter_user in self.get_query_set().filter(user__in=chunk):
+                by_user_id[twitter_user.user_id] = twitter_user
+        result = []
+        for user in users:
+            twitter_user = by_user_id.get(user.pk)
+            if twitter_user is not None:
+                twitter_user._user_cache = user
+                user._twitter_cache = twitter_user
+                if twitter_user.userinfo_json:
+                    twitter_user.userinfo()
+            result.append((user, twitter_user))
+        return result
+
     @staticmethod
     def _access_token(access_token, userinfo=None):
         if userinfo is None:
             userinfo = get_user_info(access_token)
         attributes = {'access_token_str': str(access_token),
+                      'access_token_hash': token_digest(access_token),
                       'twitter_id': userinfo.id,
-                      'userinfo_json': userinfo.AsJsonString()}
+                      'userinfo_json': encode_userinfo_json(
+                          userinfo.AsJsonString()
+                      )}
         return (attributes, userinfo)
 
     def create_twitter_user(self, user, access_token, userinfo=None):
@@ -39,15 +214,24 @@ class TwitterUserManager(models.Manager):
 
         If `userinfo` is provided, it will use that instead of
         fetching recent Twitter user info using `access_token`.
+
+        Relies on the unique constraints on user and twitter_id, so
+        that only the INSERT is sent to the database.
         """
         attributes, userinfo = self._access_token(access_token, userinfo)
-        if self.get_query_set().filter(user=user):
-            raise UserAlreadyLinked('User %s is already linked to Twitter.' %
-                                    user)
-        if self.get_query_set().filter(access_token_str=access_token):
+        sid = transaction.savepoint()
+        try:
+            twitter_user = self.create(user=user, **attributes)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            if self.get_query_set().filter(user=user).exists():
+                raise UserAlreadyLinked('User %s is already linked to '
+                                        'Twitter.' % user)
             raise TwitterAlreadyLinked('Twitter user %s is already linked.' %
                                        userinfo.screen_name)
-        return self.create(user=user, **attributes)
+        transaction.savepoint_commit(sid)
+        user._twitter_cache = twitter_user
+        return twitter_user
 
     def update_or_create(self, user, access_token, userinfo=None):
         """
@@ -57,113 +241,575 @@ class TwitterUserManager(models.Manager):
 
         If `userinfo` is provided, it will use that instead of
         fetching recent Twitter user info using `access_token`.
+
+        An existing TwitterUser is written with a single UPDATE, and
+        only if its access token or user info changed.
         """
         attributes, userinfo = self._access_token(access_token, userinfo)
-        obj, created = self.get_or_create(user=user,
-                                          defaults=attributes)
-        if not created:
-            save = False
-            if obj.update_access_token(access_token):
-                save = True
-            if obj.update_userinfo(userinfo):
-                save = True
-            if save:
-                obj.save()
+        try:
+            obj = self.get_query_set().get(user=user)
+        except self.model.DoesNotExist:
+            sid = transaction.savepoint()
+            try:
+                obj = self.create(user=user, **attributes)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+                # Created concurrently for the same user.
+                obj = self.get_query_set().get(user=user)
+            else:
+                transaction.savepoint_commit(sid)
+                user._twitter_cache = obj
+                return obj, True
+        changed = obj.update_access_token(access_token)
+        if obj.update_userinfo(userinfo):
+            changed = True
+        if changed:
+            fields = (('access_token_str', 'access_token_hash',
+                       'userinfo_json') +
+                      TwitterUser.PROFILE_FIELDS)
+            self.get_query_set().filter(pk=obj.pk).update(
+                **dict((f, getattr(obj, f)) for f in fields)
+            )
+            invalidate_cached_user(self.model, obj)
         user._twitter_cache = obj
-        return obj, created
+        return obj, False
+
+    def sweep_revoked(self, concurrency=4, pool=None):
+        """
+        Yields (TwitterUser, revoked) for every TwitterUser, deleting
+        the ones who have revoked our access to Twitter.
+
+        Access tokens are checked with Twitter `concurrency` at a time,
+        on `pool` if given, or on a pool of its own that is shut down
+        afterwards.  The answers are cached for is_revoked().  If a check fails, `revoked` is the exception.
+        Like OAuthTwitter._check_for_revocation(), revoked TwitterUsers
+        are deleted without sending twitter_user_unassociated.
+        """
+        own_pool = pool is None
+        if own_pool:
+            pool = WorkerPool(concurrency)
+        try:
+            for chunk in self._chunks(ID_CHUNK_SIZE):
+                # Only the checks run on the pool, as each thread would
+                # need a database connection of its own.
+                futures = [pool.submit(twitter_user.check_revoked)
+                           for twitter_user in chunk]
+                for twitter_user, future in zip(chunk, futures):
+                    revoked = future.exception()
+                    if revoked is None:
+                        revoked = future.result()
+                        if revoked:
+                            twitter_user.invalidate_cache()
+                            twitter_user.delete()
+                    yield twitter_user, revoked
+        finally:
+            if own_pool:
+                pool.shutdown(wait=False)
+
+    def refresh_userinfo(self, concurrency=4, pool=None,
+                         chunk_size=ID_CHUNK_SIZE):
+        """
+        Yields (TwitterUser, changed) for every TwitterUser, after
+        refreshing their user info from Twitter.
+
+        User info is fetched `concurrency` at a time, on `pool` if
+        given, or on a pool of its own that is shut down afterwards.
+        These calls wait for rate limit quota, or fail with
+        RateLimited, before the quota kept for signing in is touched.
+        Only the rows whose user info changed are written, in one
+        transaction per `chunk_size` TwitterUsers.  If a fetch fails,
+        `changed` is the exception.
+        """
+        own_pool = pool is None
+        if own_pool:
+            pool = WorkerPool(concurrency)
+        scheduler = default_scheduler()
+        try:
+            for chunk in self._chunks(chunk_size):
+                futures = [pool.submit(scheduler.deferring,
+                                       twitter_user.fetch_userinfo)
+                           for twitter_user in chunk]
+                results = []
+                for twitter_user, future in zip(chunk, futures):
+                    changed = future.exception()
+                    if changed is None:
+                        userinfo = twitter_user.update_userinfo(
+                            future.result()
+                        )
+                        changed = userinfo is not None
+                    results.append((twitter_user, changed))
+                self._save_userinfo([twitter_user
+                                     for twitter_user, changed in results
+                                     if changed is True])
+                for result in results:
+                    yield result
+        finally:
+            if own_pool:
+                pool.shutdown(wait=False)
+
+    @transaction.commit_on_success
+    def _save_userinfo(self, twitter_users):
+        """Writes the user info columns of `twitter_users`."""
+        fields = ('userinfo_json',) + TwitterUser.PROFILE_FIELDS
+        for twitter_user in twitter_users:
+            self.get_query_set().filter(pk=twitter_user.pk).update(
+                **dict((f, getattr(twitter_user, f)) for f in fields)
+            )
+            invalidate_cached_user(self.model, twitter_user)
+
+    def _chunks(self, chunk_size):
+        """
+        Yields lists of up to `chunk_size` TwitterUsers with access
+        tokens, paged by primary key, so rows may be deleted along the
+        way.
+        """
+        queryset = self.get_query_set().exclude(access_token_hash='')
+        queryset = queryset.select_related('user').order_by('pk')
+        last_pk = None
+        while True:
+            chunk = queryset
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            yield chunk
+
+    def get_by_access_token(self, access_token):
+        """
+        Returns the TwitterUser with `access_token`.
+
+        Looks it up by the indexed access_token_hash, so the token's
+        secret is never sent in a query.
+        """
+        return self.get_query_set().get(
+            access_token_hash=token_digest(access_token)
+        )
+
+    def iter_twitter_ids(self, id_lists, chunk_size=ID_CHUNK_SIZE):
+        """
+        Yields the TwitterUsers whose twitter_id is in `id_lists`.
+
+        `id_lists` is an iterable of lists of Twitter ids, such as pages
+        of an API response.  They are looked up `chunk_size` ids at a
+        time, so that no query grows with the number of ids.
+        """
+        for ids in id_lists:
+            for i in xrange(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                for twitter_user in self.get_query_set().filter(
+                    twitter_id__in=chunk
+                ):
+                    yield twitter_user
 
 
 class TwitterUser(models.Model):
     user = models.OneToOneField(User, unique=True, verbose_name=_('user'),
                                 related_name='twitter')
-    twitter_id = models.IntegerField(unique=True)
+    twitter_id = models.BigIntegerField(unique=True)
     access_token_str = models.TextField()
+    # utils.token_digest() of access_token_str, to look tokens up by.
+    access_token_hash = models.CharField(max_length=40, blank=True,
+                                         db_index=True)
     userinfo_json = models.TextField(blank=True)
+    # Copied from userinfo_json, so that they can be queried and
+    # displayed without parsing JSON.
+    screen_name = models.CharField(max_length=20, blank=True, db_index=True)
+    name = models.CharField(max_length=40, blank=True)
+    profile_image_url = models.CharField(max_length=255, blank=True)
     objects = TwitterUserManager()
 
+    PROFILE_FIELDS = ('screen_name', 'name', 'profile_image_url')
+
     def __init__(self, *args, **kwargs):
         super(TwitterUser, self).__init__(*args, **kwargs)
         self._api = None
+        self._profile_json = None
+        # (userinfo_json, parsed dictionary) and (userinfo_json,
+        # twitter.User), so that userinfo_json is parsed once until it
+        # changes.
+        self._userinfo_dict_cache = (None, None)
+        self._userinfo_cache = (None, None)
 
     def __unicode__(self):
-        return self.userinfo().screen_name
+        return self.get_screen_name()
+
+    def save(self, *args, **kwargs):
+        self.update_profile()
+        super(TwitterUser, self).save(*args, **kwargs)
 
     @classmethod
     def on_create(cls, sender, instance, created, raw, **kwargs):
         if created and not raw:
             twitter_user_created.send(sender=cls, twitter_user=instance)
 
+    @classmethod
+    def on_delete(cls, sender, instance, **kwargs):
+        TwitterFollow.objects.forget(instance.twitter_id)
+
     def get_access_token(self):
         if self.access_token_str:
-            return OAuthToken.from_string(self.access_token_str)
+            # The database returns unicode, which breaks HMAC signing.
+            return OAuthToken.from_string(str(self.access_token_str))
         return None
 
     def set_access_token(self, value):
-        self.access_token_str = str(value)
+        if value is None:
+            self.access_token_str = self.access_token_hash = ''
+        else:
+            self.access_token_str = str(value)
+            self.access_token_hash = token_digest(value)
 
     access_token = property(get_access_token, set_access_token)
 
     def update_access_token(self, access_token):
-        if self.access_token != access_token:
+        # OAuthTokens compare by identity, so compare their strings.
+        if access_token is None:
+            changed = self.access_token is not None
+        else:
+            changed = self.access_token_str != str(access_token)
+        if changed:
             self.access_token = access_token
             return True
 
     def api(self):
         cache_timeout = getattr(settings, 'DJANGO_OAUTH_TWITTER_CACHE_TIMEOUT',
                                 60)
+        stale_timeout = getattr(settings,
+                                'DJANGO_OAUTH_TWITTER_CACHE_STALE_TIMEOUT',
+                                None)
+        lock_wait = getattr(settings, 'DJANGO_OAUTH_TWITTER_CACHE_LOCK_WAIT',
+                            None)
         if self._api is None:
             self._api = DjangoCachedApi(api=TwitterApi(self.access_token),
-                                        cache_timeout=cache_timeout)
+                                        cache_timeout=cache_timeout,
+                                        stale_timeout=stale_timeout,
+                                        lock_wait=lock_wait,
+                                        local_cache=local_cache(),
+                                        policy=cache_policy(),
+                                        keys=cache_keys(self.access_token))
         return self._api
 
+    def invalidate_cache(self):
+        """Discards the cached API responses fetched with this token."""
+        if self.access_token is not None:
+            cache_keys(self.access_token).invalidate()
+
     def is_revoked(self):
+        """
+        Returns True if this User has revoked our access to Twitter.
+
+        The answer is cached for
+        settings.DJANGO_OAUTH_TWITTER_REVOCATION_TTL seconds, 600 by
+        default, or 0 to always ask Twitter.
+        """
+        key = self._revocation_cache_key()
+        if key is not None:
+            start = time.time()
+            revoked = cache.get(key)
+            twitter_cache_lookup.send_robust(
+                sender=TwitterUser, endpoint='is_revoked',
+                latency=time.time() - start,
+                result=revoked is None and 'miss' or 'hit', bytes=None
+            )
+            if revoked is not None:
+                return revoked
+        return self.check_revoked()
+
+    def fetch_userinfo(self):
+        """Returns this User's Twitter user info, bypassing the cache."""
+        return fail_whale(TwitterApi(self.access_token).GetUserInfo)()
+
+    def check_revoked(self):
+        """
+        Asks Twitter whether this User has revoked our access, and
+        caches the answer for is_revoked().
+        """
         try:
-            # Use a non-cached API
-            fail_whale(TwitterApi(self.access_token).GetUserInfo)()
+            self.fetch_userinfo()
         except HTTPError, e:
-            if e.code == 401:
-                return True
-            raise
+            if e.code != 401:
+                raise
+            revoked = True
         else:
-            return False
+            revoked = False
+        key = self._revocation_cache_key()
+        if key is not None:
+            cache.set(key, revoked, revocation_ttl())
+        return revoked
+
+    def _revocation_cache_key(self):
+        if self.access_token is None or not revocation_ttl():
+            return None
+        return ('django_oauth_twitter:revoked:%s' %
+                token_digest(self.access_token))
 
     def userinfo(self):
         if self.userinfo_json:
-            userinfo_dict = simplejson.loads(self.userinfo_json)
-            userinfo = twitter.User.NewFromJsonDict(userinfo_dict)
+            json, userinfo = self._userinfo_cache
+            if json != self.userinfo_json:
+                userinfo = twitter.User.NewFromJsonDict(self.userinfo_dict())
+                self._userinfo_cache = (self.userinfo_json, userinfo)
         else:
             userinfo = self.update_userinfo()
         return userinfo
 
+    def userinfo_dict(self):
+        """
+        Returns userinfo_json as a dictionary.
+
+        The dictionary is reused until userinfo_json changes.
+        """
+        json, userinfo_dict = self._userinfo_dict_cache
+        if json != self.userinfo_json:
+            userinfo_dict = simplejson.loads(
+                decode_userinfo_json(self.userinfo_json)
+            )
+            self._userinfo_dict_cache = (self.userinfo_json, userinfo_dict)
+        return userinfo_dict
+
     def update_userinfo(self, userinfo=None):
         if userinfo is None:
             userinfo = fail_whale(self.api().GetUserInfo)()
-        userinfo_json = userinfo.AsJsonString()
+        userinfo_dict = simplejson.loads(userinfo.AsJsonString())
+        userinfo_json = encode_userinfo_dict(userinfo_dict)
         if self.userinfo_json != userinfo_json:
             self.userinfo_json = userinfo_json
+            self._userinfo_dict_cache = (userinfo_json, userinfo_dict)
+            self.update_profile(userinfo_dict)
             return userinfo
 
+    def update_profile(self, userinfo_dict=None):
+        """
+        Copies PROFILE_FIELDS from `userinfo_dict` into their columns.
+
+        If `userinfo_dict` is None, it is parsed from userinfo_json,
+        unless the columns are already up to date.
+        """
+        if userinfo_dict is None:
+            if (not self.userinfo_json or
+                self._profile_json == self.userinfo_json):
+                return
+            userinfo_dict = self.userinfo_dict()
+        for name in self.PROFILE_FIELDS:
+            max_length = self._meta.get_field(name).max_length
+            setattr(self, name, (userinfo_dict.get(name) or u'')[:max_length])
+        self._profile_json = self.userinfo_json
+
     def get_screen_name(self):
-        return self.userinfo().screen_name
+        if not self.screen_name:
+            self.update_profile()
+        if not self.screen_name:
+            return self.userinfo().screen_name
+        return self.screen_name
+
+    def get_site_friends(self, user=None, chunk_size=ID_CHUNK_SIZE):
+        """
+        Returns the Users who are Twitter friends of `user`.
 
-    screen_name = property(get_screen_name)
+        If `user` is None, default to this User, and return a queryset
+        of the TwitterFollows stored by sync_graph(), as
+        get_synced_site_friends() does.  Otherwise, the friends of
+        `user` are fetched from Twitter and returned as a list, looked
+        up `chunk_size` ids per query.
+        """
+        if user is None:
+            return self.get_synced_site_friends()
+        return list(self.iter_site_friends(user=user, chunk_size=chunk_size))
 
-    def get_site_friends(self, user=None):
+    def get_site_followers(self):
         """
-        Returns a queryset of Users who are Twitter friends of `user`.
+        Returns a queryset of Users who are Twitter followers of this User.
+
+        Uses the TwitterFollows stored by sync_graph(), as
+        get_synced_site_followers() does.
+        """
+        return self.get_synced_site_followers()
+
+    def iter_site_friends(self, user=None, chunk_size=ID_CHUNK_SIZE):
+        """
+        Yields the TwitterUsers who are Twitter friends of `user`.
 
         If `user` is None, default to this User.
+
+        Friends are fetched from Twitter one page of ids at a time, and
+        looked up `chunk_size` ids at a time.
+        """
+        pages = id_pages(self.api().GetFriendIDs, user=user)
+        return self.__class__.objects.iter_twitter_ids(pages, chunk_size)
+
+    def get_synced_site_friends(self):
+        """
+        Returns a queryset of TwitterUsers this User follows on Twitter.
+
+        Uses the TwitterFollows stored by sync_graph(), instead of
+        asking Twitter.
         """
-        friends = fail_whale(self.api().GetFriends)(user=user, cursor=None)
         return self.__class__.objects.filter(
-            twitter_id__in=[f.id for f in friends]
+            twitter_id__in=TwitterFollow.objects.filter(
+                follower_id=self.twitter_id
+            ).values('followed_id')
         )
 
-    def get_site_followers(self):
-        """Returns a queryset of Users who are Twitter followers of this User."""
-        followers = fail_whale(self.api().GetFollowers)(cursor=None)
+    def get_synced_site_followers(self):
+        """
+        Returns a queryset of TwitterUsers following this User on Twitter.
+
+        Uses the TwitterFollows stored by sync_graph(), instead of
+        asking Twitter.
+        """
         return self.__class__.objects.filter(
-            twitter_id__in=[f.id for f in followers]
+            twitter_id__in=TwitterFollow.objects.filter(
+                followed_id=self.twitter_id
+            ).values('follower_id')
         )
 
+    def sync_graph(self):
+        """
+        Updates the stored TwitterFollows of this User from Twitter.
+
+        Like TwitterFollowManager.sync(), it commits nothing, so run it
+        in a transaction.
+
+        Returns ((friends added, friends removed),
+                 (followers added, followers removed)).
+        """
+        api = self.api()
+        friends = TwitterFollow.objects.sync(
+            self.twitter_id, id_pages(api.GetFriendIDs)
+        )
+        followers = TwitterFollow.objects.sync(
+            self.twitter_id, id_pages(api.GetFollowerIDs), followers=True
+        )
+        return friends, followers
+
+    def iter_site_followers(self, chunk_size=ID_CHUNK_SIZE):
+        """
+        Yields the TwitterUsers who are Twitter followers of this User.
+
+        Followers are fetched from Twitter one page of ids at a time,
+        and looked up `chunk_size` ids at a time.
+        """
+        pages = id_pages(self.api().GetFollowerIDs)
+        return self.__class__.objects.iter_twitter_ids(pages, chunk_size)
+
+class TwitterFollowManager(models.Manager):
+    def sync(self, twitter_id, id_pages, followers=False,
+             chunk_size=ID_CHUNK_SIZE):
+        """
+        Updates the stored follows of `twitter_id` from `id_pages`.
+
+        `id_pages` is an iterable of lists of the Twitter ids that
+        `twitter_id` follows, or of its followers if `followers` is
+        True.  Each page is compared with the stored follows: missing
+        ones are inserted `chunk_size` rows per executemany(), since
+        Django 1.2 has no bulk_create(), and the ones missing from every
+        page are removed `chunk_size` at a time.
+
+        Each chunk is inserted in a savepoint, so follows stored by a
+        concurrent sync are skipped.  Nothing is committed: run it in a
+        transaction, as the sync_twitter_graph command does.
+
+        Returns an (added, removed) tuple of counts.
+        """
+        if followers:
+            own_field, other_field = 'followed_id', 'follower_id'
+        else:
+            own_field, other_field = 'follower_id', 'followed_id'
+        follows = self.get_query_set().filter(**{own_field: twitter_id})
+        stored = set(follows.values_list(other_field, flat=True))
+        seen = set()
+        added = 0
+        for ids in id_pages:
+            new_ids = []
+            for other_id in ids:
+                if other_id not in stored and other_id not in seen:
+                    new_ids.append(other_id)
+                seen.add(other_id)
+            for i in xrange(0, len(new_ids), chunk_size):
+                added += self._insert_many(own_field, other_field, twitter_id,
+                                           new_ids[i:i + chunk_size])
+        removed = list(stored - seen)
+        for i in xrange(0, len(removed), chunk_size):
+            follows.filter(
+                **{'%s__in' % other_field: removed[i:i + chunk_size]}
+            ).delete()
+        return added, len(removed)
+
+    def forget(self, twitter_id):
+        """
+        Deletes the follows stored for `twitter_id` by sync().
+
+        Follows to and from other TwitterUsers are kept, as they are
+        also among the friends or followers stored for those users.
+        """
+        site_ids = TwitterUser.objects.values('twitter_id')
+        follows = self.get_query_set()
+        follows.filter(follower_id=twitter_id).exclude(
+            followed_id__in=site_ids
+        ).delete()
+        follows.filter(followed_id=twitter_id).exclude(
+            follower_id__in=site_ids
+        ).delete()
+
+    def _insert_many(self, own_field, other_field, twitter_id, other_ids):
+        """
+        Inserts the follows between `twitter_id` and `other_ids`, and
+        returns how many were inserted.
+
+        If another sync stored some of them first, the follows are
+        inserted one at a time instead, skipping those.
+        """
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO %s (%s, %s) VALUES (%%s, %%s)' % (
+            qn(self.model._meta.db_table), qn(own_field), qn(other_field)
+        )
+        rows = [(twitter_id, other_id) for other_id in other_ids]
+        cursor = connection.cursor()
+        sid = transaction.savepoint()
+        try:
+            cursor.executemany(sql, rows)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            inserted = 0
+            for row in rows:
+                sid = transaction.savepoint()
+                try:
+                    cursor.execute(sql, row)
+                except IntegrityError:
+                    transaction.savepoint_rollback(sid)
+                else:
+                    transaction.savepoint_commit(sid)
+                    inserted += 1
+        else:
+            transaction.savepoint_commit(sid)
+            inserted = len(rows)
+        if inserted and transaction.is_managed():
+            # Raw queries do not mark the transaction as dirty.
+            transaction.set_dirty()
+        return inserted
+
+
+class TwitterFollow(models.Model):
+    """A Twitter user, `follower_id`, following another, `followed_id`."""
+    follower_id = models.BigIntegerField()
+    followed_id = models.BigIntegerField(db_index=True)
+    objects = TwitterFollowManager()
+
+    class Meta:
+        unique_together = (('follower_id', 'followed_id'),)
+
+    def __unicode__(self):
+        return u'%s follows %s' % (self.follower_id, self.followed_id)
+
+
 post_save.connect(TwitterUser.on_create, sender=TwitterUser)
+post_delete.connect(TwitterUser.on_delete, sender=TwitterUser)
+post_save.connect(invalidate_cached_user, sender=User)
+post_delete.connect(invalidate_cached_user, sender=User)
+post_save.connect(invalidate_cached_user, sender=TwitterUser)
+post_delete.connect(invalidate_cached_user, sender=TwitterUser)
+
+if getattr(settings, 'DJANGO_OAUTH_TWITTER_INSTRUMENT', False):
+    default_aggregator().connect()
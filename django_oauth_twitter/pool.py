@@ -0,0 +1,190 @@
+"""
+A small pool of worker threads that return futures.
+
+Calls to Twitter block on the network.  Submitting them to a
+WorkerPool lets a view start several calls at once, and wait only for
+the ones it needs:
+
+    pool = WorkerPool(4)
+    userinfo = pool.submit(api.GetUserInfo)
+    friends = pool.submit(api.GetFriendIDs)
+    print userinfo.result(), friends.result()
+"""
+
+
+from Queue import Queue
+import sys
+import threading
+
+from django.conf import settings
+
+
+class Future(object):
+    """The result of a call that may not have finished yet."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        """Returns True if the call has finished."""
+        return self._done.isSet()
+
+    def result(self, timeout=None):
+        """
+        Returns the result of the call, waiting up to `timeout` seconds.
+
+        Re-raises the exception raised by the call, if any.  Raises
+        TimeoutError if the call does not finish in time.
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Returns the exception raised by the call, or None."""
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, f):
+        """Calls `f` with this future, once the call has finished."""
+        self._lock.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(f)
+                return
+        finally:
+            self._lock.release()
+        f(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        self._lock.acquire()
+        try:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._lock.release()
+        for f in callbacks:
+            f(self)
+
+    def _wait(self, timeout):
+        self._done.wait(timeout)
+        if not self.done():
+            raise TimeoutError('Call did not finish in %s seconds.' % timeout)
+
+
+class WorkerPool(object):
+    """
+    Runs calls on at most `size` daemon threads.
+
+    Threads are only started once there is work for them, and stop
+    once the pool is shut down.
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('size must be at least 1, not %r.' % size)
+        self.size = size
+        self._queue = Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, f, *args, **kwargs):
+        """Calls `f(*args, **kwargs)` on a worker and returns a Future."""
+        future = Future()
+        self._lock.acquire()
+        try:
+            if self._shutdown:
+                raise RuntimeError('Cannot submit to a WorkerPool that has '
+                                   'been shut down.')
+            self._queue.put((future, f, args, kwargs))
+        finally:
+            self._lock.release()
+        self._start_worker()
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Stops the workers once they have run the calls already
+        submitted.  If `wait` is True, waits for them to stop.
+        """
+        self._lock.acquire()
+        try:
+            self._shutdown = True
+            threads = list(self._threads)
+            for thread in threads:
+                self._queue.put(None)
+        finally:
+            self._lock.release()
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def map(self, f, iterable):
+        """Returns the results of calling `f` on each item, in order."""
+        return [future.result()
+                for future in [self.submit(f, item) for item in iterable]]
+
+    def _start_worker(self):
+        self._lock.acquire()
+        try:
+            if not self._shutdown and len(self._threads) < self.size:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        while True:
+            call = self._queue.get()
+            if call is None:
+                return
+            future, f, args, kwargs = call
+            try:
+                result = f(*args, **kwargs)
+            except:
+                future.set_exc_info(sys.exc_info())
+            else:
+                future.set_result(result)
+
+
+class TimeoutError(Exception):
+    pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def default_pool():
+    """
+    Returns the shared WorkerPool.
+
+    Its size is settings.DJANGO_OAUTH_TWITTER_POOL_SIZE, 4 by default.
+    """
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            _pool = WorkerPool(
+                getattr(settings, 'DJANGO_OAUTH_TWITTER_POOL_SIZE', 4)
+            )
+        return _pool
+    finally:
+        _pool_lock.release()
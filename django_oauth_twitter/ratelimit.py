@@ -0,0 +1,271 @@
+"""
+Tracks Twitter's rate limits, and schedules calls around them.
+
+Twitter limits the calls made with each access token, and reports what
+is left of the limit in the X-RateLimit-* headers of its responses.
+RateLimitScheduler reads those headers as responses arrive through the
+transport, and keeps them in the Django cache, so that every process
+knows how much quota each token has left.  Before a request is sent,
+it holds back calls that can wait, such as paging through friend ids,
+while quota is running out:
+
+    scheduler = RateLimitScheduler(RateLimitTracker(),
+                                   deferrable=[r'/friends/ids'])
+    api._urllib = Transport(pool, scheduler=scheduler)
+"""
+
+
+from cgi import parse_qs
+from hashlib import sha1
+import re
+import threading
+import time
+from urlparse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Header prefixes used by the REST API, which reports the quota of the
+# token over all endpoints, and by the newer API, which reports the
+# quota of each endpoint.
+TOKEN_HEADER_PREFIX = 'X-RateLimit-'
+ENDPOINT_HEADER_PREFIX = 'X-Rate-Limit-'
+
+# The quota of a token, over all endpoints.
+ALL_ENDPOINTS = '*'
+
+
+class RateLimitTracker(object):
+    """
+    Stores the rate limit status of each token and endpoint in a cache.
+
+    A status is (remaining, limit, reset), where `reset` is the time
+    the quota is replenished.  It expires from `cache_backend` then.
+    """
+    INDEX_SIZE = 1000
+
+    def __init__(self, cache_backend=None,
+                 key_prefix='django_oauth_twitter:ratelimit'):
+        if cache_backend is None:
+            cache_backend = cache
+        self.cache = cache_backend
+        self.key_prefix = key_prefix
+        self._indexed = set()
+        self._lock = threading.Lock()
+
+    def record(self, token_key, endpoint, remaining, limit, reset):
+        """Stores the status of `endpoint` for the token `token_key`."""
+        timeout = int(reset - time.time()) + 1
+        if timeout <= 0:
+            return
+        key = self._key(token_key, endpoint)
+        self.cache.set(key, (remaining, limit, reset), timeout)
+        self._index(key, token_key, endpoint)
+
+    def status(self, token_key, endpoint):
+        """
+        Returns the (remaining, limit, reset) of `endpoint` for the
+        token `token_key`, or None if it is not known.
+        """
+        status = self.cache.get(self._key(token_key, endpoint))
+        if status is not None and status[2] <= time.time():
+            return None
+        return status
+
+    def entries(self):
+        """
+        Returns a list of the (token_key, endpoint, status) known to
+        this cache, by token and endpoint.
+        """
+        result = []
+        index = self.cache.get(self._key('index')) or {}
+        statuses = self.cache.get_many(index.keys())
+        for key, (token_key, endpoint) in sorted(index.iteritems(),
+                                                 key=lambda i: i[1]):
+            status = statuses.get(key)
+            if status is not None and status[2] > time.time():
+                result.append((token_key, endpoint, status))
+        return result
+
+    def _index(self, key, token_key, endpoint):
+        if key in self._indexed:
+            return
+        self._lock.acquire()
+        try:
+            index_key = self._key('index')
+            index = self.cache.get(index_key) or {}
+            if len(index) >= self.INDEX_SIZE:
+                # Forget the entries that have expired.
+                live = self.cache.get_many(index.keys())
+                index = dict((k, v) for k, v in index.iteritems()
+                             if k in live)
+                self._indexed &= set(index)
+            index[key] = (token_key, endpoint)
+            self.cache.set(index_key, index, 24 * 60 * 60)
+            self._indexed.add(key)
+        finally:
+            self._lock.release()
+
+    def _key(self, *parts):
+        return ':'.join((self.key_prefix,) + parts)
+
+
+class RateLimitScheduler(object):
+    """
+    Holds back calls that can wait while rate limit quota drains.
+
+    Calls to URLs matching one of the `deferrable` regular expressions
+    can wait.  Once less than `reserve` of a token's quota is left,
+    they sleep until the quota is replenished, if that is within
+    `max_delay` seconds, or else raise RateLimited.  This keeps the
+    reserve for calls that cannot wait, such as signing in.  Those are
+    only rejected once no quota is left at all.
+
+    Calls made inside deferring() can also wait, whatever their URL.
+    """
+
+    def __init__(self, tracker, deferrable=(), reserve=0.1, max_delay=5,
+                 sleep=time.sleep):
+        self.tracker = tracker
+        self.deferrable = [re.compile(pattern) for pattern in deferrable]
+        self.reserve = reserve
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self._local = threading.local()
+
+    def deferring(self, f, *args, **kwargs):
+        """
+        Returns `f(*args, **kwargs)`, treating the calls it makes to
+        Twitter as calls that can wait.
+        """
+        deferring = getattr(self._local, 'deferring', False)
+        self._local.deferring = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            self._local.deferring = deferring
+
+    def acquire(self, url, data=None):
+        """
+        Waits until the request for `url`, with POST `data`, may be sent.
+
+        Raises RateLimited if it may not be sent.
+        """
+        token_key, endpoint = self._identify(url, data)
+        if token_key is None:
+            return
+        deferrable = self._deferrable(url)
+        for name in (endpoint, ALL_ENDPOINTS):
+            status = self.tracker.status(token_key, name)
+            if status is None:
+                continue
+            remaining, limit, reset = status
+            if remaining <= 0 or (deferrable and
+                                  remaining < limit * self.reserve):
+                delay = reset - time.time()
+                if not deferrable or delay > self.max_delay:
+                    raise RateLimited(url, reset)
+                self.sleep(max(delay, 0))
+
+    def record(self, url, data, headers):
+        """Records the rate limit `headers` of the response for `url`."""
+        token_key, endpoint = self._identify(url, data)
+        if token_key is None:
+            return
+        # Twitter reports either the quota of this endpoint, or the
+        # quota of the token as a whole.  An endpoint running out of
+        # quota must not hold back calls to the others.
+        status = _parse_headers(headers, ENDPOINT_HEADER_PREFIX)
+        if status is not None:
+            self.tracker.record(token_key, endpoint, *status)
+        status = _parse_headers(headers, TOKEN_HEADER_PREFIX)
+        if status is not None:
+            self.tracker.record(token_key, ALL_ENDPOINTS, *status)
+
+    def _deferrable(self, url):
+        if getattr(self._local, 'deferring', False):
+            return True
+        for pattern in self.deferrable:
+            if pattern.search(url):
+                return True
+        return False
+
+    def _identify(self, url, data):
+        """Returns (token key digest, endpoint path) for a request."""
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        params = parse_qs(query)
+        if data:
+            params.update(parse_qs(data))
+        token = params.get('oauth_token')
+        if not token:
+            return None, None
+        return token_key_digest(token[0]), path
+
+
+class RateLimited(Exception):
+    """Raised instead of calling Twitter without enough quota left."""
+
+    def __init__(self, url, reset):
+        Exception.__init__(self, 'Rate limited until %s: %s' %
+                           (time.ctime(reset), url))
+        self.url = url
+        self.reset = reset
+
+
+def token_key_digest(key):
+    """
+    Returns a digest of an access token's public `key`.
+
+    Requests only carry the token's key, so rate limits are tracked by
+    this digest, instead of the utils.token_digest() of the token.
+    """
+    return sha1(key).hexdigest()
+
+def _parse_headers(headers, prefix):
+    """
+    Returns (remaining, limit, reset) from the `prefix` headers of
+    `headers`, or None.
+    """
+    try:
+        return (int(headers[prefix + 'Remaining']),
+                int(headers[prefix + 'Limit']),
+                int(headers[prefix + 'Reset']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def default_scheduler():
+    """
+    Returns the RateLimitScheduler shared by this process.
+
+    settings.DJANGO_OAUTH_TWITTER_RATELIMIT_DEFERRABLE is a list of
+    regular expressions for the URLs of calls that can wait; friend and
+    follower paging by default.
+    settings.DJANGO_OAUTH_TWITTER_RATELIMIT_RESERVE is the fraction of
+    quota kept for other calls, 0.1 by default.
+    settings.DJANGO_OAUTH_TWITTER_RATELIMIT_MAX_DELAY is how long, in
+    seconds, a call may wait for quota, 5 by default.
+    """
+    global _scheduler
+    _scheduler_lock.acquire()
+    try:
+        if _scheduler is None:
+            _scheduler = RateLimitScheduler(
+                RateLimitTracker(),
+                deferrable=getattr(
+                    settings, 'DJANGO_OAUTH_TWITTER_RATELIMIT_DEFERRABLE',
+                    [r'/friends/ids', r'/followers/ids']
+                ),
+                reserve=getattr(settings,
+                                'DJANGO_OAUTH_TWITTER_RATELIMIT_RESERVE', 0.1),
+                max_delay=getattr(settings,
+                                  'DJANGO_OAUTH_TWITTER_RATELIMIT_MAX_DELAY',
+                                  5),
+            )
+        return _scheduler
+    finally:
+        _scheduler_lock.release()
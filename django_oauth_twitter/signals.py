@@ -7,3 +7,21 @@ twitter_user_created = Signal(providing_args=['twitter_user'])
 # unassociated.
 twitter_user_associated = Signal(providing_args=['twitter_user'])
 twitter_user_unassociated = Signal(providing_args=['user', 'screen_name'])
+
+# These signals instrument calls to Twitter.  `latency` is in seconds.
+#
+# twitter_request is sent after each HTTP request to Twitter, with the
+# `endpoint` path, the HTTP `status`, or None if there was no response,
+# and the number of `bytes` in the response body.
+twitter_request = Signal(providing_args=['endpoint', 'latency', 'status',
+                                         'bytes'])
+# twitter_call is sent after each API call made through a RetryPolicy,
+# such as with fail_whale(), with the `name` of the API method, the
+# number of `retries` and the `error` it raised, if any.
+twitter_call = Signal(providing_args=['name', 'latency', 'retries', 'status',
+                                      'error'])
+# twitter_cache_lookup is sent after each lookup of a cached Twitter
+# response, with the `endpoint` path, the `result`, one of 'hit',
+# 'stale' or 'miss', and the number of `bytes` found, if known.
+twitter_cache_lookup = Signal(providing_args=['endpoint', 'latency', 'result',
+                                              'bytes'])
@@ -1,42 +1,1022 @@
 from __future__ import with_statement
 
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from cgi import parse_qs
 import os
+import threading
+import time
 from urllib import quote
-from urllib2 import HTTPError
+import urllib2
+from urllib2 import HTTPError, URLError
+from urlparse import urlsplit
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, get_cache
 from django.core.urlresolvers import NoReverseMatch, reverse
+from django.db import connection
+from django.http import HttpRequest
 import django.template.loader
 from django.test import TestCase
 
 from mocker import Mocker, ANY, MATCH
 
 from oauth.oauth import OAuthToken
+import twitter
 
+import django_oauth_twitter.models
+import django_oauth_twitter.utils
 from django_oauth_twitter import (ACCESS_KEY, REQUEST_KEY, SUCCESS_URL_KEY,
-                                  USERINFO_KEY)
+                                  USERINFO_KEY, USERINFO_TIME_KEY,
+                                  USERINFO_TOKEN_KEY)
+from django_oauth_twitter.backends import TwitterBackend
+from django_oauth_twitter.cache import (CacheKeys, CachePolicy,
+                                        CompactJsonCodec, DjangoCache,
+                                        DjangoCachedApi, DjangoCacheError,
+                                        LocalCache, ZlibCodec)
+from django_oauth_twitter.instrumentation import (Aggregator, endpoint,
+                                                  percentile, summarize)
 from django_oauth_twitter.middleware import (cached_user_info,
+                                             fetch_user_info,
+                                             refresh_user_info,
                                              set_access_token,
                                              set_request_token)
-from django_oauth_twitter.models import TwitterUser
+from django_oauth_twitter.models import (TwitterAlreadyLinked, TwitterFollow,
+                                         TwitterUser, UserAlreadyLinked,
+                                         user_cache_key)
+from django_oauth_twitter.pool import TimeoutError, WorkerPool
+from django_oauth_twitter.ratelimit import (default_scheduler, RateLimited,
+                                            RateLimitScheduler,
+                                            RateLimitTracker,
+                                            token_key_digest)
+from django_oauth_twitter.transport import (ConnectionPool,
+                                            default_transport, Transport)
 from django_oauth_twitter.test_urls import oauthtwitter
 from django_oauth_twitter.views import LazyReverse, OAuthTwitter
-from django_oauth_twitter.utils import TwitterApi, get_user_info
+from django_oauth_twitter.utils import (AsyncTwitterApi, CircuitBreaker,
+                                        circuit_breaker,
+                                        decode_userinfo_json,
+                                        encode_userinfo_json,
+                                        fail_whale, fail_whale_async,
+                                        get_user_info, retry_policy, RetryPolicy,
+                                        token_digest, TwitterApi,
+                                        TwitterUnavailable)
 
 TOKEN = OAuthToken.from_string('oauth_token=a&oauth_token_secret=b')
 
 
+class FakeApi(object):
+    """Imitates the caching behaviour of twitter.Api._FetchUrl()."""
+    _cache_timeout = 60
+
+    def __init__(self, response='fresh', delay=0):
+        self.response = response
+        self.delay = delay
+        self.fetches = 0
+
+    def SetCache(self, cache):
+        self._cache = cache
+
+    def _FetchUrl(self, url):
+        last_cached = self._cache.GetCachedTime(url)
+        if time.time() >= last_cached + self._cache_timeout:
+            self.fetches += 1
+            time.sleep(self.delay)
+            self._cache.Set(url, self.response)
+            return self.response
+        return self._cache.Get(url)
+
+    def GetUserInfo(self):
+        return self._FetchUrl('http://twitter.com/account/verify_credentials')
+
+
+class FakeRequest(object):
+    """A request with just a `session`."""
+
+    def __init__(self, session=None):
+        self.session = session or {}
+
+
+class QueryCounter(object):
+    """
+    Counts the database queries run in a `with` block.
+
+        with QueryCounter() as queries:
+            User.objects.get(pk=1)
+        self.assertEqual(len(queries), 1)
+
+    Django 1.2 has no assertNumQueries().
+    """
+
+    def __enter__(self):
+        self.debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        return connection.queries
+
+    def __exit__(self, *exc_info):
+        settings.DEBUG = self.debug
+
+
+class StubTwitter(HTTPServer):
+    """
+    Serves canned Twitter responses on localhost, from a thread.
+
+        stub = StubTwitter({'/account/verify_credentials.json': '{...}'})
+        api = TwitterApi(TOKEN)
+        api.GetUserInfo(stub.url + '/account/verify_credentials.json')
+        stub.shutdown()
+
+    A response that is a list is served one item per request.  A
+    response that is an int is sent as that HTTP error status.  A
+    response that is a tuple is a body and a dictionary of headers.  A
+    response that is None closes the connection without answering.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            path, query = urlsplit(self.path)[2:4]
+            length = int(self.headers.get('Content-Length', 0))
+            if length:
+                query = self.rfile.read(length)
+            self.server.requests.append((path, parse_qs(query)))
+            response = self.server.responses.get(path, 404)
+            if isinstance(response, list):
+                response = response.pop(0)
+            if response is None:
+                self.close_connection = 1
+                return
+            headers = {}
+            if isinstance(response, tuple):
+                response, headers = response
+            if isinstance(response, int):
+                self.send_response(response)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(response)))
+            for header in headers.iteritems():
+                self.send_header(*header)
+            self.end_headers()
+            self.wfile.write(response)
+
+        do_POST = do_GET
+
+        def log_message(self, *args):
+            pass
+
+    def __init__(self, responses):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), self.Handler)
+        self.responses = responses
+        self.requests = []
+        self.connections = 0
+        self.url = 'http://127.0.0.1:%d' % self.server_port
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def process_request(self, request, client_address):
+        # Handle each connection on its own thread, so keep-alive
+        # connections do not block each other.
+        self.connections += 1
+        thread = threading.Thread(target=HTTPServer.process_request,
+                                  args=(self, request, client_address))
+        thread.setDaemon(True)
+        thread.start()
+
+
+class DjangoCacheTest(TestCase):
+    def setUp(self):
+        self.backend = get_cache('locmem://')
+
+    def test_miss(self):
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=self.backend)
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        self.assertEqual(api.fetches, 1)
+
+    def test_unknown_entry(self):
+        # Values stored by earlier versions are not (stale_at, data).
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=self.backend)
+        self.backend.set('url', 'raw', 60)
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        self.assertEqual(api.fetches, 1)
+        keys = CacheKeys()
+        DjangoCachedApi(api, cache_backend=self.backend, keys=keys)
+        self.backend.set(keys.key('url'), 'raw', 60)
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        self.assertEqual(api.fetches, 2)
+
+    def test_stale_without_stale_timeout(self):
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=self.backend)
+        self.backend.set('url', (time.time() - 1, 'stale'), 60)
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        self.assertEqual(api.fetches, 1)
+
+    def test_stale_while_revalidate(self):
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=self.backend, stale_timeout=60)
+        self.backend.set('url', (time.time() - 1, 'stale'), 60)
+        # Only the first caller refreshes the stale entry.
+        cache = api._cache
+        self.assertEqual(cache.GetCachedTime('url'), float('-inf'))
+        self.assertEqual(cache.GetCachedTime('url'), float('inf'))
+        self.assertEqual(cache.Get('url'), 'stale')
+        cache.Set('url', 'fresh')
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        self.assertEqual(api.fetches, 0)
+
+    def _fetch_concurrently(self, apis):
+        threads = [threading.Thread(target=api._FetchUrl, args=('url',))
+                   for api in apis]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(api.fetches for api in apis)
+
+    def test_single_flight(self):
+        # Each API stands in for a separate worker process.
+        apis = [FakeApi(delay=0.2) for i in range(5)]
+        for api in apis:
+            DjangoCachedApi(api, cache_backend=self.backend, lock_wait=5)
+        self.assertEqual(self._fetch_concurrently(apis), 1)
+        self.assertEqual(self.backend.get('url')[1], 'fresh')
+
+    def test_single_flight_timeout(self):
+        apis = [FakeApi(delay=0.2) for i in range(3)]
+        for api in apis:
+            DjangoCachedApi(api, cache_backend=self.backend, lock_wait=0.01)
+        self.assertEqual(self._fetch_concurrently(apis), 3)
+
+    def test_threads_share_cache(self):
+        cache = DjangoCache(60, self.backend)
+        cache.Set('a', 'A')
+        cache.Set('b', 'B')
+        looked_up = threading.Event()
+        results = []
+        def lookup_a():
+            cache.GetCachedTime('a')
+            looked_up.set()
+            other.join()
+            results.append(cache.Get('a'))
+        def lookup_b():
+            looked_up.wait()
+            cache.GetCachedTime('b')
+            results.append(cache.Get('b'))
+        other = threading.Thread(target=lookup_b)
+        this = threading.Thread(target=lookup_a)
+        other.start()
+        this.start()
+        this.join()
+        self.assertEqual(results, ['B', 'A'])
+
+    def test_get_requires_get_cached_time(self):
+        cache = DjangoCache(60, self.backend)
+        cache.Set('url', 'fresh')
+        self.assertRaises(DjangoCacheError, cache.Get, 'url')
+        cache.GetCachedTime('url')
+        self.assertEqual(cache.Get('url'), 'fresh')
+
+    def test_namespaced_keys(self):
+        keys = CacheKeys(namespace='token')
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=self.backend, keys=keys)
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        self.assertEqual(api.fetches, 1)
+        self.assertEqual(self.backend.get('url'), None)
+        self.assertEqual(self.backend.get(keys.key('url'))[1], 'fresh')
+        # Other namespaces have entries of their own.
+        other = FakeApi()
+        DjangoCachedApi(other, cache_backend=self.backend,
+                        keys=CacheKeys(namespace='other'))
+        other._FetchUrl('url')
+        self.assertEqual(other.fetches, 1)
+
+    def test_invalidate(self):
+        apis = {}
+        for namespace in ('token', 'other'):
+            apis[namespace] = FakeApi()
+            DjangoCachedApi(apis[namespace], cache_backend=self.backend,
+                            keys=CacheKeys(namespace=namespace))
+            apis[namespace]._FetchUrl('url')
+        CacheKeys(namespace='token').invalidate(self.backend)
+        apis['token']._FetchUrl('url')
+        apis['other']._FetchUrl('url')
+        self.assertEqual(apis['token'].fetches, 2)
+        self.assertEqual(apis['other'].fetches, 1)
+        CacheKeys().invalidate_all(self.backend)
+        apis['token']._FetchUrl('url')
+        apis['other']._FetchUrl('url')
+        self.assertEqual(apis['token'].fetches, 3)
+        self.assertEqual(apis['other'].fetches, 2)
+
+    def test_invalidate_while_fetching(self):
+        keys = CacheKeys(namespace='token')
+        cache = DjangoCache(60, self.backend, keys=keys)
+        cache.GetCachedTime('url')
+        keys.invalidate(self.backend)
+        # Fetched before the invalidation, so discarded.
+        cache.Set('url', 'revoked')
+        self.assertEqual(cache.GetCachedTime('url'), float('-inf'))
+
+    def test_previous_version(self):
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=self.backend,
+                        keys=CacheKeys(namespace='token', version=1))
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        # After a deploy, the first caller refreshes the entry, while
+        # the others are served the previous version's.
+        cache = DjangoCache(60, self.backend,
+                            keys=CacheKeys(namespace='token', version=2))
+        self.assertEqual(cache.GetCachedTime('url'), float('-inf'))
+        self.assertEqual(cache.GetCachedTime('url'), float('inf'))
+        self.assertEqual(cache.Get('url'), 'fresh')
+        cache.Set('url', 'new')
+        cache.GetCachedTime('url')
+        self.assertEqual(cache.Get('url'), 'new')
+
+
+class CachePolicyTest(TestCase):
+    def setUp(self):
+        self.backend = get_cache('locmem://')
+        self.policy = CachePolicy(methods={'GetUserInfo': 3600},
+                                  urls=[(r'/users/show/', 600),
+                                        (r'/direct_messages', 0)])
+
+    def test_timeout(self):
+        policy = self.policy
+        self.assertEqual(policy.timeout('/users/show/1.json', default=60),
+                         600)
+        self.assertEqual(policy.timeout('/statuses/home_timeline.json',
+                                        default=60), 60)
+        self.assertEqual(policy.timeout('/users/show/1.json',
+                                        method='GetUserInfo'), 3600)
+
+    def test_django_cache(self):
+        api = FakeApi()
+        cached_api = DjangoCachedApi(api, cache_backend=self.backend,
+                                     policy=self.policy)
+        cached_api.GetUserInfo()
+        stale_at, value = self.backend.get(
+            'http://twitter.com/account/verify_credentials'
+        )
+        self.assertTrue(stale_at > time.time() + 3000)
+        api._FetchUrl('/users/show/1.json')
+        stale_at, value = self.backend.get('/users/show/1.json')
+        self.assertTrue(stale_at < time.time() + 601)
+        # Never cached.
+        api._FetchUrl('/direct_messages.json')
+        api._FetchUrl('/direct_messages.json')
+        self.assertEqual(self.backend.get('/direct_messages.json'), None)
+        self.assertEqual(api.fetches, 4)
+
+
+class LocalCacheTest(TestCase):
+    def test_lru(self):
+        local = LocalCache(max_bytes=10, timeout=60)
+        local.set('a', 'aaaa', 4)
+        local.set('b', 'bbbb', 4)
+        self.assertEqual(local.get('a'), 'aaaa')
+        # 'b' is the least recently used.
+        local.set('c', 'cccc', 4)
+        self.assertEqual(local.get('b'), None)
+        self.assertEqual(local.get('c'), 'cccc')
+        # Too big to cache.
+        local.set('d', 'd' * 11, 11)
+        self.assertEqual(local.get('d'), None)
+        self.assertEqual(local.stats(), {'hits': 2, 'misses': 2,
+                                         'evictions': 1, 'items': 2,
+                                         'bytes': 8, 'max_bytes': 10})
+
+    def test_timeout(self):
+        local = LocalCache(max_bytes=10, timeout=0)
+        local.set('a', 'aaaa', 4)
+        self.assertEqual(local.get('a'), None)
+        self.assertEqual(len(local), 0)
+
+    def test_django_cache(self):
+        backend = get_cache('locmem://')
+        local = LocalCache(max_bytes=1024, timeout=60)
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=backend, local_cache=local)
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        backend.delete('url')
+        self.assertEqual(api._FetchUrl('url'), 'fresh')
+        self.assertEqual(api.fetches, 1)
+        self.assertEqual(local.hits, 1)
+
+
+class CodecTest(TestCase):
+    JSON = '[%s]' % ', '.join(['{"id": %d, "screen_name": "user"}' % i
+                               for i in range(100)])
+
+    def test_zlib(self):
+        codec = ZlibCodec(threshold=100)
+        data = codec.encode(self.JSON)
+        self.assertTrue(len(data) < len(self.JSON))
+        self.assertEqual(codec.decode(data), self.JSON)
+        self.assertEqual(codec.decode(codec.encode('short')), 'short')
+        # Values stored before the codec was in use.
+        self.assertEqual(codec.decode('legacy'), 'legacy')
+
+    def test_compact_json(self):
+        codec = ZlibCodec(threshold=100, codec=CompactJsonCodec())
+        self.assertEqual(codec.decode(codec.encode(self.JSON)),
+                         self.JSON.replace(' ', ''))
+        token = 'oauth_token=a&oauth_token_secret=b'
+        self.assertEqual(codec.decode(codec.encode(token)), token)
+
+    def test_django_cache(self):
+        backend = get_cache('locmem://')
+        cache = DjangoCache(60, backend, codec=ZlibCodec(threshold=100))
+        cache.Set('url', self.JSON)
+        self.assertTrue(len(backend.get('url')[1]) < len(self.JSON))
+        cache.GetCachedTime('url')
+        self.assertEqual(cache.Get('url'), self.JSON)
+
+    def test_userinfo_json(self):
+        json = '{"screen_name": "twitter", "id": 1}'
+        self.assertEqual(encode_userinfo_json(json),
+                         '{"id":1,"screen_name":"twitter"}')
+        settings.DJANGO_OAUTH_TWITTER_USERINFO_COMPRESS_THRESHOLD = 0
+        try:
+            data = encode_userinfo_json(json)
+        finally:
+            del settings.DJANGO_OAUTH_TWITTER_USERINFO_COMPRESS_THRESHOLD
+        self.assertTrue(data.startswith('zlib:'))
+        self.assertEqual(decode_userinfo_json(data),
+                         '{"id":1,"screen_name":"twitter"}')
+        self.assertEqual(decode_userinfo_json(json), json)
+
+
+class FakeGraphApi(object):
+    """Serves pages of friend and follower ids."""
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def GetFriendIDs(self, user=None, cursor=-1):
+        if cursor == -1:
+            cursor = 0
+        next_cursor = cursor + 1
+        if next_cursor == len(self.pages):
+            next_cursor = 0
+        return {'ids': self.pages[cursor], 'next_cursor': next_cursor}
+
+    GetFollowerIDs = GetFriendIDs
+
+
+class TwitterUserTest(TestCase):
+    def setUp(self):
+        self.mocker = Mocker()
+        self.twitter_users = []
+        for i in range(1, 6):
+            user = User.objects.create_user('user%d' % i, '', 'password')
+            self.twitter_users.append(
+                TwitterUser.objects.create(user=user, twitter_id=i * 10,
+                                           userinfo_json='{}')
+            )
+
+    def test_iter_site_friends(self):
+        twitter_user = self.twitter_users[0]
+        twitter_user._api = FakeGraphApi([[20, 21, 30], [31, 40], [41]])
+        friends = twitter_user.iter_site_friends(chunk_size=2)
+        self.assertEqual(sorted(f.twitter_id for f in friends), [20, 30, 40])
+        followers = twitter_user.iter_site_followers(chunk_size=2)
+        self.assertEqual(sorted(f.twitter_id for f in followers),
+                         [20, 30, 40])
+
+    def test_get_site_friends(self):
+        twitter_user = self.twitter_users[0]
+        twitter_user._api = FakeGraphApi([[20, 21, 30], [31, 40], [41]])
+        with QueryCounter() as queries:
+            friends = twitter_user.get_site_friends(user='other',
+                                                    chunk_size=2)
+        self.assertEqual(sorted(f.twitter_id for f in friends), [20, 30, 40])
+        # One query per chunk of each page of ids.
+        self.assertEqual(len(queries), 4)
+        # This User's friends and followers are only read from the
+        # stored follows, which sync_graph() updates.
+        self.assertEqual(list(twitter_user.get_site_friends()), [])
+        self.assertEqual(list(twitter_user.get_site_followers()), [])
+        twitter_user.sync_graph()
+        self.assertEqual(
+            sorted(f.twitter_id for f in twitter_user.get_site_friends()),
+            [20, 30, 40]
+        )
+        self.assertEqual(
+            sorted(f.twitter_id for f in twitter_user.get_site_followers()),
+            [20, 30, 40]
+        )
+
+    def test_sync_graph(self):
+        twitter_user = self.twitter_users[0]
+        twitter_user._api = FakeGraphApi([[20, 21], [30]])
+        self.assertEqual(twitter_user.sync_graph(), ((3, 0), (3, 0)))
+        self.assertEqual(
+            sorted(t.twitter_id
+                   for t in twitter_user.get_synced_site_friends()),
+            [20, 30]
+        )
+        twitter_user._api = FakeGraphApi([[21, 40]])
+        self.assertEqual(twitter_user.sync_graph(), ((1, 2), (1, 2)))
+        self.assertEqual(
+            sorted(t.twitter_id
+                   for t in twitter_user.get_synced_site_followers()),
+            [40]
+        )
+        self.assertEqual(TwitterFollow.objects.count(), 4)
+
+    def test_sync_batches(self):
+        with QueryCounter() as queries:
+            self.assertEqual(
+                TwitterFollow.objects.sync(10, [[20, 21, 30], [31, 40]],
+                                           chunk_size=2),
+                (5, 0)
+            )
+        # One SELECT of the stored follows, then one INSERT per chunk.
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(
+            sorted(TwitterFollow.objects.values_list('followed_id',
+                                                     flat=True)),
+            [20, 21, 30, 31, 40]
+        )
+
+    def test_sync_concurrently(self):
+        def id_pages():
+            # Another sync stores a follow after this one read them.
+            TwitterFollow.objects.create(follower_id=10, followed_id=20)
+            yield [20, 30]
+        self.assertEqual(TwitterFollow.objects.sync(10, id_pages()), (1, 0))
+        self.assertEqual(
+            sorted(TwitterFollow.objects.values_list('followed_id',
+                                                     flat=True)),
+            [20, 30]
+        )
+
+    def test_delete_forgets_follows(self):
+        TwitterFollow.objects.sync(10, [[20, 60]])
+        TwitterFollow.objects.sync(10, [[30, 70]], followers=True)
+        TwitterFollow.objects.sync(20, [[10, 60]])
+        self.twitter_users[0].delete()
+        # Only the follows between 10 and users of no other TwitterUser
+        # are deleted.
+        self.assertEqual(
+            sorted(TwitterFollow.objects.values_list('follower_id',
+                                                     'followed_id')),
+            [(10, 20), (20, 10), (20, 60), (30, 10)]
+        )
+
+    def test_profile_columns(self):
+        twitter_user = self.twitter_users[0]
+        json = '{"screen_name": "twitter", "name": "Twitter", "id": 10}'
+        twitter_user.userinfo_json = json
+        twitter_user.save()
+        twitter_user = TwitterUser.objects.get(screen_name='twitter')
+        self.assertEqual(twitter_user.name, 'Twitter')
+        self.assertEqual(unicode(twitter_user), 'twitter')
+        userinfo = self.mocker.mock()
+        userinfo.AsJsonString()
+        self.mocker.result('{"screen_name": "renamed", "id": 10}')
+        with self.mocker:
+            self.assertTrue(twitter_user.update_userinfo(userinfo))
+        self.assertEqual(twitter_user.screen_name, 'renamed')
+        self.assertEqual(twitter_user.name, '')
+
+    def test_userinfo_memoized(self):
+        twitter_user = self.twitter_users[0]
+        twitter_user.userinfo_json = '{"screen_name": "twitter"}'
+        userinfo = twitter_user.userinfo()
+        self.assertEqual(userinfo.screen_name, 'twitter')
+        self.assertTrue(twitter_user.userinfo() is userinfo)
+        twitter_user.userinfo_json = '{"screen_name": "renamed"}'
+        self.assertEqual(twitter_user.userinfo().screen_name, 'renamed')
+
+    def test_iter_twitter_ids(self):
+        ids = TwitterUser.objects.iter_twitter_ids([[10, 11], [], [50]])
+        self.assertEqual(sorted(t.twitter_id for t in ids), [10, 50])
+
+    def test_with_userinfo(self):
+        TwitterUser.objects.update(userinfo_json='{"screen_name": "t"}')
+        for n in (2, 5):
+            with QueryCounter() as queries:
+                twitter_users = list(TwitterUser.objects.filter(
+                    twitter_id__lte=n * 10
+                ).with_userinfo())
+                for twitter_user in twitter_users:
+                    self.assertEqual(twitter_user.userinfo_dict(),
+                                     {'screen_name': 't'})
+                    self.assertEqual(twitter_user.userinfo().screen_name, 't')
+                    user = twitter_user.user
+                    self.assertTrue(user.twitter is twitter_user)
+            self.assertEqual(len(twitter_users), n)
+            self.assertEqual(len(queries), 1)
+        self.assertEqual(TwitterUser.objects.with_userinfo().count(), 5)
+
+    def test_for_users(self):
+        User.objects.create_user('unlinked', '', 'password')
+        for n in (3, 6):
+            users = list(User.objects.order_by('pk')[:n])
+            with QueryCounter() as queries:
+                pairs = TwitterUser.objects.for_users(users)
+                for user, twitter_user in pairs:
+                    if twitter_user is not None:
+                        self.assertTrue(user.twitter is twitter_user)
+                        self.assertTrue(twitter_user.user is user)
+                        twitter_user.userinfo()
+            self.assertEqual(len(queries), 1)
+            self.assertEqual([user for user, twitter_user in pairs], users)
+        self.assertEqual([t and t.twitter_id for u, t in pairs],
+                         [10, 20, 30, 40, 50, None])
+        with QueryCounter() as queries:
+            TwitterUser.objects.for_users(users, chunk_size=2)
+        self.assertEqual(len(queries), 3)
+
+    def test_invalidate_cache(self):
+        twitter_user = self.twitter_users[0]
+        twitter_user.access_token = TOKEN
+        keys = django_oauth_twitter.models.cache_keys(TOKEN)
+        generation = keys.generation(cache)
+        twitter_user.invalidate_cache()
+        self.assertNotEqual(keys.generation(cache), generation)
+        self.assertEqual(keys.generation(cache)[0], generation[0])
+
+    def test_64_bit_twitter_ids(self):
+        twitter_id = 2 ** 40
+        twitter_user = self.twitter_users[0]
+        twitter_user.twitter_id = twitter_id
+        twitter_user.save()
+        TwitterFollow.objects.create(follower_id=twitter_id,
+                                     followed_id=twitter_id + 1)
+        ids = TwitterUser.objects.iter_twitter_ids([[twitter_id]])
+        self.assertEqual([t.twitter_id for t in ids], [twitter_id])
+        self.assertEqual(
+            TwitterFollow.objects.get(follower_id=twitter_id).followed_id,
+            twitter_id + 1
+        )
+
+    def _token(self, key):
+        return OAuthToken.from_string('oauth_token=%s&oauth_token_secret=s' %
+                                      key)
+
+    def _replace_twitter_api(self, errors):
+        """Answers GetUserInfo() with the HTTP error code for each key."""
+        calls = []
+        def TwitterApi(token):
+            class Api(object):
+                def GetUserInfo(self):
+                    calls.append(token.key)
+                    if errors.get(token.key):
+                        raise HTTPError('url', errors[token.key], '', {},
+                                        None)
+                    return 'userinfo'
+            return Api()
+        original = django_oauth_twitter.models.TwitterApi
+        django_oauth_twitter.models.TwitterApi = TwitterApi
+        self.addCleanup(setattr, django_oauth_twitter.models, 'TwitterApi',
+                        original)
+        return calls
+
+    def test_is_revoked_cached(self):
+        calls = self._replace_twitter_api({'cached': 401})
+        twitter_user = self.twitter_users[0]
+        twitter_user.access_token = self._token('cached')
+        self.assertTrue(twitter_user.is_revoked())
+        self.assertTrue(twitter_user.is_revoked())
+        # A new token is checked again.
+        twitter_user.access_token = self._token('new')
+        self.assertFalse(twitter_user.is_revoked())
+        self.assertEqual(calls, ['cached', 'new'])
+
+    def test_sweep_revoked(self):
+        self._replace_twitter_api({'revoked': 401, 'error': 403})
+        for i, key in enumerate(['revoked', 'valid', 'error']):
+            self.twitter_users[i].access_token = self._token(key)
+            self.twitter_users[i].save()
+        results = list(TwitterUser.objects.sweep_revoked(pool=WorkerPool(2)))
+        self.assertEqual([(t.user.username, revoked)
+                          for t, revoked in results[:2]],
+                         [('user1', True), ('user2', False)])
+        self.assertEqual(results[2][1].code, 403)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(
+            sorted(TwitterUser.objects.values_list('twitter_id', flat=True)),
+            [20, 30, 40, 50]
+        )
+
+    def test_sweep_revoked_own_pool(self):
+        # The pool sweep_revoked() starts for itself is shut down.
+        self._replace_twitter_api({})
+        pools = []
+        class RecordingPool(WorkerPool):
+            def __init__(self, size):
+                WorkerPool.__init__(self, size)
+                pools.append(self)
+        original = django_oauth_twitter.models.WorkerPool
+        django_oauth_twitter.models.WorkerPool = RecordingPool
+        self.addCleanup(setattr, django_oauth_twitter.models, 'WorkerPool',
+                        original)
+        for i, twitter_user in enumerate(self.twitter_users):
+            twitter_user.access_token = self._token('valid%d' % i)
+            twitter_user.save()
+        results = list(TwitterUser.objects.sweep_revoked(concurrency=2))
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(pools), 1)
+        for thread in pools[0]._threads:
+            thread.join(5)
+            self.assertFalse(thread.isAlive())
+
+    def test_create_twitter_user(self):
+        user = User.objects.create_user('new', '', 'password')
+        userinfo = twitter.User(id=60, screen_name='new')
+        with QueryCounter() as queries:
+            twitter_user = TwitterUser.objects.create_twitter_user(
+                user, TOKEN, userinfo
+            )
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(user.twitter is twitter_user)
+        self.assertEqual(twitter_user.screen_name, 'new')
+        user = User.objects.get(pk=user.pk)
+        self.assertRaises(UserAlreadyLinked,
+                          TwitterUser.objects.create_twitter_user,
+                          user, TOKEN, twitter.User(id=70, screen_name='x'))
+        other = User.objects.create_user('other', '', 'password')
+        self.assertRaises(TwitterAlreadyLinked,
+                          TwitterUser.objects.create_twitter_user,
+                          other, TOKEN, userinfo)
+
+    def test_get_by_access_token(self):
+        user = User.objects.create_user('new', '', 'password')
+        twitter_user = TwitterUser.objects.create_twitter_user(
+            user, TOKEN, twitter.User(id=60, screen_name='new')
+        )
+        self.assertEqual(twitter_user.access_token_hash, token_digest(TOKEN))
+        self.assertEqual(TwitterUser.objects.get_by_access_token(TOKEN),
+                         twitter_user)
+        # The hash follows the token.
+        token = self._token('other')
+        twitter_user.access_token = token
+        twitter_user.save()
+        self.assertRaises(TwitterUser.DoesNotExist,
+                          TwitterUser.objects.get_by_access_token, TOKEN)
+        self.assertEqual(TwitterUser.objects.get_by_access_token(token),
+                         twitter_user)
+        twitter_user.access_token = None
+        self.assertEqual(twitter_user.access_token_hash, '')
+        self.assertEqual(twitter_user.access_token, None)
+
+    def test_update_or_create(self):
+        user = User.objects.create_user('new', '', 'password')
+        userinfo = twitter.User(id=60, screen_name='new')
+        with QueryCounter() as queries:
+            twitter_user, created = TwitterUser.objects.update_or_create(
+                user, TOKEN, userinfo
+            )
+        self.assertTrue(created)
+        self.assertEqual(len(queries), 2)
+        # Nothing changed.
+        user = User.objects.get(pk=user.pk)
+        with QueryCounter() as queries:
+            twitter_user, created = TwitterUser.objects.update_or_create(
+                user, TOKEN, userinfo
+            )
+        self.assertFalse(created)
+        self.assertEqual(len(queries), 1)
+        # The user info changed.
+        userinfo = twitter.User(id=60, screen_name='renamed')
+        with QueryCounter() as queries:
+            TwitterUser.objects.update_or_create(user, TOKEN, userinfo)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(TwitterUser.objects.get(user=user).screen_name,
+                         'renamed')
+
+    def test_refresh_userinfo(self):
+        stub = StubTwitter({
+            '/same.json': '{"id":10,"screen_name":"same"}',
+            '/changed.json': '{"id":20,"screen_name":"changed"}',
+            '/error.json': 401,
+            '/limited.json': '{"id":40,"screen_name":"limited"}',
+        })
+        def TwitterApi(token):
+            api = django_oauth_twitter.utils.TwitterApi()
+            api._access_token = token
+            class StubApi(object):
+                def GetUserInfo(self):
+                    return api.GetUserInfo('%s/%s.json' % (stub.url,
+                                                           token.key))
+            return StubApi()
+        self.addCleanup(stub.server_close)
+        self.addCleanup(stub.shutdown)
+        original = django_oauth_twitter.models.TwitterApi
+        django_oauth_twitter.models.TwitterApi = TwitterApi
+        self.addCleanup(setattr, django_oauth_twitter.models, 'TwitterApi',
+                        original)
+        self.twitter_users[0].userinfo_json = encode_userinfo_json(
+            '{"id":10,"screen_name":"same"}'
+        )
+        for i, key in enumerate(['same', 'changed', 'error', 'limited']):
+            self.twitter_users[i].access_token = self._token(key)
+            self.twitter_users[i].save()
+        # Little quota is left, so the refresh may not use it.
+        default_scheduler().tracker.record(token_key_digest('limited'), '*',
+                                           1, 150, time.time() + 60)
+        results = list(TwitterUser.objects.refresh_userinfo(
+            pool=WorkerPool(2), chunk_size=3
+        ))
+        self.assertEqual([(t.twitter_id, changed)
+                          for t, changed in results[:2]],
+                         [(10, False), (20, True)])
+        self.assertEqual(results[2][1].code, 401)
+        self.assertTrue(isinstance(results[3][1], RateLimited))
+        self.assertEqual(len(results), 4)
+        twitter_user = TwitterUser.objects.get(twitter_id=20)
+        self.assertEqual(twitter_user.screen_name, 'changed')
+        self.assertEqual(len(stub.requests), 3)
+
+
+class TwitterBackendTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.backend = TwitterBackend()
+        self.user = User.objects.create_user('twitter', '', 'password')
+        self.twitter_user = TwitterUser.objects.create(
+            user=self.user, twitter_id=10,
+            userinfo_json='{"screen_name": "twitter"}'
+        )
+
+    def test_authenticate(self):
+        with QueryCounter() as queries:
+            user = self.backend.authenticate(twitter_id=10)
+            self.assertEqual(user, self.user)
+            self.assertEqual(user.twitter.screen_name, 'twitter')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.backend.authenticate(twitter_id=20), None)
+
+    def test_get_user(self):
+        with QueryCounter() as queries:
+            user = self.backend.get_user(self.user.pk)
+            self.assertEqual(user.twitter.screen_name, 'twitter')
+        self.assertEqual(len(queries), 1)
+        # Cached, but for the UNCACHED_USER_FIELDS.
+        with QueryCounter() as queries:
+            user = self.backend.get_user(self.user.pk)
+            self.assertEqual(user, self.user)
+            self.assertEqual(user.username, 'twitter')
+            self.assertEqual(user.twitter.screen_name, 'twitter')
+            self.assertTrue(user.twitter.user is user)
+            self.assertTrue(user.check_password('password'))
+        self.assertEqual(len(queries), 1)
+        user_fields = cache.get(user_cache_key(self.user.pk))[0]
+        self.assertFalse('password' in user_fields)
+        # Saving either one drops the cached pair.
+        self.twitter_user.userinfo_json = '{"screen_name": "renamed"}'
+        self.twitter_user.save()
+        user = self.backend.get_user(self.user.pk)
+        self.assertEqual(user.twitter.screen_name, 'renamed')
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.assertEqual(self.backend.get_user(self.user.pk).first_name,
+                         'Renamed')
+        self.assertEqual(self.backend.get_user(-1), None)
+
+    def test_get_user_deactivated(self):
+        self.backend.get_user(self.user.pk)
+        # QuerySet.update() sends no signal to drop the cached User.
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.backend.get_user(self.user.pk), None)
+        cache.clear()
+        self.assertEqual(self.backend.get_user(self.user.pk), None)
+
+    def test_get_user_unlinked(self):
+        self.backend.get_user(self.user.pk)
+        self.twitter_user.delete()
+        user = self.backend.get_user(self.user.pk)
+        self.assertEqual(user, self.user)
+        self.assertRaises(TwitterUser.DoesNotExist, lambda: user.twitter)
+        user = self.backend.get_user(self.user.pk)
+        self.assertRaises(TwitterUser.DoesNotExist, lambda: user.twitter)
+
+
 class MiddlewareTest(TestCase):
     def setUp(self):
         self.mocker = Mocker()
 
     def test_set_access_token(self):
+        request = FakeRequest({USERINFO_KEY: '{"id": 1}',
+                               USERINFO_TIME_KEY: time.time(),
+                               USERINFO_TOKEN_KEY: 'digest'})
+        set_access_token(request, TOKEN)
+        self.assertEqual(request.session, {ACCESS_KEY: TOKEN.to_string()})
+        self.assertEqual(request.twitter_access_token, TOKEN)
+
+    def test_session_user_info(self):
+        settings.DJANGO_OAUTH_TWITTER_USERINFO_MAX_AGE = 60
         request = self.mocker.mock()
-        request.session[ACCESS_KEY] = TOKEN.to_string()
-        request.twitter_access_token = TOKEN
+        session = {USERINFO_KEY: '{"screen_name": "twitter"}',
+                   USERINFO_TIME_KEY: time.time(),
+                   USERINFO_TOKEN_KEY: token_digest(TOKEN)}
+        request.session
+        self.mocker.result(session)
+        self.mocker.count(1, None)
+        key = 'django_oauth_twitter:userinfo:%s' % token_digest(TOKEN)
+        try:
+            with self.mocker:
+                # Fresh copy in the session: Twitter isn't called.
+                userinfo = cached_user_info(request, TOKEN)
+                self.assertEqual(userinfo.screen_name, 'twitter')
+                # Stale copy, refreshed out-of-band.
+                session[USERINFO_TIME_KEY] = 0
+                cache.set(key, ('{"screen_name": "renamed"}', time.time()))
+                userinfo = cached_user_info(request, TOKEN)
+                self.assertEqual(userinfo.screen_name, 'renamed')
+                self.assertTrue(session[USERINFO_TIME_KEY] > 0)
+        finally:
+            del settings.DJANGO_OAUTH_TWITTER_USERINFO_MAX_AGE
+            cache.delete(key)
+
+    def test_session_user_info_other_token(self):
+        # The session holds the user info of another account.
+        settings.DJANGO_OAUTH_TWITTER_USERINFO_MAX_AGE = 60
+        other = OAuthToken('other', 'secret')
+        request = FakeRequest({USERINFO_KEY: '{"id": 111}',
+                               USERINFO_TIME_KEY: time.time(),
+                               USERINFO_TOKEN_KEY: token_digest(other)})
+        userinfo = self.mocker.mock()
+        userinfo.id
+        self.mocker.result(222)
+        userinfo.AsJsonString()
+        self.mocker.result('{"id": 222}')
+        gui = self.mocker.replace(get_user_info)
+        gui(TOKEN)
+        self.mocker.result(userinfo)
+        try:
+            with self.mocker:
+                self.assertEqual(cached_user_info(request, TOKEN).id, 222)
+        finally:
+            del settings.DJANGO_OAUTH_TWITTER_USERINFO_MAX_AGE
+        self.assertEqual(request.session[USERINFO_TOKEN_KEY],
+                         token_digest(TOKEN))
+
+    def test_fetch_user_info(self):
+        # A copy in the session is never used.
+        request = FakeRequest({USERINFO_KEY: '{"id": 111}',
+                               USERINFO_TIME_KEY: time.time(),
+                               USERINFO_TOKEN_KEY: token_digest(TOKEN)})
+        userinfo = self.mocker.mock()
+        userinfo.AsJsonString()
+        self.mocker.result('{"id": 222}')
+        gui = self.mocker.replace(get_user_info)
+        gui(TOKEN)
+        self.mocker.result(userinfo)
         with self.mocker:
-            set_access_token(request, TOKEN)
+            self.assertTrue(fetch_user_info(request, TOKEN) is userinfo)
+        self.assertEqual(request.session[USERINFO_KEY], '{"id": 222}')
+        self.assertTrue(request.twitter_userinfo is userinfo)
+
+    def test_fetch_user_info_retries(self):
+        # Twitter is only tried as often as the retry policy allows.
+        stub = StubTwitter({'/account/verify_credentials.json': 503})
+        self.addCleanup(stub.server_close)
+        self.addCleanup(stub.shutdown)
+        original = django_oauth_twitter.utils.TwitterApi
+        def TwitterApi(token):
+            api = original()
+            api._access_token = token
+            class StubApi(object):
+                def GetUserInfo(self):
+                    return api.GetUserInfo(
+                        stub.url + '/account/verify_credentials.json'
+                    )
+            return StubApi()
+        django_oauth_twitter.utils.TwitterApi = TwitterApi
+        self.addCleanup(setattr, django_oauth_twitter.utils, 'TwitterApi',
+                        original)
+        breaker = circuit_breaker()
+        breaker._succeeded(probing=True)
+        self.addCleanup(breaker._succeeded, True)
+        self.assertRaises(HTTPError, fetch_user_info, FakeRequest(), TOKEN)
+        self.assertEqual(len(stub.requests), retry_policy().max_tries)
+
+    def test_refresh_user_info(self):
+        userinfo = self.mocker.mock()
+        userinfo.AsJsonString()
+        self.mocker.result('{"screen_name": "twitter"}')
+        gui = self.mocker.replace(get_user_info)
+        gui(TOKEN)
+        self.mocker.result(userinfo)
+        key = 'django_oauth_twitter:userinfo:%s' % token_digest(TOKEN)
+        with self.mocker:
+            refresh_user_info(TOKEN, 60)
+        self.assertEqual(cache.get(key)[0], '{"screen_name": "twitter"}')
+        cache.delete(key)
 
     def test_set_request_token(self):
         request = self.mocker.mock()
@@ -65,6 +1045,535 @@ class UtilsTest(TestCase):
         with self.mocker:
             self.assertEqual(get_user_info(TOKEN), 'GetUserInfo')
 
+    def test_get_user_info_policy(self):
+        # The retry policy is looked up when get_user_info() is called.
+        policy = RetryPolicy(max_tries=1)
+        self.addCleanup(setattr, django_oauth_twitter.utils, '_retry_policy',
+                        django_oauth_twitter.utils._retry_policy)
+        django_oauth_twitter.utils._retry_policy = policy
+        Api = self.mocker.replace(TwitterApi)
+        Api(TOKEN).GetUserInfo()
+        self.mocker.throw(HTTPError('url', 503, 'Unavailable', {}, None))
+        with self.mocker:
+            self.assertRaises(HTTPError, get_user_info, TOKEN)
+        self.assertEqual(policy.metrics['attempts'], 1)
+        self.assertEqual(policy.metrics['failures'], 1)
+
+
+class PoolTest(TestCase):
+    def test_submit(self):
+        pool = WorkerPool(2)
+        self.assertEqual(pool.submit(lambda a, b: a + b, 1, b=2).result(), 3)
+        self.assertEqual(pool.map(lambda x: x * 2, range(5)), [0, 2, 4, 6, 8])
+        self.assertEqual(len(pool._threads), 2)
+
+    def test_exception(self):
+        future = WorkerPool(1).submit(int, 'x')
+        self.assertTrue(isinstance(future.exception(), ValueError))
+        self.assertRaises(ValueError, future.result)
+
+    def test_shutdown(self):
+        pool = WorkerPool(2)
+        event = threading.Event()
+        future = pool.submit(event.wait, 5)
+        pool.submit(int, '1')
+        pool.shutdown(wait=False)
+        self.assertRaises(RuntimeError, pool.submit, int, '2')
+        event.set()
+        pool.shutdown()
+        # Calls submitted before the shutdown still run.
+        self.assertTrue(future.result(0))
+        self.assertFalse([t for t in pool._threads if t.isAlive()])
+
+    def test_timeout(self):
+        event = threading.Event()
+        future = WorkerPool(1).submit(event.wait)
+        self.assertRaises(TimeoutError, future.result, 0.01)
+        results = []
+        future.add_done_callback(results.append)
+        event.set()
+        future.result(5)
+        self.assertEqual(results, [future])
+
+
+class AsyncTwitterApiTest(TestCase):
+    def setUp(self):
+        settings.TWITTER_CONSUMER_KEY = 'KEY'
+        settings.TWITTER_CONSUMER_SECRET = 'SECRET'
+        self.stub = StubTwitter({
+            '/account/verify_credentials.json':
+                '{"id":1,"screen_name":"twitter"}',
+            '/oauth/request_token': 'oauth_token=c&oauth_token_secret=d',
+            '/oauth/access_token': [503,
+                                    'oauth_token=e&oauth_token_secret=f'],
+            '/friends/ids/twitter.json': ['{"ids":[1,2],"next_cursor":5}',
+                                  '{"ids":[3],"next_cursor":0}'],
+        })
+        self.pool = WorkerPool(2)
+
+    def tearDown(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+
+    def api(self, token):
+        # Some python-twitter releases refuse OAuthApi's access token in
+        # Api.__init__(), so sign with the token after construction.
+        api = TwitterApi()
+        api._access_token = token
+        api.base_url = self.stub.url
+        return api
+
+    def test_get_user_info(self):
+        api = AsyncTwitterApi(api=self.api(TOKEN), pool=self.pool)
+        future = api.GetUserInfo(self.stub.url +
+                                 '/account/verify_credentials.json')
+        self.assertEqual(future.result(5).screen_name, 'twitter')
+        path, query = self.stub.requests[0]
+        self.assertEqual(query['oauth_token'], ['a'])
+        self.assertTrue('oauth_signature' in query)
+
+    def test_token_exchange(self):
+        api = AsyncTwitterApi(pool=self.pool)
+        token = api.getRequestToken(self.stub.url + '/oauth/request_token')
+        self.assertEqual(token.result(5).key, 'c')
+        # The first attempt is Service Temporarily Unavailable.
+        api = AsyncTwitterApi(api=self.api(token.result()), pool=self.pool)
+        token = api.getAccessToken(self.stub.url + '/oauth/access_token')
+        self.assertEqual(token.result(5).key, 'e')
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_friend_ids(self):
+        api = AsyncTwitterApi(api=self.api(TOKEN), pool=self.pool)
+        future = api.GetFriendIDs(user='twitter')
+        self.assertEqual(future.result(5), [1, 2, 3])
+        self.assertEqual([query['cursor'] for path, query in self.stub.requests],
+                         [['-1'], ['5']])
+
+    def test_cached(self):
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=get_cache('locmem://'))
+        async_api = AsyncTwitterApi(api=api, pool=self.pool)
+        self.assertEqual(async_api.GetUserInfo().result(5), 'fresh')
+        self.assertEqual(async_api.GetUserInfo().result(5), 'fresh')
+        self.assertEqual(api.fetches, 1)
+
+    def test_fail_whale_async(self):
+        calls = []
+        def f():
+            calls.append(1)
+            if len(calls) < 3:
+                raise HTTPError('url', 503, 'Unavailable', {}, None)
+            return 'whale'
+        self.assertEqual(fail_whale_async(f, self.pool)().result(5), 'whale')
+        self.assertEqual(len(calls), 3)
+
+
+class TransportTest(TestCase):
+    def setUp(self):
+        self.stub = StubTwitter({'/a': 'A', '/b': 'B', '/error': 503})
+
+    def tearDown(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+
+    def open(self, transport, path, data=None):
+        opener = transport.build_opener()
+        try:
+            return opener.open(self.stub.url + path, data).read()
+        finally:
+            opener.close()
+
+    def test_keep_alive(self):
+        transport = Transport(ConnectionPool(size=1, timeout=5))
+        self.assertEqual(self.open(transport, '/a'), 'A')
+        self.assertEqual(self.open(transport, '/b', 'x=1'), 'B')
+        self.assertEqual(self.open(transport, '/a'), 'A')
+        self.assertEqual(self.stub.connections, 1)
+        self.assertEqual(transport.pool.opened, 1)
+        transport.pool.clear()
+        self.assertEqual(self.open(transport, '/a'), 'A')
+        self.assertEqual(self.stub.connections, 2)
+
+    def test_pool_size(self):
+        transport = Transport(ConnectionPool(size=0, timeout=5))
+        self.open(transport, '/a')
+        self.open(transport, '/a')
+        self.assertEqual(transport.pool.opened, 2)
+
+    def test_idle_timeout(self):
+        transport = Transport(ConnectionPool(timeout=5, idle_timeout=0))
+        self.open(transport, '/a')
+        self.open(transport, '/a')
+        self.assertEqual(transport.pool.opened, 2)
+
+    def test_http_error(self):
+        transport = Transport(ConnectionPool(timeout=5))
+        try:
+            self.open(transport, '/error')
+        except HTTPError, e:
+            self.assertEqual(e.code, 503)
+        else:
+            self.fail('HTTPError not raised')
+        # The connection is still reusable after an error.
+        self.assertEqual(self.open(transport, '/a'), 'A')
+        self.assertEqual(transport.pool.opened, 1)
+
+    def test_closed_connection(self):
+        # The server closes a kept-alive connection without answering.
+        # Only the GET is sent again.
+        transport = Transport(ConnectionPool(timeout=5), proxies={})
+        self.stub.responses['/closed'] = [None, 'C', None]
+        self.open(transport, '/a')
+        self.assertEqual(self.open(transport, '/closed'), 'C')
+        self.open(transport, '/a')
+        self.assertRaises(URLError, self.open, transport, '/closed', 'x=1')
+        self.assertEqual([path for path, query in self.stub.requests],
+                         ['/a', '/closed', '/closed', '/a', '/closed'])
+
+    def test_proxy(self):
+        transport = Transport(ConnectionPool(timeout=5),
+                              proxies={'http': 'http://proxy:3128'})
+        opener = transport.build_opener()
+        self.assertTrue(isinstance(opener, urllib2.OpenerDirector))
+        self.assertTrue([handler for handler in opener.handlers
+                         if isinstance(handler, urllib2.ProxyHandler)])
+
+    def test_twitter_api(self):
+        settings.TWITTER_CONSUMER_KEY = 'KEY'
+        settings.TWITTER_CONSUMER_SECRET = 'SECRET'
+        self.assertTrue(TwitterApi()._urllib is default_transport())
+
+
+class RetryPolicyTest(TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.calls = 0
+
+    def policy(self, **kwargs):
+        return RetryPolicy(sleep=self.sleeps.append, random=lambda: 1.0,
+                           **kwargs)
+
+    def failing(self, *errors):
+        errors = list(errors)
+        def f():
+            self.calls += 1
+            if errors:
+                raise errors.pop(0)
+            return 'whale'
+        return f
+
+    def unavailable(self, headers=None):
+        return HTTPError('url', 503, 'Unavailable', headers or {}, None)
+
+    def test_backoff(self):
+        policy = self.policy(max_tries=4, max_delay=0.3)
+        f = fail_whale(self.failing(*[self.unavailable()] * 3), policy)
+        self.assertEqual(f(), 'whale')
+        self.assertEqual(self.sleeps, [0.1, 0.2, 0.3])
+        self.assertEqual(policy.metrics['attempts'], 4)
+        self.assertEqual(policy.metrics['retries'], 3)
+
+    def test_gives_up(self):
+        policy = self.policy()
+        f = fail_whale(self.failing(*[self.unavailable()] * 3), policy)
+        self.assertRaises(HTTPError, f)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(policy.metrics['failures'], 1)
+        # Other errors are not retried.
+        self.calls = 0
+        f = fail_whale(self.failing(HTTPError('url', 404, 'Not Found', {},
+                                              None)), policy)
+        self.assertRaises(HTTPError, f)
+        self.assertEqual(self.calls, 1)
+
+    def test_retry_after(self):
+        policy = self.policy(max_delay=5)
+        error = self.unavailable({'Retry-After': '2'})
+        self.assertEqual(fail_whale(self.failing(error), policy)(), 'whale')
+        self.assertEqual(self.sleeps, [2])
+        # Waiting longer than max_delay ties up the worker, so give up.
+        error = self.unavailable({'Retry-After': '60'})
+        self.assertRaises(HTTPError, fail_whale(self.failing(error), policy))
+        self.assertEqual(self.sleeps, [2])
+
+    def test_budget(self):
+        policy = self.policy(budget_ratio=0.5, budget_max=1)
+        f = fail_whale(self.failing(self.unavailable()), policy)
+        self.assertEqual(f(), 'whale')
+        f = fail_whale(self.failing(self.unavailable()), policy)
+        self.assertRaises(HTTPError, f)
+        self.assertEqual(policy.metrics['budget_exhausted'], 1)
+        # Successful calls earn back the budget.
+        fail_whale(self.failing(), policy)()
+        f = fail_whale(self.failing(self.unavailable()), policy)
+        self.assertEqual(f(), 'whale')
+        self.assertEqual(policy.metrics['retries'], 2)
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(threshold=2, cooldown=60,
+                                      cache_backend=get_cache('locmem://'))
+        self.calls = 0
+
+    def call(self, error=None):
+        def f():
+            self.calls += 1
+            if error is not None:
+                raise error
+            return 'whale'
+        return self.breaker.call(f)
+
+    def test_opens(self):
+        error = HTTPError('url', 500, 'Internal Server Error', {}, None)
+        self.assertRaises(HTTPError, self.call, error)
+        self.assertFalse(self.breaker.is_open())
+        self.assertRaises(HTTPError, self.call, error)
+        self.assertTrue(self.breaker.is_open())
+        self.assertRaises(TwitterUnavailable, self.call)
+        self.assertEqual(self.calls, 2)
+
+    def test_client_errors(self):
+        # Twitter answering 401 Unauthorized is not an outage.
+        error = HTTPError('url', 401, 'Unauthorized', {}, None)
+        for i in range(3):
+            self.assertRaises(HTTPError, self.call, error)
+        self.assertFalse(self.breaker.is_open())
+
+    def cool_down(self):
+        self.breaker.cache.set(self.breaker._key('open'), time.time() - 1, 60)
+
+    def test_probe(self):
+        # Once the cooldown is over, one call probes Twitter, and fails.
+        self.cool_down()
+        self.assertRaises(URLError, self.call, URLError('timed out'))
+        self.assertTrue(self.breaker.is_open())
+        self.assertRaises(TwitterUnavailable, self.call)
+        # Only one call probes at a time.
+        self.cool_down()
+        self.breaker.cache.add(self.breaker._key('probe'), True, 60)
+        self.assertRaises(TwitterUnavailable, self.call)
+        # A successful probe closes the circuit.
+        self.breaker.cache.delete(self.breaker._key('probe'))
+        self.assertEqual(self.call(), 'whale')
+        self.assertFalse(self.breaker.is_open())
+        self.assertEqual(self.call(), 'whale')
+        self.assertEqual(self.calls, 3)
+
+    def test_retry_policy(self):
+        policy = RetryPolicy(breaker=self.breaker, sleep=lambda delay: None)
+        error = HTTPError('url', 503, 'Unavailable', {}, None)
+        def f():
+            self.calls += 1
+            raise error
+        self.assertRaises(TwitterUnavailable, fail_whale(f, policy))
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(policy.metrics['retries'], 2)
+
+
+class RateLimitTest(TestCase):
+    def setUp(self):
+        self.tracker = RateLimitTracker(cache_backend=get_cache('locmem://'))
+        self.sleeps = []
+        self.scheduler = RateLimitScheduler(self.tracker,
+                                            deferrable=[r'/friends/ids'],
+                                            reserve=0.1, max_delay=5,
+                                            sleep=self.sleeps.append)
+        self.token_key = token_key_digest('a')
+
+    def test_tracker(self):
+        reset = time.time() + 60
+        self.tracker.record(self.token_key, '/users/show.json', 5, 150, reset)
+        self.tracker.record(self.token_key, '/friends/ids.json', 9, 15, reset)
+        self.tracker.record(self.token_key, '/expired.json', 9, 15,
+                            time.time() - 1)
+        self.assertEqual(self.tracker.status(self.token_key,
+                                             '/users/show.json'),
+                         (5, 150, reset))
+        self.assertEqual(self.tracker.status(self.token_key, '/expired.json'),
+                         None)
+        self.assertEqual(
+            [(endpoint, status[0])
+             for token_key, endpoint, status in self.tracker.entries()],
+            [('/friends/ids.json', 9), ('/users/show.json', 5)]
+        )
+
+    def test_deferrable(self):
+        url = 'http://twitter.com/friends/ids.json?oauth_token=a'
+        self.scheduler.acquire(url)
+        self.tracker.record(self.token_key, '*', 10, 150, time.time() + 2)
+        self.scheduler.acquire(url)
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertTrue(0 < self.sleeps[0] <= 2)
+        # Too long to wait.
+        self.tracker.record(self.token_key, '*', 10, 150, time.time() + 60)
+        self.assertRaises(RateLimited, self.scheduler.acquire, url)
+        # Other calls use up the reserve.
+        self.scheduler.acquire('http://twitter.com/users/show.json',
+                               'oauth_token=a')
+        self.tracker.record(self.token_key, '*', 0, 150, time.time() + 60)
+        self.assertRaises(RateLimited, self.scheduler.acquire,
+                          'http://twitter.com/users/show.json',
+                          'oauth_token=a')
+        # Other tokens have their own quota.
+        self.scheduler.acquire(url.replace('=a', '=b'))
+
+    def test_transport(self):
+        reset = int(time.time()) + 60
+        stub = StubTwitter({'/users/show.json': [
+            ('{}', {'X-RateLimit-Remaining': '0',
+                    'X-RateLimit-Limit': '150',
+                    'X-RateLimit-Reset': str(reset)}),
+        ]})
+        try:
+            transport = Transport(ConnectionPool(timeout=5), self.scheduler)
+            url = stub.url + '/users/show.json?oauth_token=a'
+            transport.build_opener().open(url).read()
+            # The REST API reports the quota of the whole token.
+            self.assertEqual(self.tracker.status(self.token_key, '*'),
+                             (0, 150, reset))
+            self.assertRaises(RateLimited, transport.build_opener().open, url)
+            self.assertEqual(len(stub.requests), 1)
+        finally:
+            stub.shutdown()
+            stub.server_close()
+
+    def test_endpoint_quota(self):
+        # The newer API reports the quota of each endpoint, so running
+        # out on one does not throttle the others.
+        reset = int(time.time()) + 60
+        stub = StubTwitter({
+            '/1.1/friends/ids.json': [
+                ('{}', {'X-Rate-Limit-Remaining': '0',
+                        'X-Rate-Limit-Limit': '15',
+                        'X-Rate-Limit-Reset': str(reset)}),
+            ],
+            '/1.1/account/verify_credentials.json': '{}',
+        })
+        self.addCleanup(stub.server_close)
+        self.addCleanup(stub.shutdown)
+        transport = Transport(ConnectionPool(timeout=5), self.scheduler)
+        friends = stub.url + '/1.1/friends/ids.json?oauth_token=a'
+        transport.build_opener().open(friends).read()
+        self.assertEqual(self.tracker.status(self.token_key, '*'), None)
+        self.assertRaises(RateLimited, transport.build_opener().open,
+                          friends)
+        credentials = (stub.url +
+                       '/1.1/account/verify_credentials.json?oauth_token=a')
+        self.assertEqual(transport.build_opener().open(credentials).read(),
+                         '{}')
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        self.aggregator = Aggregator(cache_backend=get_cache('locmem://'))
+        self.aggregator.connect()
+        self.addCleanup(self.aggregator.disconnect)
+
+    def stats(self):
+        return dict(self.aggregator.stats())
+
+    def test_endpoint(self):
+        self.assertEqual(endpoint('http://twitter.com/users/show/12.json'
+                                  '?oauth_token=a'),
+                         '/users/show/:id.json')
+
+    def test_call(self):
+        policy = RetryPolicy(sleep=lambda delay: None, random=lambda: 1.0)
+        errors = [HTTPError('url', 503, 'Unavailable', {}, None)]
+        def GetUser():
+            if errors:
+                raise errors.pop(0)
+            return 'whale'
+        self.assertEqual(fail_whale(GetUser, policy)(), 'whale')
+        def GetFriends():
+            raise HTTPError('url', 404, 'Not Found', {}, None)
+        self.assertRaises(HTTPError, fail_whale(GetFriends, policy))
+        stats = self.stats()
+        self.assertEqual(stats[('call', 'GetUser')]['count'], 1)
+        self.assertEqual(stats[('call', 'GetUser')]['retries'], 1)
+        self.assertEqual(stats[('call', 'GetUser')]['errors'], 0)
+        self.assertEqual(stats[('call', 'GetFriends')]['errors'], 1)
+
+    def test_cache_lookup(self):
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=get_cache('locmem://'),
+                        stale_timeout=60)
+        api._FetchUrl('http://twitter.com/statuses/1.json')
+        api._FetchUrl('http://twitter.com/statuses/1.json')
+        api._cache._cache.set('http://twitter.com/statuses/3.json',
+                              (time.time() - 1, 'stale'), 60)
+        # Another caller is refreshing the stale entry.
+        api._cache._lock('http://twitter.com/statuses/3.json')
+        api._FetchUrl('http://twitter.com/statuses/3.json')
+        stats = self.stats()[('cache', '/statuses/:id.json')]
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual((stats['miss'], stats['hit'], stats['stale']),
+                         (1, 1, 1))
+        self.assertEqual(stats['bytes'], len('fresh') + len('stale'))
+
+    def test_cache_and_request_endpoints(self):
+        # Cache lookups and requests of a URL are counted together,
+        # although python-twitter prefixes its cache keys.
+        stub = StubTwitter({'/users/show/12.json': '{}'})
+        self.addCleanup(stub.server_close)
+        self.addCleanup(stub.shutdown)
+        url = stub.url + '/users/show/12.json?oauth_token=a'
+        api = FakeApi()
+        DjangoCachedApi(api, cache_backend=get_cache('locmem://'))
+        api._FetchUrl('12345-AbCd:' + url)
+        Transport(ConnectionPool(timeout=5)).build_opener().open(url).read()
+        stats = self.stats()
+        self.assertEqual(stats[('cache', '/users/show/:id.json')]['count'], 1)
+        self.assertEqual(stats[('request', '/users/show/:id.json')]['count'],
+                         1)
+
+    def test_request(self):
+        stub = StubTwitter({'/a/1': 'A', '/error': 503})
+        self.addCleanup(stub.server_close)
+        self.addCleanup(stub.shutdown)
+        opener = Transport(ConnectionPool(timeout=5)).build_opener()
+        opener.open(stub.url + '/a/1')
+        self.assertRaises(HTTPError, opener.open, stub.url + '/error')
+        stats = self.stats()
+        self.assertEqual(stats[('request', '/a/:id')]['bytes'], 1)
+        self.assertEqual(stats[('request', '/a/:id')]['errors'], 0)
+        self.assertEqual(stats[('request', '/error')]['errors'], 1)
+
+    def test_percentiles(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 50), None)
+        for latency in (0.3, 0.1, 0.2):
+            self.aggregator.record(('call', 'f'), latency)
+        [(key, stats)] = self.aggregator.stats()
+        self.assertEqual((stats['p50'], stats['p90'], stats['max']),
+                         (0.2, 0.3, 0.3))
+
+    def test_sample_size(self):
+        aggregator = Aggregator(sample_size=2)
+        for latency in (0.3, 0.1, 0.2):
+            aggregator.record(('call', 'f'), latency)
+        [(key, stats)] = aggregator.stats()
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual(stats['max'], 0.2)
+
+    def test_published(self):
+        backend = get_cache('locmem://')
+        first = Aggregator(cache_backend=backend, key_prefix='test')
+        second = Aggregator(cache_backend=backend, key_prefix='test')
+        # As if published by another process.
+        second._process_key = lambda: 'test:other:1'
+        first.record(('call', 'f'), 0.1)
+        second.record(('call', 'f'), 0.2, error=True)
+        first.publish()
+        second.publish()
+        first.publish()
+        [(key, stats)] = summarize(first.published())
+        self.assertEqual((stats['count'], stats['errors'], stats['max']),
+                         (2, 1, 0.2))
+
 
 class LazyReverseTest(TestCase):
     urls = 'django_oauth_twitter.test_urls'
@@ -152,10 +1661,7 @@ class OAuthTwitterTest(TestCase):
         self.mocker.count(1, 3)
         Api(ANY).GetUserInfo()
         self.mocker.result(userinfo)
-        Api(ANY).GetUserInfo()
-        self.mocker.result(userinfo)
-        Api(ANY).GetUserInfo()
-        self.mocker.result(userinfo)
+        self.mocker.count(1, 2)
         with self.mocker:
             # User goes off to Twitter and gets redirected back to callback
             response = self.client.get(reverse('twitter_signin_associate'))
@@ -207,8 +1713,6 @@ class OAuthTwitterTest(TestCase):
         self.mocker.count(1, 3)
         Api(ANY).GetUserInfo()
         self.mocker.result(userinfo)
-        Api(ANY).GetUserInfo()
-        self.mocker.result(userinfo)
         with self.mocker:
             # User goes off to Twitter and gets redirected back to callback
             response = self.client.get(reverse('twitter_signin_associate'))
@@ -288,11 +1792,12 @@ class OAuthTwitterTest(TestCase):
         Api(TOKEN).getAccessToken()
         self.mocker.result(TOKEN)
         request.twitter_access_token = ANY
+        request.twitter_userinfo = ANY
         request.user
         self.mocker.result(AnonymousUser())
         userinfo = self.mocker.mock()
-        cui = self.mocker.replace(cached_user_info)
-        cui(request, TOKEN)
+        fui = self.mocker.replace(fetch_user_info)
+        fui(request, TOKEN)
         self.mocker.result(userinfo)
         o._authenticate(userinfo=userinfo)
         self.mocker.result(None)
@@ -304,12 +1809,12 @@ class OAuthTwitterTest(TestCase):
         Api(TOKEN).getAccessToken()
         self.mocker.result(TOKEN)
         request.twitter_access_token = ANY
+        request.twitter_userinfo = ANY
         request.user
         self.mocker.result(User.objects.get(username='password'))
         self.mocker.count(1, 2)
-        cui(request, TOKEN)
+        fui(request, TOKEN)
         self.mocker.result(userinfo)
-        self.mocker.count(1, 2)
         userinfo.id
         self.mocker.result(3)
         userinfo.AsJsonString()
@@ -329,6 +1834,32 @@ class OAuthTwitterTest(TestCase):
         self.assertTrue(response['Location'].startswith(prefix),
                         response['Location'])
 
+    def test_signin_unavailable(self):
+        breaker = circuit_breaker()
+        breaker._open()
+        try:
+            response = self.client.get(reverse('twitter_signin'))
+        finally:
+            breaker._succeeded(probing=True)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(breaker.cooldown))
+        self.assertTemplateUsed(response,
+                                'django_oauth_twitter/unavailable.html')
+
+    def test_add_association_unavailable(self):
+        # No session copy of the user info, and Twitter is down.
+        request = HttpRequest()
+        request.session = {}
+        request.user = User.objects.get(username='password')
+        breaker = circuit_breaker()
+        breaker._open()
+        try:
+            response = oauthtwitter._add_association(request, TOKEN)
+        finally:
+            breaker._succeeded(probing=True)
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(TwitterUser.objects.filter(user=request.user))
+
     def test_register(self):
         # User goes directly to the register page.
         response = self.client.get(reverse(oauthtwitter.register))
@@ -0,0 +1,315 @@
+"""
+A pooled, keep-alive HTTP transport for oauth-python-twitter.
+
+oauth-python-twitter opens every URL with urllib2, which makes a new
+TCP and TLS connection for each request.  Transport stands in for the
+urllib2 module on an OAuthApi, so its requests reuse connections from
+a shared ConnectionPool:
+
+    api = OAuthApi(consumer_key=KEY, consumer_secret=SECRET)
+    api._urllib = Transport(ConnectionPool(size=10, timeout=10))
+
+utils.TwitterApi() does this with default_transport().
+"""
+
+
+from cStringIO import StringIO
+import errno
+import httplib
+import socket
+import threading
+import time
+from urllib import getproxies
+import urllib2
+from urllib2 import HTTPError, URLError
+from urlparse import urljoin, urlsplit
+
+from django.conf import settings
+
+from django_oauth_twitter.instrumentation import endpoint
+from django_oauth_twitter.ratelimit import default_scheduler
+from django_oauth_twitter.signals import twitter_request
+
+
+MAX_REDIRECTS = 5
+
+# Methods that may be sent twice without harm.
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+# Errors sending a request on a connection the server already closed.
+CLOSED_ERRNOS = (errno.EPIPE, errno.ECONNRESET)
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to `size` idle connections open to each host.
+
+    `timeout` is the socket timeout, in seconds, for connecting and for
+    each read.  Idle connections are dropped after `idle_timeout`
+    seconds, before the server is likely to have closed them.
+    """
+
+    def __init__(self, size=10, timeout=None, idle_timeout=30,
+                 ssl_context=None):
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self.opened = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, scheme, netloc):
+        """
+        Returns (connection, reused) for `scheme`://`netloc`.
+
+        `reused` is True if the connection was idle in the pool.
+        """
+        key = (scheme, netloc)
+        now = time.time()
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key, [])
+            while idle:
+                connection, idle_since = idle.pop()
+                if now - idle_since < self.idle_timeout:
+                    return connection, True
+                connection.close()
+            self.opened += 1
+        finally:
+            self._lock.release()
+        return self._connect(scheme, netloc), False
+
+    def release(self, scheme, netloc, connection):
+        """Returns `connection` to the pool, or closes it if it is full."""
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.size:
+                idle.append((connection, time.time()))
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+    def clear(self):
+        """Closes every idle connection."""
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+        for connections in idle.itervalues():
+            for connection, idle_since in connections:
+                connection.close()
+
+    def _connect(self, scheme, netloc):
+        if scheme == 'https':
+            kwargs = {}
+            if self.ssl_context is not None:
+                kwargs['context'] = self.ssl_context
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout,
+                                           **kwargs)
+        elif scheme == 'http':
+            return httplib.HTTPConnection(netloc, timeout=self.timeout)
+        raise URLError('unknown url type: %s' % scheme)
+
+
+class Transport(object):
+    """
+    Imitates the urllib2 module, for the parts OAuthApi uses.
+
+    Openers from build_opener() send their requests over `pool`.  If
+    there is a ratelimit.RateLimitScheduler `scheduler`, requests wait
+    for its go-ahead, and it is told of the rate limits in responses.
+
+    The pool connects to Twitter directly.  If an HTTP or HTTPS proxy
+    is configured in `proxies`, which defaults to the http_proxy and
+    https_proxy environment variables, build_opener() returns urllib2's
+    opener instead, which goes through the proxy.
+    """
+    __version__ = '1.0'
+
+    def __init__(self, pool, scheduler=None, proxies=None):
+        self.pool = pool
+        self.scheduler = scheduler
+        self.proxies = proxies
+
+    def build_opener(self, *handlers):
+        proxies = self.proxies
+        if proxies is None:
+            proxies = getproxies()
+        if proxies.get('http') or proxies.get('https'):
+            return urllib2.build_opener(urllib2.ProxyHandler(proxies),
+                                        *handlers)
+        return PooledOpener(self.pool, self.scheduler)
+
+
+class PooledOpener(object):
+    """Imitates urllib2.OpenerDirector, using a ConnectionPool."""
+
+    def __init__(self, pool, scheduler=None):
+        self.pool = pool
+        self.scheduler = scheduler
+
+    def open(self, url, data=None):
+        """
+        Returns a Response for `url`, POSTing `data` if it is given.
+
+        Raises HTTPError if the response is not successful, and
+        URLError if there is no response.  Raises RateLimited if the
+        scheduler does not let the request through.
+
+        Sends the twitter_request signal once there is a response, or
+        once there is none.
+        """
+        if self.scheduler is not None:
+            self.scheduler.acquire(url, data)
+        status = size = None
+        start = time.time()
+        try:
+            response = self._open(url, data)
+            status, size = response.code, response.size
+            return response
+        except HTTPError, e:
+            status, size = e.code, getattr(e.fp, 'size', None)
+            raise
+        finally:
+            twitter_request.send_robust(sender=Transport,
+                                        endpoint=endpoint(url),
+                                        latency=time.time() - start,
+                                        status=status, bytes=size)
+
+    def close(self):
+        pass
+
+    def _open(self, url, data):
+        for redirects in range(MAX_REDIRECTS + 1):
+            response = self._request(url, data)
+            if self.scheduler is not None:
+                self.scheduler.record(url, data, response.info())
+            location = response.info().get('location')
+            if response.code in (301, 302, 303, 307) and location:
+                # Follow the redirection with a GET, as urllib2 does.
+                url, data = urljoin(url, location), None
+                continue
+            if not 200 <= response.code < 300:
+                raise HTTPError(url, response.code, response.msg,
+                                response.info(), response)
+            return response
+        raise HTTPError(url, response.code, 'Too many redirects',
+                        response.info(), response)
+
+    def _request(self, url, data):
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        if query:
+            path += '?' + query
+        method, headers = 'GET', {}
+        if data is not None:
+            method = 'POST'
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        while True:
+            connection, reused = self.pool.acquire(scheme, netloc)
+            sent = False
+            try:
+                connection.request(method, path or '/', data, headers)
+                sent = True
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                connection.close()
+                if reused and _closed_while_idle(method, e, sent):
+                    continue
+                raise URLError(e)
+            if response.will_close:
+                connection.close()
+            else:
+                self.pool.release(scheme, netloc, connection)
+            return Response(url, response, body)
+
+
+def _closed_while_idle(method, e, sent):
+    """
+    Returns True if the request failed with `e` because the server had
+    closed the idle connection, so that it is safe to send again.
+
+    That is only when the request may be sent twice, and nothing was
+    received: the server either reset the connection while the request
+    was being `sent`, or closed it without answering.  Timeouts are not
+    retried, as the server may still be handling the request.
+    """
+    if method not in IDEMPOTENT_METHODS or isinstance(e, socket.timeout):
+        return False
+    if isinstance(e, httplib.BadStatusLine):
+        return True
+    if sent or not isinstance(e, socket.error):
+        return False
+    return getattr(e, 'errno', None) in CLOSED_ERRNOS
+
+
+class Response(object):
+    """A fully read response, like the ones urllib2 returns."""
+
+    def __init__(self, url, response, body):
+        self.url = url
+        self.code = response.status
+        self.msg = response.reason
+        self.headers = response.msg
+        self.size = len(body)
+        self._body = StringIO(body)
+
+    def read(self, *args):
+        return self._body.read(*args)
+
+    def readline(self, *args):
+        return self._body.readline(*args)
+
+    def readlines(self, *args):
+        return self._body.readlines(*args)
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def close(self):
+        pass
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def default_transport():
+    """
+    Returns the Transport shared by this process.
+
+    settings.DJANGO_OAUTH_TWITTER_HTTP_POOL_SIZE is the number of idle
+    connections kept open to each host, 10 by default.
+    settings.DJANGO_OAUTH_TWITTER_HTTP_TIMEOUT is the socket timeout,
+    in seconds, 10 by default.
+    settings.DJANGO_OAUTH_TWITTER_HTTP_IDLE_TIMEOUT is how long, in
+    seconds, an idle connection is kept open, 30 by default.
+
+    Requests are scheduled by ratelimit.default_scheduler().
+    """
+    global _transport
+    _transport_lock.acquire()
+    try:
+        if _transport is None:
+            pool = ConnectionPool(
+                size=getattr(settings, 'DJANGO_OAUTH_TWITTER_HTTP_POOL_SIZE',
+                             10),
+                timeout=getattr(settings, 'DJANGO_OAUTH_TWITTER_HTTP_TIMEOUT',
+                                10),
+                idle_timeout=getattr(
+                    settings, 'DJANGO_OAUTH_TWITTER_HTTP_IDLE_TIMEOUT', 30
+                ),
+            )
+            _transport = Transport(pool, default_scheduler())
+        return _transport
+    finally:
+        _transport_lock.release()
@@ -1,13 +1,27 @@
+import base64
 from cgi import parse_qs
+from email.utils import mktime_tz, parsedate_tz
+from hashlib import sha1
+import random
+import sys
+import threading
+import time
 from urllib import urlencode
 from urllib2 import HTTPError, URLError
 from urlparse import urlsplit, urlunsplit
+import zlib
 
 from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.core.cache import cache
 from django.core.urlresolvers import Resolver404, resolve, reverse
 from django.utils.functional import update_wrapper
 
+import simplejson
+
+from django_oauth_twitter.pool import default_pool
+from django_oauth_twitter.signals import twitter_call
+from django_oauth_twitter.transport import default_transport
 
 try:
     from oauthtwitter import OAuthApi
@@ -23,35 +37,464 @@ except AttributeError:
 def TwitterApi(token=None):
     """
     Returns an OAuthApi object, given an optional `token`.
+
+    Its requests share the keep-alive connections of
+    transport.default_transport().
     """
     # Use the default consumer key and secret from settings.
-    return OAuthApi(consumer_key=settings.TWITTER_CONSUMER_KEY,
-                    consumer_secret=settings.TWITTER_CONSUMER_SECRET,
-                    access_token=token)
+    api = OAuthApi(consumer_key=settings.TWITTER_CONSUMER_KEY,
+                   consumer_secret=settings.TWITTER_CONSUMER_SECRET,
+                   access_token=token)
+    api._urllib = default_transport()
+    return api
 
 
-def fail_whale(f):
-    MAX_TRIES = 3
-    def wrapper(*args, **kwargs):
-        for tries in range(MAX_TRIES - 1):
+class RetryPolicy(object):
+    """
+    Retries calls to Twitter when it is temporarily unavailable.
+
+    A call is tried up to `max_tries` times.  Before each retry, it
+    waits a random time of up to `base_delay` * 2 ** retries seconds,
+    but no more than `max_delay` seconds.  If Twitter answers with a
+    Retry-After header, it waits that long instead, or gives up if that
+    is more than `max_delay` seconds.
+
+    Retries are limited by a budget, so that during an outage they do
+    not multiply the load on Twitter.  Each call adds `budget_ratio` to
+    the budget, up to `budget_max`, and each retry spends 1 from it.
+    Once the budget is spent, calls are not retried.
+
+    If there is a CircuitBreaker `breaker`, each attempt goes through
+    it, so no attempts are made while Twitter is known to be down.
+
+    The counts in `metrics` are: calls, attempts, retries, calls given
+    up on because the budget was spent, and calls that failed.  Each
+    call also sends the twitter_call signal.
+    """
+
+    def __init__(self, max_tries=3, base_delay=0.1, max_delay=5,
+                 budget_ratio=0.1, budget_max=10, sleep=time.sleep,
+                 random=random.random, breaker=None):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self.budget = budget_max
+        self.sleep = sleep
+        self.random = random
+        self.breaker = breaker
+        self.metrics = dict.fromkeys(['calls', 'attempts', 'retries',
+                                      'budget_exhausted', 'failures'], 0)
+        self._lock = threading.Lock()
+
+    def __call__(self, f):
+        """Returns a version of `f` that is retried by this policy."""
+        def wrapper(*args, **kwargs):
+            self._count('calls', budget=self.budget_ratio)
+            start = time.time()
+            for retries in range(self.max_tries):
+                self._count('attempts')
+                try:
+                    if self.breaker is not None:
+                        result = self.breaker.call(f, *args, **kwargs)
+                    else:
+                        result = f(*args, **kwargs)
+                except URLError, e:
+                    exc_info = sys.exc_info()
+                    delay = self._retry_delay(e, retries)
+                    if delay is None:
+                        self._count('failures')
+                        self._called(f, start, retries, e)
+                        raise exc_info[0], exc_info[1], exc_info[2]
+                    self._count('retries')
+                    self.sleep(delay)
+                except Exception, e:
+                    exc_info = sys.exc_info()
+                    self._called(f, start, retries, e)
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                else:
+                    self._called(f, start, retries)
+                    return result
+        return update_wrapper(wrapper, f)
+
+    def delay(self, e, retries):
+        """
+        Returns how long to wait, in seconds, before retrying after the
+        URLError `e`, or None if the call should not be retried.
+        """
+        if isinstance(e, HTTPError):
+            if e.code != 503:
+                # Retry when Service Temporarily Unavailable
+                return None
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                if retry_after > self.max_delay:
+                    return None
+                return retry_after
+        else:
+            errno = getattr(e.reason, 'args', [None])[0]
+            if errno != 8:
+                # Retry when EOF occurred in violation of protocol
+                return None
+        # Full jitter spreads out the retries of concurrent callers.
+        return self.random() * min(self.max_delay,
+                                   self.base_delay * 2 ** retries)
+
+    def _retry_delay(self, e, retries):
+        """
+        Returns how long to wait before retrying after the URLError `e`,
+        or None if the retries or their budget are spent.
+        """
+        if retries + 1 == self.max_tries:
+            return None
+        delay = self.delay(e, retries)
+        if delay is not None and not self._spend():
+            self._count('budget_exhausted')
+            return None
+        return delay
+
+    def _called(self, f, start, retries, error=None):
+        twitter_call.send_robust(sender=RetryPolicy,
+                                 name=getattr(f, '__name__', None),
+                                 latency=time.time() - start,
+                                 retries=retries,
+                                 status=getattr(error, 'code', None),
+                                 error=error)
+
+    def _count(self, metric, budget=0):
+        self._lock.acquire()
+        try:
+            self.metrics[metric] += 1
+            self.budget = min(self.budget + budget, self.budget_max)
+        finally:
+            self._lock.release()
+
+    def _spend(self):
+        self._lock.acquire()
+        try:
+            if self.budget < 1:
+                return False
+            self.budget -= 1
+            return True
+        finally:
+            self._lock.release()
+
+
+def _retry_after(e):
+    """Returns the seconds in the Retry-After header of HTTPError `e`."""
+    value = (getattr(e, 'hdrs', None) or {}).get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(mktime_tz(date) - time.time(), 0)
+
+_retry_policy = None
+_retry_policy_lock = threading.Lock()
+
+def retry_policy():
+    """
+    Returns the RetryPolicy shared by this process.
+
+    It is configured by the settings DJANGO_OAUTH_TWITTER_RETRY_TRIES,
+    _RETRY_BASE_DELAY, _RETRY_MAX_DELAY, _RETRY_BUDGET_RATIO and
+    _RETRY_BUDGET_MAX, which default to RetryPolicy's arguments.
+    """
+    global _retry_policy
+    _retry_policy_lock.acquire()
+    try:
+        if _retry_policy is None:
+            options = {}
+            for name, setting in [('max_tries', 'TRIES'),
+                                  ('base_delay', 'BASE_DELAY'),
+                                  ('max_delay', 'MAX_DELAY'),
+                                  ('budget_ratio', 'BUDGET_RATIO'),
+                                  ('budget_max', 'BUDGET_MAX')]:
+                setting = 'DJANGO_OAUTH_TWITTER_RETRY_' + setting
+                if hasattr(settings, setting):
+                    options[name] = getattr(settings, setting)
+            _retry_policy = RetryPolicy(breaker=circuit_breaker(), **options)
+        return _retry_policy
+    finally:
+        _retry_policy_lock.release()
+
+
+class CircuitBreaker(object):
+    """
+    Fails calls to Twitter fast, while Twitter is down.
+
+    After `threshold` failures within `window` seconds, the circuit
+    opens: for the next `cooldown` seconds, calls raise
+    TwitterUnavailable without trying Twitter.  Then one call is let
+    through to probe Twitter.  If it succeeds, the circuit closes;
+    otherwise it opens for another `cooldown` seconds.
+
+    The state is kept in `cache_backend`, which defaults to Django's
+    cache, so that every process agrees on it.  Failures are server
+    errors, and errors without a response, such as timeouts.
+    """
+
+    def __init__(self, threshold=5, window=30, cooldown=30,
+                 cache_backend=None, key_prefix='django_oauth_twitter:circuit'):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        if cache_backend is None:
+            cache_backend = cache
+        self.cache = cache_backend
+        self.key_prefix = key_prefix
+
+    def call(self, f, *args, **kwargs):
+        """Returns `f(*args, **kwargs)`, unless the circuit is open."""
+        probing = self._allow()
+        try:
+            result = f(*args, **kwargs)
+        except URLError, e:
+            if isinstance(e, HTTPError) and e.code < 500:
+                # Twitter answered; it is up.
+                self._succeeded(probing)
+            else:
+                self._failed(probing)
+            raise
+        self._succeeded(probing)
+        return result
+
+    def is_open(self):
+        """Returns True if calls are failing fast."""
+        opened_until = self.cache.get(self._key('open'))
+        return opened_until is not None and time.time() < opened_until
+
+    def _allow(self):
+        """
+        Raises TwitterUnavailable if the circuit is open.
+
+        Returns True if this call probes a circuit whose cooldown is
+        over.
+        """
+        opened_until = self.cache.get(self._key('open'))
+        if opened_until is None:
+            return False
+        if (time.time() < opened_until or
+            not self.cache.add(self._key('probe'), True, self.cooldown)):
+            raise TwitterUnavailable()
+        return True
+
+    def _succeeded(self, probing):
+        if probing:
+            self.cache.delete(self._key('open'))
+            self.cache.delete(self._key('failures'))
+            self.cache.delete(self._key('probe'))
+
+    def _failed(self, probing):
+        key = self._key('failures')
+        if self.cache.add(key, 1, self.window):
+            failures = 1
+        else:
             try:
-                return f(*args, **kwargs)
-            except HTTPError, e:
-                if e.code != 503:
-                    # Retry when Service Temporarily Unavailable
-                    raise
-            except URLError, e:
-                errno = getattr(e.reason, 'args', [None])[0]
-                if errno != 8:
-                    # Retry when EOF occurred in violation of protocol
-                    raise
-        return f(*args, **kwargs)
+                failures = self.cache.incr(key)
+            except ValueError:
+                # The count expired since add().
+                self.cache.add(key, 1, self.window)
+                failures = 1
+        if probing or failures >= self.threshold:
+            self._open()
+
+    def _open(self):
+        # Keep the state past the cooldown, so the next call probes.
+        self.cache.set(self._key('open'), time.time() + self.cooldown,
+                       self.cooldown + self.window)
+        self.cache.delete(self._key('failures'))
+        self.cache.delete(self._key('probe'))
+
+    def _key(self, name):
+        return '%s:%s' % (self.key_prefix, name)
+
+
+class TwitterUnavailable(URLError):
+    """Raised instead of calling Twitter, while the circuit is open."""
+
+    def __init__(self):
+        URLError.__init__(self, 'Twitter is unavailable')
+
+
+_circuit_breaker = None
+
+def circuit_breaker():
+    """
+    Returns the CircuitBreaker used by retry_policy(), or None.
+
+    It is configured by the settings
+    DJANGO_OAUTH_TWITTER_BREAKER_THRESHOLD, _BREAKER_WINDOW and
+    _BREAKER_COOLDOWN, which default to CircuitBreaker's arguments.  A
+    threshold of 0 turns it off.
+    """
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        options = {}
+        for name, setting in [('threshold', 'THRESHOLD'),
+                              ('window', 'WINDOW'),
+                              ('cooldown', 'COOLDOWN')]:
+            setting = 'DJANGO_OAUTH_TWITTER_BREAKER_' + setting
+            if hasattr(settings, setting):
+                options[name] = getattr(settings, setting)
+        if options.get('threshold') == 0:
+            return None
+        _circuit_breaker = CircuitBreaker(**options)
+    return _circuit_breaker
+
+def fail_whale(f, policy=None):
+    """
+    Returns a version of `f` that is retried when Twitter is
+    temporarily unavailable.
+
+    `policy` defaults to the shared retry_policy(), looked up on each
+    call, so that `f` can be wrapped before settings are configured.
+    """
+    if policy is not None:
+        return policy(f)
+    def wrapper(*args, **kwargs):
+        return retry_policy()(f)(*args, **kwargs)
+    return update_wrapper(wrapper, f)
+
+def fail_whale_async(f, pool=None, policy=None):
+    """
+    Returns a version of `f` that runs on `pool` and returns a Future.
+
+    Like fail_whale(), the call is retried by `policy` when Twitter is
+    temporarily unavailable.  `pool` defaults to the shared
+    pool.default_pool().
+    """
+    f = fail_whale(f, policy)
+    def wrapper(*args, **kwargs):
+        return (pool or default_pool()).submit(f, *args, **kwargs)
     return update_wrapper(wrapper, f)
 
 @fail_whale
 def get_user_info(access_token):
     return TwitterApi(access_token).GetUserInfo()
 
+def id_pages(method, **kwargs):
+    """
+    Yields each page of ids returned by the cursored API `method`.
+    """
+    cursor = -1
+    while cursor:
+        page = fail_whale(method)(cursor=cursor, **kwargs)
+        yield page['ids']
+        cursor = page.get('next_cursor')
+
+
+class AsyncTwitterApi(object):
+    """
+    Calls Twitter without blocking, returning a Future for each call.
+
+        api = AsyncTwitterApi(token)
+        userinfo, friend_ids = api.GetUserInfo(), api.GetFriendIDs()
+        print userinfo.result().screen_name, len(friend_ids.result())
+
+    Each call is made on a WorkerPool by the wrapped `api`, so it is
+    signed and cached just like a blocking call to `api`.  Calls are
+    retried with fail_whale().
+    """
+
+    def __init__(self, token=None, api=None, pool=None):
+        """
+        `api` defaults to TwitterApi(`token`).  Wrap it in
+        DjangoCachedApi to cache responses.
+
+        `pool` defaults to the shared pool.default_pool().
+        """
+        if api is None:
+            api = TwitterApi(token)
+        self.api = api
+        self.pool = pool
+
+    def call(self, method, *args, **kwargs):
+        """Calls the API `method`, by name, and returns a Future."""
+        return fail_whale_async(getattr(self.api, method),
+                                self.pool)(*args, **kwargs)
+
+    def GetUserInfo(self, *args, **kwargs):
+        """Returns a Future twitter.User of the authenticated user."""
+        return self.call('GetUserInfo', *args, **kwargs)
+
+    def getRequestToken(self, *args, **kwargs):
+        """Returns a Future OAuthToken with a new request token."""
+        return self.call('getRequestToken', *args, **kwargs)
+
+    def getAccessToken(self, *args, **kwargs):
+        """
+        Returns a Future OAuthToken with the access token exchanged for
+        the authorized request token that `api` was created with.
+        """
+        return self.call('getAccessToken', *args, **kwargs)
+
+    def GetFriendIDs(self, **kwargs):
+        """Returns a Future list of all friend ids, from every page."""
+        return self._ids(self.api.GetFriendIDs, **kwargs)
+
+    def GetFollowerIDs(self, **kwargs):
+        """Returns a Future list of all follower ids, from every page."""
+        return self._ids(self.api.GetFollowerIDs, **kwargs)
+
+    def _ids(self, method, **kwargs):
+        def ids():
+            result = []
+            for page in id_pages(method, **kwargs):
+                result.extend(page)
+            return result
+        return (self.pool or default_pool()).submit(ids)
+
+
+def token_digest(token):
+    """
+    Returns a fixed-width digest of the OAuth `token`.
+
+    Use it to refer to a token, such as in cache keys, without
+    revealing its secret.
+    """
+    return sha1(str(token)).hexdigest()
+
+USERINFO_ZLIB_PREFIX = 'zlib:'
+
+def encode_userinfo_json(json):
+    """
+    Returns the Twitter user info `json` encoded for storage.
+
+    The JSON is stripped of whitespace, and compressed if it is at
+    least settings.DJANGO_OAUTH_TWITTER_USERINFO_COMPRESS_THRESHOLD
+    bytes long.
+    """
+    return encode_userinfo_dict(simplejson.loads(json))
+
+def encode_userinfo_dict(userinfo_dict):
+    """
+    Returns the Twitter user info `userinfo_dict` encoded for storage.
+
+    See encode_userinfo_json().
+    """
+    json = simplejson.dumps(userinfo_dict, separators=(',', ':'),
+                            sort_keys=True)
+    threshold = getattr(settings,
+                        'DJANGO_OAUTH_TWITTER_USERINFO_COMPRESS_THRESHOLD',
+                        None)
+    if threshold is not None and len(json) >= threshold:
+        return USERINFO_ZLIB_PREFIX + base64.b64encode(zlib.compress(json))
+    return json
+
+def decode_userinfo_json(data):
+    """Returns the Twitter user info JSON stored as `data`."""
+    if data.startswith(USERINFO_ZLIB_PREFIX):
+        return zlib.decompress(
+            base64.b64decode(data[len(USERINFO_ZLIB_PREFIX):])
+        )
+    return data
+
 def _host(netloc):
     return netloc.split(':')[0]
 
@@ -18,8 +18,9 @@ except ImportError:
 else:
     login_required_m = method_decorator(login_required)
 
+from django_oauth_twitter.backends import TwitterBackend
 from django_oauth_twitter.forms import RegistrationForm
-from django_oauth_twitter.middleware import (cached_user_info,
+from django_oauth_twitter.middleware import (fetch_user_info,
                                              get_success_url,
                                              remove_tokens,
                                              set_access_token,
@@ -28,8 +29,10 @@ from django_oauth_twitter.models import (TwitterUser, TwitterAlreadyLinked,
                                          UserAlreadyLinked)
 from django_oauth_twitter.signals import (twitter_user_associated,
                                           twitter_user_unassociated)
-from django_oauth_twitter.utils import (fail_whale, login_redirect_url,
-                                        next_url, TwitterApi, update_qs)
+from django_oauth_twitter.utils import (circuit_breaker, fail_whale,
+                                        login_redirect_url, next_url,
+                                        TwitterApi,
+                                        TwitterUnavailable, update_qs)
 
 from oauth.oauth import OAuthToken
 
@@ -151,9 +154,15 @@ class OAuthTwitter(object):
                 # we're unauthorized.
                 return HttpResponseRedirect(reverse('twitter_signin'))
             raise
+        except TwitterUnavailable:
+            return self._twitter_unavailable(request=request)
         set_access_token(request, access_token)
-        # Funnel the user into the site.
-        userinfo = cached_user_info(request, access_token)
+        # Funnel the user into the site, by the account Twitter says the
+        # access token belongs to.
+        try:
+            userinfo = fetch_user_info(request, access_token)
+        except TwitterUnavailable:
+            return self._twitter_unavailable(request=request)
         if request.user.is_anonymous():
             # Find the User by the access token.
             user = self._authenticate(userinfo=userinfo)
@@ -161,7 +170,7 @@ class OAuthTwitter(object):
                 # New user
                 return self._on_new_user(request=request)
             return self._login_and_redirect(request=request, user=user)
-        return self._add_association(request, access_token)
+        return self._add_association(request, access_token, userinfo)
 
     def signin(self, request, success_url=None):
         """
@@ -177,7 +186,10 @@ class OAuthTwitter(object):
             success_url = str(LazyReverse(success_url))
         # Get a request token.
         twitter = TwitterApi()
-        request_token = fail_whale(twitter.getRequestToken)()
+        try:
+            request_token = fail_whale(twitter.getRequestToken)()
+        except TwitterUnavailable:
+            return self._twitter_unavailable(request=request)
         # Save success_url, along with the request token, in the session.
         set_request_token(request, request_token, success_url)
         # Redirect to Twitter's sign in URL.
@@ -235,25 +247,26 @@ class OAuthTwitter(object):
         """
         if userinfo is None:
             return None
-        try:
-            user = TwitterUser.objects.get(twitter_id=userinfo.id).user
-        except TwitterUser.DoesNotExist:
-            return None
-        return user
+        return TwitterBackend().authenticate(twitter_id=userinfo.id)
 
     def _check_for_revocation(self, request):
         """
         Checks to see if `request.user` has revoked Twitter OAuth.
 
         If the TwitterUser has been revoked by Twitter, _unassociate()
-        the credentials we have on file.
+        the credentials we have on file.  While Twitter is unavailable,
+        the check is skipped.
         """
         try:
             twitter_user = request.user.twitter
         except TwitterUser.DoesNotExist:
             pass
         else:
-            if twitter_user.is_revoked():
+            try:
+                revoked = twitter_user.is_revoked()
+            except TwitterUnavailable:
+                return
+            if revoked:
                 self._unassociate(request, raw=True)
 
     def _create_user(self, request):
@@ -278,9 +291,10 @@ class OAuthTwitter(object):
         return self._login_and_redirect(request=request, user=user)
 
     def _login(self, request, user):
-        # Nasty but necessary - annotate user and pretend it was the regular
-        # auth backend. This is needed so django.contrib.auth.get_user works:
-        user.backend = 'django.contrib.auth.backends.ModelBackend'
+        # Annotate user with the backend that django.contrib.auth.get_user
+        # loads them with on later requests.  It loads the User and their
+        # TwitterUser together.
+        user.backend = 'django_oauth_twitter.backends.TwitterBackend'
         login(request, user)
 
     def _login_and_redirect(self, request, user):
@@ -332,17 +346,39 @@ class OAuthTwitter(object):
         """Redirect to settings.LOGIN_REDIRECT_URL."""
         return HttpResponseRedirect(login_redirect_url())
 
-    def _add_association(self, request, access_token):
+    def _twitter_unavailable(self, request,
+                             template='django_oauth_twitter/unavailable.html'):
+        """
+        Returns a 503 response, as Twitter is unavailable.
+
+        The response asks clients to retry once the CircuitBreaker
+        lets calls through again.
+        """
+        response = render_to_response(
+            template, context_instance=RequestContext(request)
+        )
+        response.status_code = 503
+        breaker = circuit_breaker()
+        if breaker is not None:
+            response['Retry-After'] = str(breaker.cooldown)
+        return response
+
+    def _add_association(self, request, access_token, userinfo=None):
         """
         Adds an association for `access_token` to `request.user`.
 
-        Returns an HttpResponse.
+        `userinfo` is the user info just fetched with `access_token`, if
+        any.  Returns an HttpResponse, a 503 if Twitter is unavailable.
         """
         success_url = get_success_url(request=request)
         if success_url is None:
             success_url = login_redirect_url()
         try:
-            self._associate(request, access_token)
+            if userinfo is None:
+                userinfo = fetch_user_info(request, access_token)
+            self._associate(request, access_token, userinfo)
+        except TwitterUnavailable:
+            return self._twitter_unavailable(request=request)
         except UserAlreadyLinked:
             return HttpResponseRedirect(
                 update_qs(success_url,
@@ -350,7 +386,6 @@ class OAuthTwitter(object):
                            'user': request.user.username})
             )
         except TwitterAlreadyLinked:
-            userinfo = cached_user_info(request, access_token)
             return HttpResponseRedirect(
                 update_qs(success_url,
                           {'error': 'twitter_already_linked',
@@ -382,12 +417,19 @@ class OAuthTwitter(object):
             if not fail_silently:
                 raise
 
-    def _associate(self, request, access_token):
-        """Returns the TwitterUser just associated with `request.user`."""
+    def _associate(self, request, access_token, userinfo=None):
+        """
+        Returns the TwitterUser just associated with `request.user`.
+
+        `userinfo` must have been fetched from Twitter with
+        `access_token`.  If it is None, it is fetched now.
+        """
+        if userinfo is None:
+            userinfo = fetch_user_info(request, access_token)
         twitter_user = TwitterUser.objects.create_twitter_user(
             user=request.user,
             access_token=access_token,
-            userinfo=cached_user_info(request, access_token)
+            userinfo=userinfo
         )
         twitter_user_associated.send(sender=self.__class__,
                                      twitter_user=twitter_user)
@@ -401,6 +443,7 @@ class OAuthTwitter(object):
         remove_tokens(request)
         try:
             screen_name = user.twitter.screen_name
+            user.twitter.invalidate_cache()
             user.twitter.delete()
             del user._twitter_cache
             if not raw:
@@ -20,7 +20,10 @@ Features include:
     author='Akoha Inc.',
     author_email='adminmail@akoha.com',
     url='http://bitbucket.org/akoha/django-oauth-twitter/',
-    packages=['django_oauth_twitter', 'django_oauth_twitter.migrations'],
+    packages=['django_oauth_twitter',
+              'django_oauth_twitter.management',
+              'django_oauth_twitter.management.commands',
+              'django_oauth_twitter.migrations'],
     package_data={
         'django_oauth_twitter': ['templates/django_oauth_twitter/*.html'],
     },